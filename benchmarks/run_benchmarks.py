@@ -0,0 +1,216 @@
+# run from the repository root:
+#   python -m benchmarks.run_benchmarks --scale game,night
+#   python -m benchmarks.run_benchmarks --scale season --save-baseline benchmarks/baseline.json
+import contextlib
+import getopt
+import io
+import json
+import os
+import sys
+import time
+
+import nhl_on_ice
+import nhl_shifts
+from benchmarks import synthetic
+
+# games per scale: one game, a busy night, and a full regular season
+SCALES = {"game": 1, "night": 15, "season": 1312}
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+STAGES = [
+    "parse_shift_charts",
+    "parse_player_stats",
+    "parse_time_on_ice",
+    "repair_shifts",
+    "calculate_toi_deployments",
+    "make_on_ice_index",
+    "calculate_lines",
+    "determine_forward_positions",
+]
+
+
+@contextlib.contextmanager
+def timed(stage_times, stage):
+    start = time.perf_counter()
+    yield
+    stage_times[stage] += time.perf_counter() - start
+
+
+def run_game(fixtures, game, stage_times):
+    home_id = game["home"]
+    away_id = game["away"]
+
+    # inputs the stages need but we don't time
+    home_players = nhl_shifts.parse_records_team_players(
+        json.loads(fixtures["home_players"])
+    )
+    away_players = nhl_shifts.parse_records_team_players(
+        json.loads(fixtures["away_players"])
+    )
+
+    with timed(stage_times, "parse_shift_charts"):
+        shifts = nhl_shifts.parse_shift_charts_data(
+            io.BytesIO(fixtures["shift_charts"])
+        )
+
+    with timed(stage_times, "parse_player_stats"):
+        player_stats = nhl_shifts.parse_player_stats(io.BytesIO(fixtures["live_feed"]))
+
+    with timed(stage_times, "parse_time_on_ice"):
+        nhl_shifts.parse_time_on_ice_report(fixtures["home_time_on_ice"], home_players)
+        nhl_shifts.parse_time_on_ice_report(fixtures["away_time_on_ice"], away_players)
+
+    with timed(stage_times, "repair_shifts"):
+        shifts = nhl_shifts.repair_shifts(shifts)
+
+    goalie_ids = nhl_shifts.get_goalie_ids(home_players, away_players)
+    with timed(stage_times, "calculate_toi_deployments"):
+        toi_deploy = nhl_shifts.calculate_toi_deployments(shifts, goalie_ids)
+
+    with timed(stage_times, "make_on_ice_index"):
+        nhl_on_ice.make_on_ice_index(shifts, goalie_ids)
+
+    for team_id, players in ((home_id, home_players), (away_id, away_players)):
+        with timed(stage_times, "calculate_lines"):
+            nhl_shifts.calculate_lines(toi_deploy[team_id], players, player_stats)
+
+        # every three forward even strength deployment, as calculate_lines may
+        # ask for
+        forward_lines = []
+        team_deployments = toi_deploy[team_id]
+        for deployment in team_deployments["icetime"].get("5v5", {}):
+            forwards = [
+                p
+                for p in nhl_shifts.get_line_players(
+                    deployment, team_deployments["player_ids"]
+                )
+                if players.get(p, {}).get("position") in ("C", "L", "R")
+            ]
+            if len(forwards) == 3:
+                forward_lines.append(forwards)
+
+        with timed(stage_times, "determine_forward_positions"):
+            for forwards in forward_lines:
+                nhl_shifts.determine_forward_positions(forwards, players, player_stats)
+
+    return sum(len(shifts[team_id]["start"]) for team_id in shifts)
+
+
+def run_scale(scale, seed):
+    stage_times = {stage: 0.0 for stage in STAGES}
+    shift_count = 0
+
+    # generate one game at a time so a season never sits in memory
+    for k in range(SCALES[scale]):
+        game = synthetic.generate_game(seed + k, game_id=2018020001 + k)
+        fixtures = synthetic.make_fixtures(game, seed + k)
+
+        # the pipeline prints as it goes, which isn't what we're measuring
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            shift_count += run_game(fixtures, game, stage_times)
+
+    return {"games": SCALES[scale], "shifts": shift_count, "stages": stage_times}
+
+
+def print_results(results, baseline):
+    print(
+        "{:<8} {:<28} {:>10} {:>12} {:>14} {:>10}".format(
+            "scale", "stage", "seconds", "games/s", "shifts/s", "baseline"
+        )
+    )
+
+    for scale, result in results.items():
+        for stage, seconds in result["stages"].items():
+            games_per_second = result["games"] / seconds if seconds else 0
+            shifts_per_second = result["shifts"] / seconds if seconds else 0
+
+            # ratio against the saved run, above 1 means slower than before
+            comparison = ""
+            baseline_seconds = baseline.get(scale, {}).get("stages", {}).get(stage)
+            if baseline_seconds:
+                comparison = "x{:.2f}".format(seconds / baseline_seconds)
+
+            print(
+                "{:<8} {:<28} {:>10.4f} {:>12.1f} {:>14.0f} {:>10}".format(
+                    scale,
+                    stage,
+                    seconds,
+                    games_per_second,
+                    shifts_per_second,
+                    comparison,
+                )
+            )
+
+
+def main():
+    unixOptions = "b:hs:"
+    gnuOptions = ["baseline=", "fixtures=", "help", "save-baseline=", "scale=", "seed="]
+
+    try:
+        arguments, values = getopt.getopt(sys.argv[1:], unixOptions, gnuOptions)
+    except getopt.error as err:
+        # output error, and return with an error code
+        print(str(err))
+        sys.exit(2)
+
+    scales = ["game", "night"]
+    seed = 2018
+    baseline_path = DEFAULT_BASELINE
+    save_baseline_path = None
+    fixtures_directory = None
+    for currentArgument, currentValue in arguments:
+        if currentArgument in ("-h", "--help"):
+            print(
+                "usage: python -m benchmarks.run_benchmarks [--scale game,night,season]"
+            )
+            print(
+                "       [--seed N] [--baseline FILE] [--save-baseline FILE] [--fixtures DIR]"
+            )
+            return
+        elif currentArgument in ("-s", "--scale"):
+            scales = currentValue.split(",")
+        elif currentArgument == "--seed":
+            seed = int(currentValue)
+        elif currentArgument in ("-b", "--baseline"):
+            baseline_path = currentValue
+        elif currentArgument == "--save-baseline":
+            save_baseline_path = currentValue
+        elif currentArgument == "--fixtures":
+            fixtures_directory = currentValue
+
+    # write a single game's shift charts, rosters, live feed and TH/TV reports
+    if fixtures_directory:
+        game = synthetic.generate_game(seed)
+        synthetic.write_fixtures(
+            synthetic.make_fixtures(game, seed), game["game_id"], fixtures_directory
+        )
+        print(
+            "wrote fixtures for game_id={} to {}".format(
+                game["game_id"], fixtures_directory
+            )
+        )
+        return
+
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+    results = {}
+    for scale in scales:
+        results[scale] = run_scale(scale, seed)
+
+    print_results(results, baseline)
+
+    if save_baseline_path:
+        # keep scales we didn't rerun this time
+        saved = dict(baseline) if save_baseline_path == baseline_path else {}
+        saved.update(results)
+        with open(save_baseline_path, "w") as f:
+            json.dump(saved, f, indent=2, sort_keys=True)
+        print("saved baseline to {}".format(save_baseline_path))
+
+
+if __name__ == "__main__":
+    main()
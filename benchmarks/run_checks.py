@@ -0,0 +1,1043 @@
+# run from the repository root:
+#   python -m benchmarks.run_checks
+#   python -m benchmarks.run_checks --games 50 --seed 7
+#
+# compares the fast paths against slow, obviously correct versions on
+# synthetic games, exits non-zero if any of them disagree
+import contextlib
+import getopt
+import gzip
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import unicodedata
+from http import server
+
+import numpy as np
+import requests
+
+import nhl_archive
+import nhl_cache
+import nhl_client
+import nhl_fetch
+import nhl_metrics
+import nhl_on_ice
+import nhl_shift_table
+import nhl_shifts
+from benchmarks import synthetic
+
+# seconds between live polls, and how many polls late a few shifts show up
+POLL_INTERVAL = 30
+MAX_LATE_POLLS = 3
+LATE_SHIFTS = 5
+
+# the teams in each archived game, team 1 plays in more than one
+ARCHIVE_GAMES = [(1, 2), (3, 1), (2, 3)]
+
+# how the local server fails each path (None hangs up), and how many
+# requests to it fail before it answers (None for all of them)
+FLAKY_PATHS = {
+    "/ok": (200, 0),
+    "/unavailable": (503, 1),
+    "/throttled": (429, 1),
+    "/dropped": (None, 2),
+    "/missing": (404, None),
+    "/down": (503, None),
+}
+
+
+def load_game(seed):
+    game = synthetic.generate_game(seed)
+    shift_charts = json.loads(synthetic.make_shift_charts(game))["data"]
+    rosters = {}
+    for team_id in (game["home"], game["away"]):
+        rosters[team_id] = nhl_shifts.parse_records_team_players(
+            json.loads(synthetic.make_records_roster(game, team_id))
+        )
+    player_stats = nhl_shifts.parse_player_stats(
+        io.BytesIO(synthetic.make_live_feed(game, seed))
+    )
+
+    return game, shift_charts, rosters, player_stats
+
+
+def parse_records(records):
+    data = json.dumps({"data": records}).encode("utf-8")
+    with contextlib.redirect_stdout(io.StringIO()):
+        return nhl_shifts.parse_shift_charts_data(io.BytesIO(data))
+
+
+def add_bad_shifts(rng, shift_tables):
+
+    # repeat some shifts, and stretch copies of others over the next ones
+    bad_tables = {}
+    for team_id, shift_table in shift_tables.items():
+        rows = rng.sample(range(len(shift_table["start"])), 20)
+        bad_table = {"player_ids": shift_table["player_ids"]}
+        for column in ("player", "period", "start", "end"):
+            extra = shift_table[column][rows]
+            if column == "end":
+                stretched = extra + 30
+            else:
+                stretched = extra
+            bad_table[column] = np.concatenate((shift_table[column], extra, stretched))
+        bad_tables[team_id] = nhl_shift_table.sort_shift_table(bad_table)
+
+    return bad_tables
+
+
+def get_shift_rows(shift_tables):
+
+    # every shift as (start, end, player_id, team_id)
+    rows = []
+    for team_id, shift_table in shift_tables.items():
+        player_ids = shift_table["player_ids"][shift_table["player"]]
+        rows.extend(
+            zip(
+                shift_table["start"].tolist(),
+                shift_table["end"].tolist(),
+                player_ids.tolist(),
+                [team_id] * len(player_ids),
+            )
+        )
+
+    return rows
+
+
+def get_on_ice(rows, time):
+    on_ice = {}
+    for start, end, player_id, team_id in rows:
+        if start <= time < end:
+            on_ice.setdefault(team_id, set()).add(player_id)
+
+    return on_ice
+
+
+def brute_force_deployments(shift_tables, goalie_ids):
+
+    # who is on the ice for each second between change points, one at a time
+    rows = get_shift_rows(shift_tables)
+    times = sorted({row[0] for row in rows} | {row[1] for row in rows})
+    home_id, away_id = shift_tables
+
+    deployments = {team_id: {} for team_id in shift_tables}
+    for start, end in zip(times, times[1:]):
+        on_ice = get_on_ice(rows, start)
+        if not on_ice:
+            continue
+
+        counts = {}
+        for team_id in shift_tables:
+            players = on_ice.get(team_id, set())
+            goalies = len(players & goalie_ids)
+            counts[team_id] = (len(players) - goalies, goalies)
+
+        for team_id, opposing_id in ((home_id, away_id), (away_id, home_id)):
+            strength = nhl_on_ice.get_strength(*counts[team_id], *counts[opposing_id])
+            line = frozenset(on_ice.get(team_id, set()))
+            icetime = deployments[team_id].setdefault(strength, {})
+            icetime[line] = icetime.get(line, 0) + end - start
+
+    return deployments
+
+
+def normalize_deployments(team_deployments):
+
+    # line masks depend on the order players were seen, compare the players
+    deployments = {}
+    for strength, icetime in team_deployments["icetime"].items():
+        for line, seconds in icetime.items():
+            players = frozenset(
+                nhl_shifts.get_line_players(line, team_deployments["player_ids"])
+            )
+            strength_icetime = deployments.setdefault(strength, {})
+            strength_icetime[players] = strength_icetime.get(players, 0) + seconds
+
+    return deployments
+
+
+def brute_force_toi(rows, start, end):
+
+    # overlapping shifts of the same player only count once
+    toi = {}
+    for second in range(start, end):
+        for players in get_on_ice(rows, second).values():
+            for player_id in players:
+                toi[player_id] = toi.get(player_id, 0) + 1
+
+    return toi
+
+
+def vary_name(rng, name):
+
+    # the ways a report's heading can differ from the roster's spelling
+    variant = rng.randrange(6)
+    if variant == 0:
+        name = unicodedata.normalize("NFKD", name)
+        name = "".join(c for c in name if not unicodedata.combining(c))
+    elif variant == 1:
+        name = name.replace("-", " ")
+    elif variant == 2:
+        name = name.replace(".", "")
+    elif variant == 3:
+        name = name.replace("'", "\u2019")
+    elif variant == 4:
+        name = rng.choice(["Alex", "Matt", "Zach"])
+
+    return name.upper()
+
+
+def fold_name(name):
+
+    # no accents, periods or apostrophes, hyphens as spaces, in lower case
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    for c in ".'\u2019":
+        name = name.replace(c, "")
+    for c in "-\u2010\u2013":
+        name = name.replace(c, " ")
+
+    return " ".join(name.lower().split())
+
+
+def brute_force_find_player_id(number, first_name, last_name, players):
+
+    # every rule of find_player_id as a scan of the roster
+    number = int(number)
+    name = fold_name("{} {}".format(first_name, last_name))
+    last_name = fold_name(last_name)
+
+    numbered_players = [
+        player_id
+        for player_id, player in players.items()
+        if number != 0 and int(player["number"] or 0) == number
+    ]
+    named_players = [
+        player_id
+        for player_id, player in players.items()
+        if fold_name(player["name"]) == name
+    ]
+    if len(named_players) > 1:
+        named_players = [p for p in named_players if p in numbered_players]
+    last_named_players = [
+        player_id
+        for player_id in numbered_players
+        if fold_name(players[player_id]["name"]).endswith(" " + last_name)
+    ]
+
+    for candidates in (named_players, last_named_players, numbered_players):
+        if len(candidates) == 1:
+            return candidates[0]
+
+    return 0
+
+
+def check_roster_index(rng, seed, trials):
+    failures = []
+    for trial in range(trials):
+
+        # small name pools, so players share names and last names
+        roster = synthetic.make_roster(rng, 1)
+        players = {}
+        for player in roster:
+            players[player["id"]] = {
+                "name": "{} {}".format(player["firstName"], player["lastName"]),
+                "number": rng.choice([player["number"]] * 5 + [0]),
+                "position": player["position"],
+            }
+        roster_index = nhl_shifts.build_roster_index(players)
+
+        for player in roster:
+            number = rng.choice([player["number"]] * 3 + [rng.randint(0, 99)])
+            first_name = vary_name(rng, player["firstName"])
+            last_name = vary_name(rng, player["lastName"])
+            # a misspelled last name, leaving only the number
+            if rng.random() < 0.2:
+                last_name = "ZZ"
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                player_id = nhl_shifts.find_player_id(
+                    number, first_name, last_name, roster_index
+                )
+            if player_id != brute_force_find_player_id(
+                number, first_name, last_name, players
+            ):
+                failures.append(
+                    "find_player_id trial={} {} {}, {}".format(
+                        trial, number, last_name, first_name
+                    )
+                )
+
+    # and a whole report resolves to the shifts it was made from
+    game, _, rosters, _ = load_game(seed)
+    for team_id in (game["home"], game["away"]):
+        with contextlib.redirect_stdout(io.StringIO()):
+            shift_table = nhl_shifts.parse_time_on_ice_report(
+                synthetic.make_time_on_ice_report(game, team_id), rosters[team_id]
+            )
+        shifts = sorted(
+            zip(
+                shift_table["player_ids"][shift_table["player"]].tolist(),
+                shift_table["period"].tolist(),
+                shift_table["start"].tolist(),
+                shift_table["end"].tolist(),
+            )
+        )
+        expected = sorted(
+            (
+                player_id,
+                period,
+                (period - 1) * nhl_shift_table.PERIOD_LENGTH + start,
+                (period - 1) * nhl_shift_table.PERIOD_LENGTH + end,
+            )
+            for shift_team_id, player_id, period, start, end in game["shifts"]
+            if shift_team_id == team_id
+        )
+        if shifts != expected:
+            failures.append(
+                "time on ice report seed={} team_id={}".format(seed, team_id)
+            )
+
+    return failures
+
+
+def check_sweep(rng, seed):
+    game, shift_charts, rosters, _ = load_game(seed)
+    goalie_ids = nhl_shifts.get_goalie_ids(*rosters.values())
+    shift_tables = add_bad_shifts(rng, parse_records(shift_charts))
+
+    expected = brute_force_deployments(shift_tables, goalie_ids)
+    swept = nhl_shifts.calculate_toi_deployments(shift_tables, goalie_ids)
+
+    failures = []
+    for team_id in shift_tables:
+        if normalize_deployments(swept[team_id]) != expected[team_id]:
+            failures.append("sweep seed={} team_id={}".format(seed, team_id))
+
+    return failures
+
+
+def check_on_ice_index(rng, seed):
+    game, shift_charts, rosters, _ = load_game(seed)
+    goalie_ids = nhl_shifts.get_goalie_ids(*rosters.values())
+    shift_tables = add_bad_shifts(rng, parse_records(shift_charts))
+    expected = brute_force_deployments(shift_tables, goalie_ids)
+
+    failures = []
+
+    # the on ice index, over the whole game and at points and windows in it
+    on_ice_index = nhl_on_ice.make_on_ice_index(shift_tables, goalie_ids)
+    times = on_ice_index["times"]
+    windowed = nhl_on_ice.window_deployments(on_ice_index, times[0], times[-1])
+    for team_id in shift_tables:
+        if normalize_deployments(windowed[team_id]) != expected[team_id]:
+            failures.append(
+                "window_deployments seed={} team_id={}".format(seed, team_id)
+            )
+
+    rows = get_shift_rows(shift_tables)
+    for _ in range(20):
+        time = rng.randint(int(times[0]) - 10, int(times[-1]) + 10)
+        on_ice = nhl_on_ice.on_ice_at(on_ice_index, time)
+        expected_on_ice = get_on_ice(rows, time)
+        for team_id in shift_tables:
+            if set(on_ice[team_id]) != expected_on_ice.get(team_id, set()):
+                failures.append("on_ice_at seed={} time={}".format(seed, time))
+
+        start = rng.randint(int(times[0]), int(times[-1]))
+        end = min(start + rng.randint(0, 600), int(times[-1]))
+        if nhl_on_ice.window_toi(on_ice_index, start, end) != brute_force_toi(
+            rows, start, end
+        ):
+            failures.append("window_toi seed={} {}-{}".format(seed, start, end))
+
+    return failures
+
+
+def brute_force_repair(shift_table):
+
+    # clip, drop, dedupe and merge one shift at a time
+    shifts = []
+    for player, period, start, end in zip(
+        shift_table["player"].tolist(),
+        shift_table["period"].tolist(),
+        shift_table["start"].tolist(),
+        shift_table["end"].tolist(),
+    ):
+        period_start = (period - 1) * nhl_shift_table.PERIOD_LENGTH
+        period_end = period_start + nhl_shift_table.PERIOD_LENGTH
+        start = min(max(start, period_start), period_end)
+        end = min(max(end, period_start), period_end)
+        if end > start:
+            shifts.append((player, period, start, end))
+
+    repaired = []
+    for shift in sorted(set(shifts)):
+        last = repaired[-1] if repaired else None
+        if last and last[0] == shift[0] and shift[2] < last[3]:
+            repaired[-1] = last[:3] + (max(last[3], shift[3]),)
+        else:
+            repaired.append(shift)
+
+    return repaired
+
+
+def check_repair(rng, trials):
+    failures = []
+    for trial in range(trials):
+
+        # shifts in and out of their periods, empty, backwards and overlapping
+        count = rng.randint(0, 40)
+        player_ids = [rng.randint(8470000, 8470010) for _ in range(count)]
+        periods = [rng.randint(1, 4) for _ in range(count)]
+        starts = [
+            (period - 1) * nhl_shift_table.PERIOD_LENGTH + rng.randint(-30, 1230)
+            for period in periods
+        ]
+        ends = [start + rng.randint(-20, 120) for start in starts]
+
+        # and some repeated exactly
+        for _ in range(rng.randint(0, 5) if count else 0):
+            row = rng.randrange(count)
+            for column in (player_ids, periods, starts, ends):
+                column.append(column[row])
+
+        shift_table = nhl_shift_table.make_shift_table(
+            player_ids, periods, starts, ends
+        )
+
+        repaired, _ = nhl_shift_table.repair_shift_table(shift_table)
+        shifts = sorted(
+            zip(
+                repaired["player"].tolist(),
+                repaired["period"].tolist(),
+                repaired["start"].tolist(),
+                repaired["end"].tolist(),
+            )
+        )
+        if (
+            shifts != brute_force_repair(shift_table)
+            or (np.diff(repaired["start"]) < 0).any()
+        ):
+            failures.append("repair trial={}".format(trial))
+
+    return failures
+
+
+def get_game_time(record, clock):
+    minutes, seconds = clock.split(":")
+    return (
+        (record["period"] - 1) * nhl_shift_table.PERIOD_LENGTH
+        + int(minutes) * 60
+        + int(seconds)
+    )
+
+
+def poll_shift_charts(shift_charts, time, late_polls, final):
+
+    # the shift charts as they'd read at time, shifts still going have no
+    # end yet and a few show up late
+    records = []
+    for record in shift_charts:
+        start = get_game_time(record, record["startTime"])
+        if start > time:
+            continue
+        if not final and time < start + late_polls.get(record["id"], 0) * POLL_INTERVAL:
+            continue
+
+        record = dict(record)
+        if get_game_time(record, record["endTime"]) > time:
+            record["endTime"] = ""
+        records.append(record)
+
+    return records
+
+
+def sort_line_rows(line_info):
+    return sorted(
+        line_info, key=lambda line: (line["state"], line["depth"], line["player_id"])
+    )
+
+
+def check_live(rng, seed):
+    game, shift_charts, rosters, player_stats = load_game(seed)
+    home_id = game["home"]
+    away_id = game["away"]
+    goalie_ids = nhl_shifts.get_goalie_ids(*rosters.values())
+    end = max(
+        (period - 1) * nhl_shift_table.PERIOD_LENGTH + length
+        for period, length in game["periods"]
+    )
+    late_polls = {
+        record["id"]: rng.randint(1, MAX_LATE_POLLS)
+        for record in rng.sample(shift_charts, LATE_SHIFTS)
+    }
+
+    failures = []
+    seen_shift_ids = set()
+    live_game_state = nhl_shifts.new_live_game_state([home_id, away_id], goalie_ids)
+    for time in list(range(POLL_INTERVAL, end, POLL_INTERVAL)) + [end]:
+        final = time == end
+        records = poll_shift_charts(shift_charts, time, late_polls, final)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            new_shifts, open_shifts = nhl_shifts.parse_new_shift_charts(
+                io.BytesIO(json.dumps({"data": records}).encode("utf-8")),
+                seen_shift_ids,
+            )
+            nhl_shifts.update_live_game(live_game_state, new_shifts, open_shifts)
+            if final and not open_shifts:
+                deployment_state = nhl_shifts.finish_deployments(
+                    live_game_state["deployment_state"]
+                )
+            else:
+                deployment_state = nhl_shifts.get_live_deployment_state(live_game_state)
+
+        # a batch sweep of the same records, the shifts in progress ending at
+        # the latest time the live state has seen
+        clock = live_game_state["clock"]
+        closed_records = []
+        for record in records:
+            if not record["endTime"]:
+                period_clock = (
+                    clock - (record["period"] - 1) * nhl_shift_table.PERIOD_LENGTH
+                )
+                record = dict(record, endTime=synthetic.format_clock(period_clock))
+            closed_records.append(record)
+        shift_tables = parse_records(closed_records)
+        for team_id in (home_id, away_id):
+            shift_tables.setdefault(
+                team_id, nhl_shift_table.make_shift_table([], [], [], [])
+            )
+        expected = nhl_shifts.calculate_toi_deployments(shift_tables, goalie_ids)
+
+        for team_id in (home_id, away_id):
+            live_deployments = nhl_shifts.get_team_deployments(
+                deployment_state, team_id
+            )
+            if normalize_deployments(live_deployments) != normalize_deployments(
+                expected[team_id]
+            ):
+                failures.append(
+                    "live seed={} time={} team_id={}".format(seed, time, team_id)
+                )
+
+    # and once it's over, the same lines as the batch run
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected_lines = nhl_shifts.calculate_game_lines(
+            home_id,
+            away_id,
+            parse_records(shift_charts),
+            rosters[home_id],
+            rosters[away_id],
+            player_stats,
+        )
+    for team_id in (home_id, away_id):
+        with contextlib.redirect_stdout(io.StringIO()):
+            live_lines = nhl_shifts.calculate_lines(
+                nhl_shifts.get_team_deployments(deployment_state, team_id),
+                rosters[team_id],
+                player_stats,
+            )
+        # a line lists its players in the order the sweep first saw them,
+        # which late shifts change, the rows written are the same
+        if sort_line_rows(live_lines) != sort_line_rows(expected_lines[team_id]):
+            failures.append("live lines seed={} team_id={}".format(seed, team_id))
+
+    return failures
+
+
+def drop_from_roster(fixtures, name, player_id):
+    roster = json.loads(fixtures[name])
+    roster["data"] = [player for player in roster["data"] if player["id"] != player_id]
+
+    return dict(fixtures, **{name: json.dumps(roster).encode("utf-8")})
+
+
+def process_fixtures(directory, game, teams, fixtures, known_hash=None):
+
+    # the network path, from the responses as they'd sit in the cache
+    sources = {}
+    for name in ("home_players", "away_players", "live_feed", "shift_charts"):
+        sources[name] = os.path.join(
+            directory, "{}-{}.gz".format(name, game["game_id"])
+        )
+        with gzip.open(sources[name], "wb") as f:
+            f.write(fixtures[name])
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return nhl_shifts.process_game(game["game_id"], teams, sources, known_hash)
+
+
+def rebuild_lines(game):
+    home_id, away_id = game["shifts"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        return nhl_shifts.calculate_game_lines(
+            home_id,
+            away_id,
+            game["shifts"],
+            game["players"][home_id],
+            game["players"][away_id],
+            game["player_stats"],
+        )
+
+
+def check_archived_games(archive, expected):
+    failures = []
+    season = nhl_archive.get_season(next(iter(expected)))
+
+    player_games = {}
+    for game_id, (archived_game, team_lines) in expected.items():
+        game = archive.load_game(game_id)
+
+        for team_id, shift_table in archived_game["shifts"].items():
+            player_ids = shift_table["player_ids"].tolist()
+            for column in ("player_ids", "player", "period", "start", "end"):
+                if not np.array_equal(
+                    game["shifts"][team_id][column], shift_table[column]
+                ):
+                    failures.append(
+                        "archive {} game_id={} team_id={}".format(
+                            column, game_id, team_id
+                        )
+                    )
+
+            # only the players on the roster come back as players
+            players = archived_game["players"][team_id]
+            expected_players = {
+                player_id: {
+                    "name": players[player_id]["name"],
+                    "position": players[player_id]["position"],
+                }
+                for player_id in player_ids
+                if player_id in players
+            }
+            if game["players"][team_id] != expected_players:
+                failures.append(
+                    "archive players game_id={} team_id={}".format(game_id, team_id)
+                )
+
+            for player_id in player_ids:
+                player_games.setdefault(player_id, []).append((game_id, team_id))
+
+        # the same lines as the network path
+        if rebuild_lines(game) != team_lines:
+            failures.append("archive lines game_id={}".format(game_id))
+
+    # the player index, against the games each player has shifts in
+    for player_id, games in player_games.items():
+        if archive.get_player_games(season, player_id) != sorted(games):
+            failures.append("get_player_games player_id={}".format(player_id))
+
+    return failures
+
+
+def check_archive(rng, seed):
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        archive_path = os.path.join(directory, "archive")
+        archive = nhl_archive.ShiftArchive(archive_path)
+
+        expected = {}
+        for k, (home_id, away_id) in enumerate(ARCHIVE_GAMES):
+            game = synthetic.generate_game(
+                seed + k, game_id=2018020001 + k, home_id=home_id, away_id=away_id
+            )
+            teams = {
+                "home": home_id,
+                "away": away_id,
+                "final": True,
+                "date": "2018-10-{:02d}".format(k + 1),
+            }
+            fixtures = synthetic.make_fixtures(game, seed + k)
+
+            # a skater with shifts who isn't on the roster (a late call up)
+            if k == 0:
+                skaters = [
+                    player["id"]
+                    for player in game["rosters"][home_id]
+                    if player["position"] != "G"
+                ]
+                fixtures = drop_from_roster(
+                    fixtures, "home_players", rng.choice(skaters)
+                )
+
+            team_lines, archived_game, _ = process_fixtures(
+                directory, game, teams, fixtures
+            )
+            expected[game["game_id"]] = (archived_game, team_lines)
+
+            # a part per game
+            archive.write_games({game["game_id"]: archived_game})
+
+        # and a re-run of the first, replacing its first part's copy
+        first_game_id = min(expected)
+        archive.write_games({first_game_id: expected[first_game_id][0]})
+        season = nhl_archive.get_season(first_game_id)
+
+        failures.extend(check_archived_games(archive, expected))
+
+        # and the same after compacting, read back by a new archive
+        archive.compact(season)
+        archive = nhl_archive.ShiftArchive(archive_path)
+        if len(archive.part_names(season)) != 1:
+            failures.append("compact left more than one part")
+        failures.extend(
+            "{} (compacted)".format(failure)
+            for failure in check_archived_games(archive, expected)
+        )
+
+    return failures
+
+
+def check_hashes(rng, seed):
+    failures = []
+    game = synthetic.generate_game(seed)
+    home_id = game["home"]
+    teams = {"home": home_id, "away": game["away"], "final": True, "date": "2018-10-01"}
+    fixtures = synthetic.make_fixtures(game, seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        team_lines, archived_game, input_hash = process_fixtures(
+            directory, game, teams, fixtures
+        )
+
+        # the same inputs again are skipped
+        skipped_lines, _, skipped_hash = process_fixtures(
+            directory, game, teams, fixtures, input_hash
+        )
+        if skipped_lines is not None or skipped_hash != input_hash:
+            failures.append("unchanged game not skipped seed={}".format(seed))
+
+        # a game read back from the archive hashes the same as when it was parsed
+        archive = nhl_archive.ShiftArchive(os.path.join(directory, "archive"))
+        archive.write_games({game["game_id"]: archived_game})
+        if (
+            nhl_shifts.hash_game_inputs(archive.load_game(game["game_id"]))
+            != input_hash
+        ):
+            failures.append("archived game hash seed={}".format(seed))
+
+    # and anything the lines read changes it: a shift, and a skater leaving
+    # the roster (which isn't the same as one with no position)
+    shift_table = dict(archived_game["shifts"][home_id])
+    shift_table["end"] = shift_table["end"].copy()
+    shift_table["end"][rng.randrange(len(shift_table["end"]))] -= 1
+    changed_shift = dict(archived_game, shifts=dict(archived_game["shifts"]))
+    changed_shift["shifts"][home_id] = shift_table
+
+    player_id = rng.choice(
+        [
+            player_id
+            for player_id, player in archived_game["players"][home_id].items()
+            if player["position"] != "G"
+        ]
+    )
+    unrostered = dict(archived_game["players"][home_id])
+    del unrostered[player_id]
+    no_position = dict(unrostered)
+    no_position[player_id] = {"name": "", "position": ""}
+
+    hashes = [input_hash, nhl_shifts.hash_game_inputs(changed_shift)]
+    for players in (unrostered, no_position):
+        changed_players = dict(archived_game, players=dict(archived_game["players"]))
+        changed_players["players"][home_id] = players
+        hashes.append(nhl_shifts.hash_game_inputs(changed_players))
+    if len(set(hashes)) != len(hashes):
+        failures.append("changed inputs, same hash seed={}".format(seed))
+
+    return failures
+
+
+def read_line_totals(cur):
+
+    # the season totals as upserted, and as recomputed from every game
+    cur.execute(
+        """SELECT season, team_id, state, unit, player_ids, time_on_ice, games,
+                  last_game_id, last_seen
+           FROM line_totals
+           ORDER BY season, team_id, state, unit, player_ids"""
+    )
+    totals = cur.fetchall()
+    cur.execute(
+        """SELECT season, team_id, state, unit, player_ids, SUM(time_on_ice),
+                  COUNT(*), MAX(game_id), MAX(game_date)
+           FROM line_games
+           GROUP BY season, team_id, state, unit, player_ids
+           ORDER BY season, team_id, state, unit, player_ids"""
+    )
+
+    return totals, cur.fetchall()
+
+
+def check_line_totals(seed):
+
+    # needs a database to write to, the tables go in a schema of their own
+    if "DATABASE_URL" not in os.environ:
+        return None
+
+    game_lines = {}
+    for k in range(3):
+        game, shift_charts, rosters, player_stats = load_game(seed + k)
+        with contextlib.redirect_stdout(io.StringIO()):
+            game_lines[2018020001 + k] = nhl_shifts.calculate_game_lines(
+                game["home"],
+                game["away"],
+                parse_records(shift_charts),
+                rosters[game["home"]],
+                rosters[game["away"]],
+                player_stats,
+            )
+    game_dates = {
+        game_id: "2018-10-{:02d}".format(game_id % 100) for game_id in game_lines
+    }
+    first_game_id, second_game_id, last_game_id = sorted(game_lines)
+
+    # the last game rewritten with only its even strength lines, so lines
+    # last seen in it are only seen in the earlier games
+    even_lines = {
+        team_id: [line for line in lines if line["state"] == "EVEN"]
+        for team_id, lines in game_lines[last_game_id].items()
+    }
+
+    steps = [
+        {first_game_id: game_lines[first_game_id]},
+        {
+            second_game_id: game_lines[second_game_id],
+            last_game_id: game_lines[last_game_id],
+        },
+        {last_game_id: even_lines},
+        {first_game_id: game_lines[first_game_id]},
+        {last_game_id: game_lines[last_game_id]},
+    ]
+
+    failures = []
+    schema = "run_checks_{}".format(os.getpid())
+    conn = nhl_shifts.connect_to_database()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("CREATE SCHEMA {}".format(schema))
+                cur.execute("SET search_path TO {}".format(schema))
+                with open("create_lines.sql") as f:
+                    cur.execute(f.read())
+
+        written = {}
+        for step, step_lines in enumerate(steps):
+            with contextlib.redirect_stdout(io.StringIO()):
+                nhl_shifts.write_lines_to_database(conn, step_lines, game_dates)
+            written.update(step_lines)
+
+            with conn:
+                with conn.cursor() as cur:
+                    totals, recomputed = read_line_totals(cur)
+                    if totals != recomputed:
+                        failures.append("line_totals step={}".format(step))
+
+                    cur.execute("SELECT game_id, COUNT(*) FROM lines GROUP BY game_id")
+                    expected_rows = {
+                        game_id: sum(len(lines) for lines in team_lines.values())
+                        for game_id, team_lines in written.items()
+                    }
+                    if dict(cur.fetchall()) != expected_rows:
+                        failures.append("lines step={}".format(step))
+    finally:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("DROP SCHEMA {} CASCADE".format(schema))
+        conn.close()
+
+    return failures
+
+
+class FlakyHandler(server.BaseHTTPRequestHandler):
+
+    # path -> requests seen, shared by every handler
+    request_counts = {}
+
+    def do_GET(self):
+        path, _, name = self.path.rpartition("/")
+        count = self.request_counts[self.path] = (
+            self.request_counts.get(self.path, 0) + 1
+        )
+        status, failing = FLAKY_PATHS[path]
+
+        # a status of None hangs up without answering
+        if failing is None or count <= failing:
+            if status is not None:
+                self.send_response(status)
+                self.send_header("Retry-After", "0")
+                self.end_headers()
+            return
+
+        body = name.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def get_expected_requests(status, failing):
+
+    # a 404 isn't retried, anything else is until it answers or we give up
+    if status == 404:
+        return 1
+    if failing is None:
+        return nhl_client.MAX_ATTEMPTS
+
+    return failing + 1
+
+
+def check_retries():
+    failures = []
+    given_up = [path for path, (_, failing) in FLAKY_PATHS.items() if failing is None]
+
+    # a throwaway response cache and metrics, put back afterwards
+    previous_cache = nhl_cache.cache
+    previous_metrics = nhl_metrics.collect()
+    flaky_server = server.ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    threading.Thread(target=flaky_server.serve_forever, daemon=True).start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            nhl_cache.cache = nhl_cache.ResponseCache(directory)
+            base = "http://127.0.0.1:{}".format(flaky_server.server_port)
+
+            # the async batch path, urls that failed for good are left out
+            urls = ["{}{}/async".format(base, path) for path in FLAKY_PATHS]
+            with contextlib.redirect_stdout(io.StringIO()):
+                body_paths = nhl_fetch.fetch_urls(urls)
+            bodies = {
+                url: nhl_cache.read_body(body_path)
+                for url, body_path in body_paths.items()
+            }
+            expected_bodies = {
+                url: b"async"
+                for url, path in zip(urls, FLAKY_PATHS)
+                if path not in given_up
+            }
+            if bodies != expected_bodies:
+                failures.append("fetch_urls bodies {}".format(sorted(bodies)))
+
+            counters = nhl_metrics.collect()["counters"]
+            if counters.get("http_failures") != len(given_up):
+                failures.append(
+                    "http_failures={}".format(counters.get("http_failures"))
+                )
+
+            # and cached_get, which raises for them
+            for path in FLAKY_PATHS:
+                try:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        body = nhl_cache.cached_get("{}{}/sync".format(base, path))
+                except requests.HTTPError:
+                    body = None
+                if body != (None if path in given_up else b"sync"):
+                    failures.append("cached_get {} {!r}".format(path, body))
+
+            # aiohttp may retry a dropped GET once on its own (depending on
+            # its version), so only cached_get's retries are counted exactly
+            counters = nhl_metrics.collect()["counters"]
+            retries = sum(
+                get_expected_requests(*flaky_path) - 1
+                for flaky_path in FLAKY_PATHS.values()
+            )
+            if counters.get("http_retries") != retries:
+                failures.append("http_retries={}".format(counters.get("http_retries")))
+
+        # every path asked for as often as it should have been, and no more
+        for path, flaky_path in FLAKY_PATHS.items():
+            for name in ("async", "sync"):
+                requests_made = FlakyHandler.request_counts.get(
+                    "{}/{}".format(path, name)
+                )
+                if requests_made != get_expected_requests(*flaky_path):
+                    failures.append(
+                        "requests {}/{}={}".format(path, name, requests_made)
+                    )
+    finally:
+        flaky_server.shutdown()
+        flaky_server.server_close()
+        nhl_cache.cache = previous_cache
+        nhl_metrics.merge(previous_metrics)
+
+    return failures
+
+
+def main():
+    unixOptions = "g:h"
+    gnuOptions = ["games=", "help", "seed="]
+
+    try:
+        arguments, values = getopt.getopt(sys.argv[1:], unixOptions, gnuOptions)
+    except getopt.error as err:
+        # output error, and return with an error code
+        print(str(err))
+        sys.exit(2)
+
+    games = 5
+    seed = 2018
+    for currentArgument, currentValue in arguments:
+        if currentArgument in ("-h", "--help"):
+            print("usage: python -m benchmarks.run_checks [--games N] [--seed N]")
+            return
+        elif currentArgument in ("-g", "--games"):
+            games = int(currentValue)
+        elif currentArgument == "--seed":
+            seed = int(currentValue)
+
+    rng = random.Random(seed)
+    checks = {
+        "roster index": lambda: check_roster_index(rng, seed, games * 40),
+        "sweep": lambda: [
+            failure
+            for game_seed in range(seed, seed + games)
+            for failure in check_sweep(rng, game_seed)
+        ],
+        "on ice index": lambda: [
+            failure
+            for game_seed in range(seed, seed + games)
+            for failure in check_on_ice_index(rng, game_seed)
+        ],
+        "repair": lambda: check_repair(rng, games * 400),
+        "live against batch": lambda: [
+            failure
+            for game_seed in range(seed, seed + games)
+            for failure in check_live(rng, game_seed)
+        ],
+        "line totals": lambda: check_line_totals(seed),
+        "archive round trip": lambda: check_archive(rng, seed),
+        "input hashes": lambda: [
+            failure
+            for game_seed in range(seed, seed + games)
+            for failure in check_hashes(rng, game_seed)
+        ],
+        "retries": check_retries,
+    }
+
+    failed = False
+    for name, check in checks.items():
+        failures = check()
+
+        # checks that need something this machine doesn't have
+        if failures is None:
+            print("{:<28} {}".format(name, "skipped"))
+            continue
+
+        print("{:<28} {}".format(name, "FAILED" if failures else "ok"))
+        for failure in failures[:10]:
+            print("    {}".format(failure))
+        failed = failed or bool(failures)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
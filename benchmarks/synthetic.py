@@ -0,0 +1,420 @@
+import json
+import os
+import random
+
+# seconds in a regulation period, and in regular season overtime (3v3)
+PERIOD_LENGTH = 20 * 60
+OVERTIME_LENGTH = 5 * 60
+
+# roughly how often games go to overtime or see a goalie pulled
+OVERTIME_RATE = 0.23
+EMPTY_NET_RATE = 0.35
+
+# names that exercise accents, hyphens, apostrophes and multi-word last names
+FIRST_NAMES = [
+    "Alexander", "Anze", "Auston", "Brent", "Connor", "Drew", "Erik", "Jonathan",
+    "Leon", "Mathew", "Mikko", "Nathan", "Oliver", "Patrice", "Ryan", "Sidney",
+    "T.J.", "Tim", "Victor", "William",
+]  # fmt: skip
+LAST_NAMES = [
+    "Backstrom", "Bergeron", "Burns", "Cable", "Doughty", "Draisaitl", "Ekman-Larsson",
+    "Hedman", "Kopitar", "Letang", "MacKinnon", "Marner", "Matthews", "McDavid",
+    "O'Reilly", "Oshie", "Rantanen", "Stützle", "van Riemsdyk", "Zibanejad",
+]  # fmt: skip
+
+
+def make_roster(rng, team_id):
+
+    # four centers, four of each wing, six defense and two goalies
+    positions = ["C"] * 4 + ["L"] * 4 + ["R"] * 4 + ["D"] * 6 + ["G"] * 2
+    numbers = rng.sample(range(2, 99), len(positions))
+
+    roster = []
+    for k, (position, number) in enumerate(zip(positions, numbers)):
+        roster.append(
+            {
+                "id": 8470000 + team_id * 100 + k,
+                "firstName": rng.choice(FIRST_NAMES),
+                "lastName": rng.choice(LAST_NAMES),
+                "position": position,
+                "number": number,
+            }
+        )
+
+    return roster
+
+
+def make_units(roster):
+    ids = {position: [] for position in "CLRDG"}
+    for player in roster:
+        ids[player["position"]].append(player["id"])
+
+    c, l, r, d = ids["C"], ids["L"], ids["R"], ids["D"]
+
+    # forward groups and defense groups for each strength, in rotation order
+    units = {
+        "EV": (
+            [[c[0], l[0], r[0]], [c[1], l[1], r[1]], [c[2], l[2], r[2]], [c[3], l[3], r[3]]],
+            [[d[0], d[1]], [d[2], d[3]], [d[4], d[5]]],
+        ),
+        "PP": ([[c[0], l[0], r[0], c[1]], [l[1], r[1], c[2], l[2]]], [[d[0]], [d[2]]]),
+        "PK": ([[c[2], l[3]], [c[3], r[2]]], [[d[0], d[1]], [d[2], d[3]]]),
+        "OT": ([[c[0], l[0]], [c[1], r[1]], [c[2], l[2]]], [[d[0]], [d[2]], [d[1]]]),
+        "EN": ([[c[0], l[0], r[0], c[1]]], [[d[0], d[1]]]),
+    }  # fmt: skip
+
+    return units, ids["G"][0]
+
+
+def make_penalties(rng, home_id, away_id):
+
+    # non-overlapping minors, none late enough to meet a pulled goalie
+    penalties = []
+    t = rng.randint(60, 400)
+    while t < 3 * PERIOD_LENGTH - 360:
+        penalties.append((t, t + 120, rng.choice([home_id, away_id])))
+        t += 120 + rng.randint(30, 900)
+
+    return penalties
+
+
+def team_state(team_id, t, period, penalties, pulled_goalie):
+    if period == 4:
+        return "OT"
+
+    if pulled_goalie and pulled_goalie[1] == team_id and t >= pulled_goalie[0]:
+        return "EN"
+
+    for start, end, penalized_team in penalties:
+        if start <= t < end:
+            return "PK" if penalized_team == team_id else "PP"
+
+    return "EV"
+
+
+def rotate(rng, shifts, team_id, period, groups, cursor, start, end, mean):
+
+    # cycle through the groups, cutting the last shift at the segment end
+    t = start
+    while t < end:
+        group = groups[cursor % len(groups)]
+        length = max(15, min(int(rng.gauss(mean, mean / 4)), 120))
+        shift_end = min(t + length, end)
+        for player_id in group:
+            shifts.append((team_id, player_id, period, t, shift_end))
+        t = shift_end
+        cursor += 1
+
+    return cursor
+
+
+def generate_game(seed, game_id=2018020001, home_id=1, away_id=2):
+    rng = random.Random(seed)
+
+    rosters = {home_id: make_roster(rng, home_id), away_id: make_roster(rng, away_id)}
+    penalties = make_penalties(rng, home_id, away_id)
+
+    # the trailing team pulls its goalie for the last minute or two
+    pulled_goalie = None
+    if rng.random() < EMPTY_NET_RATE:
+        pulled_goalie = (
+            3 * PERIOD_LENGTH - rng.randint(60, 150),
+            rng.choice([home_id, away_id]),
+        )
+
+    periods = [(1, PERIOD_LENGTH), (2, PERIOD_LENGTH), (3, PERIOD_LENGTH)]
+    if rng.random() < OVERTIME_RATE:
+        periods.append((4, rng.randint(30, OVERTIME_LENGTH)))
+
+    # every moment the strength can change
+    boundaries = set()
+    for start, end, _ in penalties:
+        boundaries.update([start, end])
+    if pulled_goalie:
+        boundaries.add(pulled_goalie[0])
+
+    shifts = []
+    for team_id, roster in rosters.items():
+        units, goalie_id = make_units(roster)
+        cursors = {}
+
+        for period, length in periods:
+            period_start = (period - 1) * PERIOD_LENGTH
+            period_end = period_start + length
+
+            # the goalie plays the whole period unless pulled
+            goalie_end = length
+            if pulled_goalie and pulled_goalie[1] == team_id and period == 3:
+                goalie_end = pulled_goalie[0] - period_start
+            shifts.append((team_id, goalie_id, period, 0, goalie_end))
+
+            edges = sorted(
+                {period_start, period_end}
+                | {b for b in boundaries if period_start < b < period_end}
+            )
+
+            for start, end in zip(edges, edges[1:]):
+                state = team_state(team_id, start, period, penalties, pulled_goalie)
+                forwards, defense = units[state]
+
+                # forwards and defense change on their own schedules
+                for kind, groups, mean in (("F", forwards, 45), ("D", defense, 50)):
+                    cursors[(state, kind)] = rotate(
+                        rng,
+                        shifts,
+                        team_id,
+                        period,
+                        groups,
+                        cursors.get((state, kind), 0),
+                        start - period_start,
+                        end - period_start,
+                        mean,
+                    )
+
+    game = {
+        "game_id": game_id,
+        "home": home_id,
+        "away": away_id,
+        "periods": periods,
+        "rosters": rosters,
+        "shifts": shifts,
+    }
+
+    return game
+
+
+def format_clock(seconds):
+    return "{:02d}:{:02d}".format(seconds // 60, seconds % 60)
+
+
+def format_report_clock(seconds):
+    return "{}:{:02d}".format(seconds // 60, seconds % 60)
+
+
+def players_by_id(game):
+    players = {}
+    for team_id, roster in game["rosters"].items():
+        for player in roster:
+            players[player["id"]] = dict(player, team_id=team_id)
+
+    return players
+
+
+def make_shift_charts(game):
+    players = players_by_id(game)
+
+    # the shift chart api groups shifts by player
+    records = []
+    for shift_id, (team_id, player_id, period, start, end) in enumerate(
+        sorted(game["shifts"], key=lambda shift: (shift[1], shift[2], shift[3]))
+    ):
+        player = players[player_id]
+        records.append(
+            {
+                "id": 10000000 + shift_id,
+                "gameId": game["game_id"],
+                "teamId": team_id,
+                "playerId": player_id,
+                "firstName": player["firstName"],
+                "lastName": player["lastName"],
+                "period": period,
+                "startTime": format_clock(start),
+                "endTime": format_clock(end),
+                "duration": format_clock(end - start),
+                "typeCode": 517,
+            }
+        )
+
+    return json.dumps({"data": records, "total": len(records)}).encode("utf-8")
+
+
+def make_records_roster(game, team_id):
+    roster = []
+    for player in game["rosters"][team_id]:
+        roster.append(
+            {
+                "id": player["id"],
+                "fullName": "{} {}".format(player["firstName"], player["lastName"]),
+                "position": player["position"],
+                "sweaterNumber": player["number"],
+                "shootsCatches": "L",
+            }
+        )
+
+    return json.dumps({"data": roster, "total": len(roster)}).encode("utf-8")
+
+
+def make_live_feed(game, seed):
+    rng = random.Random(seed)
+
+    teams = {}
+    for side in ("home", "away"):
+        team_id = game[side]
+        players = {}
+        for player in game["rosters"][team_id]:
+            if player["position"] == "G":
+                stats = {"goalieStats": {"saves": rng.randint(15, 40)}}
+            else:
+                faceoffs = (
+                    rng.randint(8, 25)
+                    if player["position"] == "C"
+                    else rng.randint(0, 3)
+                )
+                stats = {
+                    "skaterStats": {
+                        "timeOnIce": "15:00",
+                        "assists": 0,
+                        "goals": 0,
+                        "shots": rng.randint(0, 6),
+                        "faceOffWins": faceoffs // 2,
+                        "faceoffTaken": faceoffs,
+                        "plusMinus": 0,
+                    }
+                }
+
+            players["ID{}".format(player["id"])] = {
+                "person": {
+                    "id": player["id"],
+                    "fullName": "{} {}".format(player["firstName"], player["lastName"]),
+                },
+                "jerseyNumber": str(player["number"]),
+                "position": {"code": player["position"]},
+                "stats": stats,
+            }
+
+        teams[side] = {"team": {"id": team_id}, "players": players}
+
+    # the play-by-play is most of a real live feed
+    plays = []
+    for k in range(300):
+        plays.append(
+            {
+                "result": {"event": "Shot", "description": "Wrist Shot " * 4},
+                "about": {"eventIdx": k, "period": 1 + k % 3, "periodTime": "10:00"},
+                "coordinates": {"x": rng.uniform(-99, 99), "y": rng.uniform(-42, 42)},
+            }
+        )
+
+    feed = {
+        "gamePk": game["game_id"],
+        "gameData": {"status": {"abstractGameState": "Final"}},
+        "liveData": {"plays": {"allPlays": plays}, "boxscore": {"teams": teams}},
+    }
+
+    return json.dumps(feed).encode("utf-8")
+
+
+def make_time_on_ice_report(game, team_id):
+
+    # the TH (home) and TV (visitor) reports, one block of shift rows per player
+    period_lengths = dict(game["periods"])
+    headers = [
+        "Shift #",
+        "Per",
+        "Start of Shift<br>Elapsed / Game",
+        "End of Shift<br>Elapsed / Game",
+        "Duration",
+        "Event",
+    ]
+
+    player_shifts = {}
+    for shift_team_id, player_id, period, start, end in game["shifts"]:
+        if shift_team_id == team_id:
+            player_shifts.setdefault(player_id, []).append((period, start, end))
+
+    out = [
+        "<html><head><title>Time On Ice Report</title></head><body>",
+        '<table border="0" cellpadding="0" cellspacing="0" width="100%">',
+        '<tr><td><table><tr><td class="teamHeading + border">TEAM {}</td></tr></table></td></tr>'.format(
+            team_id
+        ),
+    ]
+
+    for player in sorted(game["rosters"][team_id], key=lambda p: p["number"]):
+        if player["id"] not in player_shifts:
+            continue
+
+        out.append(
+            '<tr><td class="playerHeading + border" colspan="8">{} {}, {}</td></tr>'.format(
+                player["number"],
+                player["lastName"].upper(),
+                player["firstName"].upper(),
+            )
+        )
+        out.append(
+            "<tr>"
+            + "".join(
+                '<td class="heading + lborder + bborder" align="center">{}</td>'.format(
+                    h
+                )
+                for h in headers
+            )
+            + "</tr>"
+        )
+
+        for k, (period, start, end) in enumerate(sorted(player_shifts[player["id"]])):
+            length = period_lengths[period]
+            cells = [
+                str(k + 1),
+                "OT" if period == 4 else str(period),
+                "{} / {}".format(
+                    format_report_clock(start), format_report_clock(length - start)
+                ),
+                "{} / {}".format(
+                    format_report_clock(end), format_report_clock(length - end)
+                ),
+                format_clock(end - start),
+                "&nbsp;",
+            ]
+            out.append(
+                '<tr class="{}Color">'.format("odd" if k % 2 else "even")
+                + "".join(
+                    '<td align="center" class="lborder + bborder">{}</td>'.format(c)
+                    for c in cells
+                )
+                + "</tr>"
+            )
+
+        # the per player summary uses its own classes
+        out.append(
+            '<tr><td colspan="8"><table><tr><td class="heading + bborder">Per</td>'
+            '<td class="heading + bborder">SHF</td></tr><tr><td class="lborder + bborder + rborder">TOT</td>'
+            "<td>{}</td></tr></table></td></tr>".format(
+                len(player_shifts[player["id"]])
+            )
+        )
+
+    out.append("</table></body></html>")
+
+    return "\n".join(out).encode("utf-8")
+
+
+def make_fixtures(game, seed):
+    fixtures = {
+        "shift_charts": make_shift_charts(game),
+        "live_feed": make_live_feed(game, seed),
+        "home_players": make_records_roster(game, game["home"]),
+        "away_players": make_records_roster(game, game["away"]),
+        "home_time_on_ice": make_time_on_ice_report(game, game["home"]),
+        "away_time_on_ice": make_time_on_ice_report(game, game["away"]),
+    }
+
+    return fixtures
+
+
+def write_fixtures(fixtures, game_id, directory):
+
+    # named like the endpoints they stand in for
+    names = {
+        "shift_charts": "shiftcharts-{}.json",
+        "live_feed": "feed-live-{}.json",
+        "home_players": "roster-home-{}.json",
+        "away_players": "roster-away-{}.json",
+        "home_time_on_ice": "TH-{}.HTM",
+        "away_time_on_ice": "TV-{}.HTM",
+    }
+
+    os.makedirs(directory, exist_ok=True)
+    for name, body in fixtures.items():
+        with open(os.path.join(directory, names[name].format(game_id)), "wb") as f:
+            f.write(body)
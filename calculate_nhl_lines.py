@@ -1,10 +1,10 @@
-import requests
 import re
 import pprint
 import operator
 
-from urllib.request import urlopen
-from bs4 import BeautifulSoup
+import nhl_cache
+import nhl_reports
+import nhl_shifts
 
 # the year range (2017-2018)
 #First year that NHL.com released HTML Reports: 2003-2004
@@ -31,62 +31,19 @@ def get_away_html_timeonice_url(year, game_id):
     print('away url: ' + url)
     return url
 
-def parse_time_on_ice(url):
+def parse_time_on_ice(url, final=False):
 
     # get the html
-    html = urlopen(url)
+    html = nhl_cache.cached_get(url, final)
 
-    # create the BeautifulSoup object
-    soup = BeautifulSoup(html, "lxml")
-
-    # regexes for grabbing players/columns
-    player_regex = '^([0-9]+) ([A-z]+), ([A-z]+)$'
-    column_regex = '[A-z]+'
-
-    # classes for different cell types
-    player_class = 'playerHeading+border'
-    header_class = 'heading+lborder+bborder'
-    stat_class = 'lborder+bborder'
-
-    index = 0
-    column_builder = []
-    column_headers = []
     shift_hash = {}
 
-    for row in soup.find_all("tr"):
-        cells = row.find_all("td")
-        player_hash = {}
-        for cell in cells:
-            c = cell.get('class')
-            if c is None:
-                continue
-            elif ''.join(c) == player_class:
-                player = cell.text
-                shift_hash[player] = []     
-            elif ''.join(c) == header_class:
-                column_builder.append(cell.text)
-            elif ''.join(c) == stat_class:
-                if len(column_builder) > 0:
-                    column_headers = column_builder
-                    column_builder = []
-     
-                player_hash[column_headers[index]] = cell.text 
-                index += 1
-                index = (index % len(column_headers))
-
-        if (player_hash):
-            # get shift start/end minute:second, and split them
-            start_min, start_sec = player_hash['Start of ShiftElapsed / Game'][:5].split(':')
-            end_min, end_sec = player_hash['End of ShiftElapsed / Game'][:5].split(':')
-     
-            # get the period, so we can differentiate the shift times
-            period = player_hash['Per']
-
-            shift = {}
-            # convert each shift into a seconds timestamp
-            shift['start'] = (int(start_min) * 60) + int(start_sec) + ((int(period)-1) * 20 * 60)
-            shift['end'] = (int(end_min) * 60) + int(end_sec) + ((int(period)-1) * 20 * 60)
-            shift_hash[player].append(shift)
+    # stream the report, shift times are already converted to seconds
+    for player, period, start, end in nhl_reports.iter_time_on_ice_shifts(html):
+        shift = {}
+        shift['start'] = start
+        shift['end'] = end
+        shift_hash.setdefault(player, []).append(shift)
 
     # pretty print the list of player shifts, minute:seconds turned to seconds
     # pprint.pprint(shift_hash)
@@ -130,9 +87,12 @@ def parse_time_on_ice(url):
     return sorted_players, sorted_player_toi
 
 
-def parse_playbyplay(url):
+def parse_playbyplay(url, final=False):
     # get the html
-    html = urlopen(url)
+    html = nhl_cache.cached_get(url, final)
+
+    # imported here, only the play by play needs BeautifulSoup
+    from bs4 import BeautifulSoup
 
     # create the BeautifulSoup object
     soup = BeautifulSoup(html, "lxml")
@@ -200,35 +160,40 @@ def compute_lines(sorted_players, position_hash, player_toi):
     return team_lines
 
 
+def main():
+    # reports change until the game is over (and for a while after), only
+    # a settled game's are never revalidated
+    final = nhl_shifts.is_game_settled(int(year[0:4] + '0' + game_id))
 
-# build the url based on year and game id
-home_url = get_home_html_timeonice_url(year, game_id)
-sorted_home_players, home_player_toi = parse_time_on_ice(home_url)
-print("################################# Home Player TOI #################################")
-pprint.pprint(sorted_home_players)
-
-away_url = get_away_html_timeonice_url(year, game_id)
-sorted_away_players, away_player_toi = parse_time_on_ice(away_url)
-print("################################# Home Player TOI #################################")
-pprint.pprint(sorted_away_players)
+    # build the url based on year and game id
+    home_url = get_home_html_timeonice_url(year, game_id)
+    sorted_home_players, home_player_toi = parse_time_on_ice(home_url, final)
+    print("################################# Home Player TOI #################################")
+    pprint.pprint(sorted_home_players)
 
-playbyplay_url = get_html_playbyplay_url(year, game_id)
-position_hash = parse_playbyplay(playbyplay_url)
-# print("################################# Position Hash #################################")
-# pprint.pprint(position_hash)
+    away_url = get_away_html_timeonice_url(year, game_id)
+    sorted_away_players, away_player_toi = parse_time_on_ice(away_url, final)
+    print("################################# Home Player TOI #################################")
+    pprint.pprint(sorted_away_players)
 
-print("################################# Home Player TOI #################################")
-pprint.pprint(home_player_toi)
+    playbyplay_url = get_html_playbyplay_url(year, game_id)
+    position_hash = parse_playbyplay(playbyplay_url, final)
+    # print("################################# Position Hash #################################")
+    # pprint.pprint(position_hash)
 
-print("################################# Computing Home Lines #################################")
-home_team_lines = compute_lines(sorted_home_players, position_hash, home_player_toi)
-print("################################# Home Lines #################################")
-pprint.pprint(home_team_lines)
+    print("################################# Home Player TOI #################################")
+    pprint.pprint(home_player_toi)
 
-print("################################# Computing Away Lines #################################")
-away_team_lines = compute_lines(sorted_away_players, position_hash, away_player_toi)
-print("################################# Away Lines #################################")
-pprint.pprint(away_team_lines)
+    print("################################# Computing Home Lines #################################")
+    home_team_lines = compute_lines(sorted_home_players, position_hash, home_player_toi)
+    print("################################# Home Lines #################################")
+    pprint.pprint(home_team_lines)
 
+    print("################################# Computing Away Lines #################################")
+    away_team_lines = compute_lines(sorted_away_players, position_hash, away_player_toi)
+    print("################################# Away Lines #################################")
+    pprint.pprint(away_team_lines)
 
 
+if __name__ == "__main__":
+    main()
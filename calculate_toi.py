@@ -1,15 +1,15 @@
-import requests
+import getopt
+import os
 import re
 import pprint
 import operator
+import sys
 
-from urllib.request import urlopen
-from bs4 import BeautifulSoup
+import numpy as np
 
-# the year range (2017-2018)
-#First year that NHL.com released HTML Reports: 2003-2004
-year = str(20172018)
-game_id = str(20398)
+import nhl_cache
+import nhl_reports
+import nhl_shifts
 
 # The url we will be scraping
 # V stands for VISITOR and H stands for HOME
@@ -30,108 +30,90 @@ def get_away_html_timeonice_url(year, game_id):
     print('away url: ' + url)
     return url
 
-def parse_time_on_ice(url):
+def get_time_on_ice_shifts(html):
+
+    players = {}
+    shift_players = []
+    shift_starts = []
+    shift_ends = []
+
+    # stream the report, shift times are already converted to seconds
+    for player, period, start, end in nhl_reports.iter_time_on_ice_shifts(html):
+        # index players in the order they appear in the report
+        shift_players.append(players.setdefault(player, len(players)))
+        shift_starts.append(start)
+        shift_ends.append(end)
+
+    shift_players = np.array(shift_players, dtype=np.int64)
+    shift_starts = np.array(shift_starts, dtype=np.int64)
+    shift_ends = np.array(shift_ends, dtype=np.int64)
+
+    return list(players), shift_players, shift_starts, shift_ends
+
+def calculate_shared_toi(shift_players, shift_starts, shift_ends, player_count):
+
+    # every shift start or end splits the game into intervals where nobody
+    # comes on or goes off
+    times = np.unique(np.concatenate([shift_starts, shift_ends]))
+    lengths = np.diff(times)
+
+    # +1 in a player's column where his shift starts and -1 where it ends, so a
+    # running sum down the intervals says who was on the ice for each one
+    changes = np.zeros((len(times), player_count), dtype=np.int64)
+    np.add.at(changes, (np.searchsorted(times, shift_starts), shift_players), 1)
+    np.add.at(changes, (np.searchsorted(times, shift_ends), shift_players), -1)
+    on_ice = (np.cumsum(changes, axis=0)[:-1] > 0).astype(np.int64)
+
+    # shared_toi[i, j] is the seconds players i and j were on the ice together,
+    # the diagonal is each player's own time on ice
+    return on_ice.T @ (on_ice * lengths[:, np.newaxis])
+
+def is_report_final(year, game_id):
+    # reports change until the game is over (and for a while after), only
+    # a settled game's are never revalidated
+    return nhl_shifts.is_game_settled(int(year[0:4] + '0' + game_id))
+
+def get_time_on_ice_matrix(url, final=False):
 
     # get the html
-    html = urlopen(url)
+    html = nhl_cache.cached_get(url, final)
 
-    # create the BeautifulSoup object
-    soup = BeautifulSoup(html, "lxml")
+    players, shift_players, shift_starts, shift_ends = get_time_on_ice_shifts(html)
+    shared_toi = calculate_shared_toi(shift_players, shift_starts, shift_ends, len(players))
+
+    return players, shared_toi
 
-    # regexes for grabbing players/columns
-    player_regex = '^([0-9]+) ([A-z]+), ([A-z]+)$'
-    column_regex = '[A-z]+'
-
-    # classes for different cell types
-    player_class = 'playerHeading+border'
-    header_class = 'heading+lborder+bborder'
-    stat_class = 'lborder+bborder'
-
-    index = 0
-    column_builder = []
-    column_headers = []
-    shift_hash = {}
-
-    for row in soup.find_all("tr"):
-        cells = row.find_all("td")
-        player_hash = {}
-        for cell in cells:
-            c = cell.get('class')
-            if c is None:
-                continue
-            elif ''.join(c) == player_class:
-                player = cell.text
-                shift_hash[player] = []     
-            elif ''.join(c) == header_class:
-                column_builder.append(cell.text)
-            elif ''.join(c) == stat_class:
-                if len(column_builder) > 0:
-                    column_headers = column_builder
-                    column_builder = []
-     
-                player_hash[column_headers[index]] = cell.text 
-                index += 1
-                index = (index % len(column_headers))
-
-        if (player_hash):
-            # get shift start/end minute:second, and split them
-            start_min, start_sec = player_hash['Start of ShiftElapsed / Game'][:5].split(':')
-            end_min, end_sec = player_hash['End of ShiftElapsed / Game'][:5].split(':')
-     
-            # get the period, so we can differentiate the shift times
-            period = player_hash['Per']
-
-            shift = {}
-            # convert each shift into a seconds timestamp
-            shift['start'] = (int(start_min) * 60) + int(start_sec) + ((int(period)-1) * 20 * 60)
-            shift['end'] = (int(end_min) * 60) + int(end_sec) + ((int(period)-1) * 20 * 60)
-            shift_hash[player].append(shift)
-
-    # pretty print the list of player shifts, minute:seconds turned to seconds
-    pprint.pprint(shift_hash)
-
-    toi_together = {}
+def sort_shared_toi(players, shared_toi):
+    sorted_players = {}
     player_toi = {}
 
-    for player in shift_hash:
-        print(player)
-        toi_together[player] = {}
-        for linemate in shift_hash:
-            # don't compare shifts against himself, track their icetime separately
-            if (linemate == player):
-                player_toi[player] = 0
-                for player_shift in shift_hash[player]:
-                    player_toi[player] += player_shift['end'] - player_shift['start']
-                continue
-            toi_together[player][linemate] = 0      
-            print('--> ' + linemate)
-            for player_shift in shift_hash[player]:
-                for linemate_shift in shift_hash[linemate]:
-                    start = max(player_shift['start'], linemate_shift['start'])
-                    end = min(player_shift['end'], linemate_shift['end'])
-                    overlap = end - start
-                    if (overlap > 0):
-                        print('overlap=' + str(overlap))
-                        toi_together[player][linemate] += overlap
-
-    pprint.pprint(toi_together)
+    for i, player in enumerate(players):
+        # track their own icetime separately from time with linemates
+        player_toi[player] = int(shared_toi[i, i])
 
-    sorted_players = {}
+        toi_together = {}
+        for j, linemate in enumerate(players):
+            if (i != j):
+                toi_together[linemate] = int(shared_toi[i, j])
 
-    for player in toi_together:
-        player_dict = toi_together[player]
-        sorted_player = sorted(player_dict.items(), key=operator.itemgetter(1), reverse=True)
-        sorted_players[player] = sorted_player
+        sorted_players[player] = sorted(toi_together.items(), key=operator.itemgetter(1), reverse=True)
 
     # sort player ice times as well
     sorted_player_toi = sorted(player_toi.items(), key=operator.itemgetter(1), reverse=True)
 
     return sorted_players, sorted_player_toi
 
+def parse_time_on_ice(url, final=False):
+    players, shared_toi = get_time_on_ice_matrix(url, final)
+    return sort_shared_toi(players, shared_toi)
+
 
-def parse_playbyplay(url):
+def parse_playbyplay(url, final=False):
     # get the html
-    html = urlopen(url)
+    html = nhl_cache.cached_get(url, final)
+
+    # imported here, only the play by play still needs BeautifulSoup
+    from bs4 import BeautifulSoup
 
     # create the BeautifulSoup object
     soup = BeautifulSoup(html, "lxml")
@@ -200,34 +182,104 @@ def compute_lines(sorted_players, position_hash, player_toi):
 
 
 
-# build the url based on year and game id
-home_url = get_home_html_timeonice_url(year, game_id)
-sorted_home_players, home_player_toi = parse_time_on_ice(home_url)
-print("################################# Home Player TOI #################################")
-pprint.pprint(sorted_home_players)
-
-away_url = get_away_html_timeonice_url(year, game_id)
-sorted_away_players, away_player_toi = parse_time_on_ice(away_url)
-print("################################# Home Player TOI #################################")
-pprint.pprint(sorted_away_players)
-
-playbyplay_url = get_html_playbyplay_url(year, game_id)
-position_hash = parse_playbyplay(playbyplay_url)
-print("################################# Position Hash #################################")
-pprint.pprint(position_hash)
-
-print("################################# Home Player TOI #################################")
-pprint.pprint(home_player_toi)
-
-print("################################# Computing Home Lines #################################")
-home_team_lines = compute_lines(sorted_home_players, position_hash, home_player_toi)
-print("################################# Home Lines #################################")
-pprint.pprint(home_team_lines)
-
-print("################################# Computing Away Lines #################################")
-away_team_lines = compute_lines(sorted_away_players, position_hash, away_player_toi)
-print("################################# Away Lines #################################")
-pprint.pprint(away_team_lines)
-
-
-
+def calculate_game_lines(year, game_id, matrix_directory=None):
+
+    # a game in progress (today's, in a --from/--to range) has partial reports
+    final = is_report_final(year, game_id)
+
+    # build the url based on year and game id
+    home_url = get_home_html_timeonice_url(year, game_id)
+    home_players, home_shared_toi = get_time_on_ice_matrix(home_url, final)
+    sorted_home_players, home_player_toi = sort_shared_toi(home_players, home_shared_toi)
+    print("################################# Home Player TOI #################################")
+    pprint.pprint(sorted_home_players)
+
+    away_url = get_away_html_timeonice_url(year, game_id)
+    away_players, away_shared_toi = get_time_on_ice_matrix(away_url, final)
+    sorted_away_players, away_player_toi = sort_shared_toi(away_players, away_shared_toi)
+    print("################################# Away Player TOI #################################")
+    pprint.pprint(sorted_away_players)
+
+    # keep the matrices, players[i] is row and column i of shared_toi
+    if matrix_directory:
+        np.savez(os.path.join(matrix_directory, year + '-' + game_id + '.npz'),
+                 home_players=home_players, home_shared_toi=home_shared_toi,
+                 away_players=away_players, away_shared_toi=away_shared_toi)
+
+    playbyplay_url = get_html_playbyplay_url(year, game_id)
+    position_hash = parse_playbyplay(playbyplay_url, final)
+    print("################################# Position Hash #################################")
+    pprint.pprint(position_hash)
+
+    print("################################# Home Player TOI #################################")
+    pprint.pprint(home_player_toi)
+
+    print("################################# Computing Home Lines #################################")
+    home_team_lines = compute_lines(sorted_home_players, position_hash, home_player_toi)
+    print("################################# Home Lines #################################")
+    pprint.pprint(home_team_lines)
+
+    print("################################# Computing Away Lines #################################")
+    away_team_lines = compute_lines(sorted_away_players, position_hash, away_player_toi)
+    print("################################# Away Lines #################################")
+    pprint.pprint(away_team_lines)
+
+    return home_team_lines, away_team_lines
+
+
+def main():
+    unixOptions = "g:ho:y:"
+    gnuOptions = ["from=", "game=", "help", "output=", "to=", "year="]
+
+    try:
+        arguments, values = getopt.getopt(sys.argv[1:], unixOptions, gnuOptions)
+    except getopt.error as err:
+        # output error, and return with an error code
+        print(str(err))
+        sys.exit(2)
+
+    # the year range (2017-2018)
+    #First year that NHL.com released HTML Reports: 2003-2004
+    year = str(20172018)
+    game_ids = []
+    first_game = None
+    last_game = None
+    matrix_directory = None
+    for currentArgument, currentValue in arguments:
+        if currentArgument in ("-h", "--help"):
+            print("usage: calculate_toi.py [-y YEAR] [-g GAME_ID ...] [--from GAME_ID --to GAME_ID] [-o DIR]")
+            return
+        elif currentArgument in ("-y", "--year"):
+            year = currentValue
+        elif currentArgument in ("-g", "--game"):
+            game_ids.append(currentValue)
+        elif currentArgument == "--from":
+            first_game = int(currentValue)
+        elif currentArgument == "--to":
+            last_game = int(currentValue)
+        elif currentArgument in ("-o", "--output"):
+            matrix_directory = currentValue
+            os.makedirs(matrix_directory, exist_ok=True)
+
+    # a range of games, ie. --from 20001 --to 21271 for a whole regular season
+    if first_game or last_game:
+        first_game = first_game or last_game
+        last_game = last_game or first_game
+        game_ids.extend(str(game_id) for game_id in range(first_game, last_game + 1))
+
+    if not game_ids:
+        game_ids = [str(20398)]
+
+    # only needed to tell a missing report from a real failure
+    import requests
+
+    for game_id in game_ids:
+        try:
+            calculate_game_lines(year, game_id, matrix_directory)
+        except requests.HTTPError as err:
+            # cancelled or not yet played games don't have reports
+            print('skipping game_id=' + game_id + ': ' + str(err))
+
+
+if __name__ == "__main__":
+    main()
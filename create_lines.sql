@@ -0,0 +1,85 @@
+-- lines each team used, one row per player per line per game
+CREATE TABLE IF NOT EXISTS lines (
+    game_id integer,
+    player_id integer,
+    team_id integer NOT NULL,
+    position character varying(5) NOT NULL,
+    depth integer,
+    state character varying(5),
+    time_on_ice integer NOT NULL,
+    CONSTRAINT lines_pkey PRIMARY KEY (game_id, player_id, depth, state)
+);
+
+CREATE INDEX IF NOT EXISTS lines_team_game_idx ON lines (team_id, game_id);
+
+-- each team's most recent game, which is all the lines table used to hold
+CREATE OR REPLACE VIEW latest_lines AS
+SELECT lines.*
+FROM lines
+JOIN (
+    SELECT team_id, MAX(game_id) AS game_id
+    FROM lines
+    GROUP BY team_id
+) latest USING (team_id, game_id);
+
+-- every line combination (forwards or defense) a team used in a game
+CREATE TABLE IF NOT EXISTS line_games (
+    game_id integer NOT NULL,
+    team_id integer NOT NULL,
+    season integer NOT NULL,
+    game_date date NOT NULL,
+    state character varying(5) NOT NULL,
+    unit character(1) NOT NULL,
+    depth integer NOT NULL,
+    player_ids integer[] NOT NULL,
+    time_on_ice integer NOT NULL,
+    CONSTRAINT line_games_pkey PRIMARY KEY (game_id, team_id, state, unit, depth)
+);
+
+CREATE INDEX IF NOT EXISTS line_games_team_date_idx ON line_games (team_id, game_date DESC, game_id DESC);
+
+-- season totals per line combination, updated as each game is written
+CREATE TABLE IF NOT EXISTS line_totals (
+    season integer NOT NULL,
+    team_id integer NOT NULL,
+    state character varying(5) NOT NULL,
+    unit character(1) NOT NULL,
+    player_ids integer[] NOT NULL,
+    time_on_ice integer NOT NULL,
+    games integer NOT NULL,
+    last_game_id integer NOT NULL,
+    last_seen date NOT NULL,
+    CONSTRAINT line_totals_pkey PRIMARY KEY (season, team_id, state, unit, player_ids)
+);
+
+-- the same totals over each team's last 10 games
+CREATE OR REPLACE VIEW recent_line_totals AS
+SELECT
+    team_id,
+    state,
+    unit,
+    player_ids,
+    SUM(time_on_ice) AS time_on_ice,
+    COUNT(*) AS games,
+    MAX(game_id) AS last_game_id,
+    MAX(game_date) AS last_seen
+FROM (
+    SELECT
+        line_games.*,
+        DENSE_RANK() OVER (
+            PARTITION BY team_id ORDER BY game_date DESC, game_id DESC
+        ) AS games_ago
+    FROM line_games
+) recent
+WHERE games_ago <= 10
+GROUP BY team_id, state, unit, player_ids;
+
+-- what each game's lines were last computed from, so unchanged games can be
+-- skipped (see ALGORITHM_VERSION in nhl_shifts.py)
+CREATE TABLE IF NOT EXISTS game_inputs (
+    game_id integer NOT NULL,
+    input_hash character(40) NOT NULL,
+    algorithm_version integer NOT NULL,
+    computed_at timestamp with time zone NOT NULL DEFAULT now(),
+    CONSTRAINT game_inputs_pkey PRIMARY KEY (game_id)
+);
@@ -0,0 +1,21 @@
+-- every NHL team, synced by nhl_metadata.py
+CREATE TABLE IF NOT EXISTS teams (
+    team_id integer NOT NULL,
+    name character varying(64) NOT NULL,
+    location character varying(64),
+    venue character varying(128),
+    team_name character varying(64),
+    division integer,
+    conference integer,
+    CONSTRAINT teams_pkey PRIMARY KEY (team_id)
+);
+
+-- every player on a current roster, with the team they were last listed by
+CREATE TABLE IF NOT EXISTS players (
+    player_id integer NOT NULL,
+    team_id integer NOT NULL,
+    name character varying(64) NOT NULL,
+    position character varying(5) NOT NULL,
+    number integer NOT NULL,
+    CONSTRAINT players_pkey PRIMARY KEY (player_id)
+);
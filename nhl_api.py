@@ -0,0 +1,334 @@
+# serve the computed lines as json, in production under gunicorn (see
+# Procfile), or locally with python nhl_api.py --port 8000
+import getopt
+import hashlib
+import json
+import os
+import re
+import select
+import sys
+import threading
+import time
+from wsgiref import simple_server
+
+import psycopg2
+
+import nhl_metrics
+import nhl_shifts
+
+# notifications can be missed while the listener reconnects, so nothing is
+# served from the cache for longer than this either way
+CACHE_TTL = float(os.environ.get("NHL_API_CACHE_TTL", 300))
+
+# seconds between reconnect attempts when the listener loses the database
+RECONNECT_INTERVAL = 5
+
+LINE_COLUMNS = ["player_id", "position", "depth", "state", "time_on_ice"]
+TOTAL_COLUMNS = [
+    "state",
+    "unit",
+    "player_ids",
+    "time_on_ice",
+    "games",
+    "last_game_id",
+    "last_seen",
+]
+
+
+def get_team_lines(cur, team_id):
+
+    # the lines from each team's most recent game
+    cur.execute(
+        """SELECT game_id, player_id, position, depth, state, time_on_ice
+           FROM latest_lines
+           WHERE team_id = %s
+           ORDER BY state, depth, position, player_id""",
+        (team_id,),
+    )
+    rows = cur.fetchall()
+    if not rows:
+        return None
+
+    return {
+        "team_id": team_id,
+        "game_id": rows[0][0],
+        "lines": [dict(zip(LINE_COLUMNS, row[1:])) for row in rows],
+    }
+
+
+def get_game_lines(cur, game_id):
+    cur.execute(
+        """SELECT team_id, player_id, position, depth, state, time_on_ice
+           FROM lines
+           WHERE game_id = %s
+           ORDER BY team_id, state, depth, position, player_id""",
+        (game_id,),
+    )
+    rows = cur.fetchall()
+    if not rows:
+        return None
+
+    teams = {}
+    for row in rows:
+        teams.setdefault(row[0], []).append(dict(zip(LINE_COLUMNS, row[1:])))
+
+    return {"game_id": game_id, "teams": teams}
+
+
+def get_season_lines(cur, season, team_id):
+
+    # every combination a team used in a season, most used first
+    cur.execute(
+        """SELECT state, unit, player_ids, time_on_ice, games, last_game_id, last_seen
+           FROM line_totals
+           WHERE season = %s AND team_id = %s
+           ORDER BY state, unit, time_on_ice DESC""",
+        (season, team_id),
+    )
+    rows = cur.fetchall()
+    if not rows:
+        return None
+
+    return {
+        "season": season,
+        "team_id": team_id,
+        "lines": [dict(zip(TOTAL_COLUMNS, row)) for row in rows],
+    }
+
+
+def get_recent_lines(cur, team_id):
+    cur.execute(
+        """SELECT state, unit, player_ids, time_on_ice, games, last_game_id, last_seen
+           FROM recent_line_totals
+           WHERE team_id = %s
+           ORDER BY state, unit, time_on_ice DESC""",
+        (team_id,),
+    )
+    rows = cur.fetchall()
+    if not rows:
+        return None
+
+    return {
+        "team_id": team_id,
+        "lines": [dict(zip(TOTAL_COLUMNS, row)) for row in rows],
+    }
+
+
+# path -> the query answering it, called with the path's ids
+ROUTES = [
+    (re.compile(r"^/teams/([0-9]+)/lines$"), get_team_lines),
+    (re.compile(r"^/teams/([0-9]+)/lines/recent$"), get_recent_lines),
+    (re.compile(r"^/games/([0-9]+)/lines$"), get_game_lines),
+    (re.compile(r"^/seasons/([0-9]{8})/teams/([0-9]+)/lines$"), get_season_lines),
+]
+
+
+class ResponseCache:
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+
+        # path -> (stored at, etag, body)
+        self.responses = {}
+        self.lock = threading.Lock()
+
+        # bumped on every clear, so a response read from the database before
+        # a write committed isn't stored after the clear that followed it
+        self.generation = 0
+
+    def get(self, path):
+        with self.lock:
+            response = self.responses.get(path)
+
+        if response is None or time.time() - response[0] > self.ttl:
+            return None
+
+        return response[1], response[2]
+
+    def put(self, path, etag, body, generation):
+        with self.lock:
+            if generation == self.generation:
+                self.responses[path] = (time.time(), etag, body)
+
+    def clear(self):
+        with self.lock:
+            self.responses.clear()
+            self.generation += 1
+
+
+class LinesListener(threading.Thread):
+    def __init__(self, cache):
+        super().__init__(daemon=True)
+        self.cache = cache
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except psycopg2.Error as err:
+                print("lost the lines listener connection: {}".format(err))
+
+            time.sleep(RECONNECT_INTERVAL)
+
+    def listen(self):
+        conn = nhl_shifts.connect_to_database()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("LISTEN {}".format(nhl_shifts.LINES_CHANNEL))
+
+            # lines may have been written while we weren't listening
+            self.cache.clear()
+
+            while True:
+                if select.select([conn], [], [], CACHE_TTL) == ([], [], []):
+                    continue
+
+                conn.poll()
+                if conn.notifies:
+                    print(
+                        "lines updated for games {}, clearing the cache".format(
+                            ",".join(notify.payload for notify in conn.notifies)
+                        )
+                    )
+                    del conn.notifies[:]
+                    self.cache.clear()
+                    nhl_metrics.incr("api_cache_invalidations")
+        finally:
+            conn.close()
+
+
+class LinesApp:
+    def __init__(self):
+        self.cache = ResponseCache()
+        self.conn = None
+        self.listener = None
+        self.lock = threading.Lock()
+
+    def start_listener(self):
+
+        # started on the first request rather than at import, so each
+        # gunicorn worker (forked after import) gets its own thread
+        with self.lock:
+            if self.listener is None:
+                self.listener = LinesListener(self.cache)
+                self.listener.start()
+
+    def query(self, handler, ids):
+
+        # one connection per worker, reopened if the database went away
+        with self.lock:
+            if self.conn is None or self.conn.closed:
+                self.conn = nhl_shifts.connect_to_database()
+                self.conn.autocommit = True
+
+            try:
+                with nhl_metrics.stage("api_query"), self.conn.cursor() as cur:
+                    return handler(cur, *ids)
+            except psycopg2.OperationalError:
+                self.conn.close()
+                raise
+
+    def render(self, path):
+        if path == "/metrics":
+            return "200 OK", None, nhl_metrics.format_prometheus().encode("utf-8")
+
+        for pattern, handler in ROUTES:
+            match = pattern.match(path)
+            if match is None:
+                continue
+
+            response = self.cache.get(path)
+            if response is not None:
+                nhl_metrics.incr("api_cache_hits")
+                return ("200 OK",) + response
+
+            nhl_metrics.incr("api_cache_misses")
+            generation = self.cache.generation
+            data = self.query(handler, [int(value) for value in match.groups()])
+            if data is None:
+                return (
+                    "404 Not Found",
+                    None,
+                    json.dumps({"error": "not found"}).encode(),
+                )
+
+            body = json.dumps(data, default=str, sort_keys=True).encode("utf-8")
+            etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+            self.cache.put(path, etag, body, generation)
+
+            return "200 OK", etag, body
+
+        return "404 Not Found", None, json.dumps({"error": "not found"}).encode()
+
+    def __call__(self, environ, start_response):
+        self.start_listener()
+        nhl_metrics.incr("api_requests")
+
+        method = environ["REQUEST_METHOD"]
+        if method not in ("GET", "HEAD"):
+            start_response("405 Method Not Allowed", [("Allow", "GET, HEAD")])
+            return [b""]
+
+        try:
+            status, etag, body = self.render(environ.get("PATH_INFO", "/"))
+        except psycopg2.Error as err:
+            print("database error: {}".format(err))
+            status, etag, body = (
+                "503 Service Unavailable",
+                None,
+                json.dumps({"error": "database unavailable"}).encode(),
+            )
+
+        content_type = "application/json"
+        if environ.get("PATH_INFO") == "/metrics":
+            content_type = "text/plain; version=0.0.4"
+
+        # clients keep what they have, but check back with us every time
+        headers = [("Content-Type", content_type), ("Cache-Control", "no-cache")]
+        if etag:
+            headers.append(("ETag", etag))
+
+            # pollers that already have these lines get an empty 304
+            if etag in environ.get("HTTP_IF_NONE_MATCH", ""):
+                nhl_metrics.incr("api_not_modified")
+                start_response("304 Not Modified", headers)
+                return [b""]
+
+        headers.append(("Content-Length", str(len(body))))
+        start_response(status, headers)
+
+        if method == "HEAD":
+            return [b""]
+
+        return [body]
+
+
+app = LinesApp()
+
+
+def main():
+    unixOptions = "hp:"
+    gnuOptions = ["help", "port="]
+
+    try:
+        arguments, values = getopt.getopt(sys.argv[1:], unixOptions, gnuOptions)
+    except getopt.error as err:
+        # output error, and return with an error code
+        print(str(err))
+        sys.exit(2)
+
+    port = int(os.environ.get("PORT", 8000))
+    for currentArgument, currentValue in arguments:
+        if currentArgument in ("-h", "--help"):
+            print("usage: python nhl_api.py [--port N]")
+            return
+        elif currentArgument in ("-p", "--port"):
+            port = int(currentValue)
+
+    # a single threaded development server, production runs under gunicorn
+    print("serving lines on port {}".format(port))
+    simple_server.make_server("", port, app).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+import os
+import time
+
+import numpy as np
+
+# where archived shifts live, one directory per season
+DEFAULT_ARCHIVE_DIR = os.environ.get("NHL_ARCHIVE_DIR", ".nhl_archive")
+
+# one row per shift, player is an index into that game and team's players
+SHIFT_COLUMNS = {
+    "player": np.int32,
+    "period": np.int8,
+    "start": np.int32,
+    "end": np.int32,
+}
+
+# one row per player per game and team, what the lines need to know about them
+# (rostered is whether they were on the team's roster at all)
+PLAYER_COLUMNS = {
+    "player_ids": np.int64,
+    "name": "U64",
+    "position": "U2",
+    "faceoffs": np.int32,
+    "rostered": np.bool_,
+}
+
+# a season is compacted back into a single part once it has more than this
+# many, each write adds one (a date at a time in a backfill)
+MAX_PARTS = 32
+
+# one row per game and team, where its shifts and players are in the columns
+INDEX_DTYPE = np.dtype(
+    [
+        ("game_id", np.int64),
+        ("team_id", np.int32),
+        ("date", "U10"),
+        ("shift_offset", np.int64),
+        ("shift_count", np.int64),
+        ("player_offset", np.int64),
+        ("player_count", np.int64),
+    ]
+)
+
+
+def get_season(game_id):
+
+    # get start/end year for season
+    start_year = int(str(game_id)[0:4])
+
+    return "{}{}".format(start_year, start_year + 1)
+
+
+class ShiftArchive:
+    def __init__(self, path=DEFAULT_ARCHIVE_DIR):
+        self.path = path
+
+        # season -> {(game_id, team_id): (part, row in its index)}
+        self.seasons = {}
+
+        # season -> player_ids with the game_id and team_id of each game they
+        # have shifts in, sorted by player
+        self.player_indexes = {}
+
+        os.makedirs(path, exist_ok=True)
+
+    def season_path(self, season):
+        return os.path.join(self.path, str(season))
+
+    def write_games(self, games):
+
+        # games are {game_id: {"date", "shifts", "players", "player_stats"}},
+        # with shifts and players keyed by team
+        games_by_season = {}
+        for game_id, game in games.items():
+            games_by_season.setdefault(get_season(game_id), {})[game_id] = game
+
+        for season, season_games in games_by_season.items():
+            self.write_part(season, season_games)
+
+            # every part is another set of files to map on each read
+            if len(self.part_names(season)) > MAX_PARTS:
+                self.compact(season)
+
+    def part_names(self, season):
+        season_path = self.season_path(season)
+        if not os.path.isdir(season_path):
+            return []
+
+        return sorted(
+            name for name in os.listdir(season_path) if name.startswith("part-")
+        )
+
+    def forget_season(self, season):
+
+        # pick up changed parts on the next read
+        self.seasons.pop(season, None)
+        self.player_indexes.pop(season, None)
+
+    def write_part(self, season, games):
+        index = []
+        shift_columns = {column: [] for column in SHIFT_COLUMNS}
+        player_columns = {column: [] for column in PLAYER_COLUMNS}
+        shift_offset = 0
+        player_offset = 0
+
+        for game_id, game in sorted(games.items()):
+            for team_id, shift_table in sorted(game["shifts"].items()):
+                players = game["players"][team_id]
+                player_ids = shift_table["player_ids"].tolist()
+                shift_count = len(shift_table["start"])
+
+                for column in SHIFT_COLUMNS:
+                    shift_columns[column].append(shift_table[column])
+
+                # players missing from the roster keep their shifts, but
+                # nothing else is known about them
+                player_columns["player_ids"].append(shift_table["player_ids"])
+                player_columns["rostered"].append([p in players for p in player_ids])
+                player_columns["name"].append(
+                    [players.get(p, {}).get("name", "") for p in player_ids]
+                )
+                player_columns["position"].append(
+                    [players.get(p, {}).get("position", "") for p in player_ids]
+                )
+                player_columns["faceoffs"].append(
+                    [
+                        game["player_stats"].get(p, {}).get("faceoffTaken", 0)
+                        for p in player_ids
+                    ]
+                )
+
+                index.append(
+                    (
+                        game_id,
+                        team_id,
+                        game["date"],
+                        shift_offset,
+                        shift_count,
+                        player_offset,
+                        len(player_ids),
+                    )
+                )
+                shift_offset += shift_count
+                player_offset += len(player_ids)
+
+        if not index:
+            return
+
+        # write the part somewhere hidden first, readers only ever see whole
+        # parts, named so they sort in the order they were written
+        season_path = self.season_path(season)
+        os.makedirs(season_path, exist_ok=True)
+        name = "part-{:020d}-{}".format(time.time_ns(), os.getpid())
+        tmp_path = os.path.join(season_path, "." + name)
+        os.makedirs(tmp_path)
+
+        np.save(os.path.join(tmp_path, "index.npy"), np.array(index, dtype=INDEX_DTYPE))
+        for column, dtype in SHIFT_COLUMNS.items():
+            np.save(
+                os.path.join(tmp_path, column + ".npy"),
+                np.concatenate(shift_columns[column]).astype(dtype),
+            )
+        for column, dtype in PLAYER_COLUMNS.items():
+            np.save(
+                os.path.join(tmp_path, column + ".npy"),
+                np.concatenate(
+                    [
+                        np.asarray(values, dtype=dtype)
+                        for values in player_columns[column]
+                    ]
+                ),
+            )
+
+        os.replace(tmp_path, os.path.join(season_path, name))
+
+        self.forget_season(season)
+
+    def load_season(self, season):
+        if season in self.seasons:
+            return self.seasons[season]
+
+        entries = {}
+        season_path = self.season_path(season)
+
+        for name in self.part_names(season):
+
+            # map the columns rather than reading them, a game is a slice
+            part_path = os.path.join(season_path, name)
+            part = {"index": np.load(os.path.join(part_path, "index.npy"))}
+            for column in list(SHIFT_COLUMNS) + list(PLAYER_COLUMNS):
+                column_path = os.path.join(part_path, column + ".npy")
+                if column == "rostered" and not os.path.exists(column_path):
+                    # parts written before the column, everyone on a roster
+                    # has a position
+                    part[column] = part["position"] != ""
+                    continue
+
+                part[column] = np.load(column_path, mmap_mode="r")
+
+            # a game written again (a re-run) replaces what was there before
+            for row, entry in enumerate(part["index"]):
+                entries[(int(entry["game_id"]), int(entry["team_id"]))] = (part, row)
+
+        self.seasons[season] = entries
+        self.player_indexes[season] = self.make_player_index(entries)
+
+        return entries
+
+    def make_player_index(self, entries):
+
+        # the rows of each part still in use (not written over by a later one)
+        part_rows = {}
+        for part, row in entries.values():
+            part_rows.setdefault(id(part), (part, []))[1].append(row)
+
+        player_ids = [np.zeros(0, dtype=np.int64)]
+        game_ids = [np.zeros(0, dtype=np.int64)]
+        team_ids = [np.zeros(0, dtype=np.int32)]
+        for part, rows in part_rows.values():
+            index = part["index"][rows]
+            counts = index["player_count"]
+
+            # every player row of those entries, ie. the ranges
+            # [player_offset, player_offset + player_count) laid end to end
+            player_rows = np.arange(counts.sum()) + np.repeat(
+                index["player_offset"] - (np.cumsum(counts) - counts), counts
+            )
+            player_ids.append(np.asarray(part["player_ids"][player_rows]))
+            game_ids.append(np.repeat(index["game_id"], counts))
+            team_ids.append(np.repeat(index["team_id"], counts))
+
+        player_ids = np.concatenate(player_ids)
+        game_ids = np.concatenate(game_ids)
+        team_ids = np.concatenate(team_ids)
+        order = np.lexsort((team_ids, game_ids, player_ids))
+
+        return {
+            "player_ids": player_ids[order],
+            "game_ids": game_ids[order],
+            "team_ids": team_ids[order],
+        }
+
+    def game_ids(self, season):
+        return sorted({game_id for game_id, _ in self.load_season(season)})
+
+    def read_game(self, entries, game_id):
+        game = {"shifts": {}, "players": {}, "player_stats": {}}
+
+        for (entry_game_id, team_id), (part, row) in entries.items():
+            if entry_game_id != game_id:
+                continue
+
+            entry = part["index"][row]
+            shifts = slice(
+                entry["shift_offset"], entry["shift_offset"] + entry["shift_count"]
+            )
+            players = slice(
+                entry["player_offset"], entry["player_offset"] + entry["player_count"]
+            )
+
+            # views into the mapped columns, nothing is copied
+            shift_table = {"player_ids": part["player_ids"][players]}
+            for column in SHIFT_COLUMNS:
+                shift_table[column] = part[column][shifts]
+
+            game["date"] = str(entry["date"])
+            game["shifts"][team_id] = shift_table
+
+            # the (small) roster and faceoff lookups the lines are built with,
+            # players who weren't on the roster stay out of it (as they were
+            # when the game was parsed)
+            team_players = {}
+            for player_id, rostered, name, position, faceoffs in zip(
+                part["player_ids"][players].tolist(),
+                part["rostered"][players].tolist(),
+                part["name"][players].tolist(),
+                part["position"][players].tolist(),
+                part["faceoffs"][players].tolist(),
+            ):
+                if rostered:
+                    team_players[player_id] = {"name": name, "position": position}
+                game["player_stats"][player_id] = {"faceoffTaken": faceoffs}
+
+            game["players"][team_id] = team_players
+
+        return game
+
+    def load_game(self, game_id):
+        return self.read_game(self.load_season(get_season(game_id)), game_id)
+
+    def iter_season(self, season):
+        entries = self.load_season(season)
+
+        # group the index by game once, rather than scanning it per game
+        games = {}
+        for game_id, team_id in entries:
+            games.setdefault(game_id, {})[(game_id, team_id)] = entries[
+                (game_id, team_id)
+            ]
+
+        for game_id in sorted(games):
+            yield game_id, self.read_game(games[game_id], game_id)
+
+    def get_player_games(self, season, player_id):
+
+        # (game_id, team_id) for every game a player has shifts in
+        self.load_season(season)
+        player_index = self.player_indexes[season]
+        first, last = np.searchsorted(
+            player_index["player_ids"], [player_id, player_id + 1]
+        )
+
+        return list(
+            zip(
+                player_index["game_ids"][first:last].tolist(),
+                player_index["team_ids"][first:last].tolist(),
+            )
+        )
+
+    def compact(self, season):
+
+        # rewrite the season as a single part, dropping games written over
+        old_parts = self.part_names(season)
+        if len(old_parts) <= 1:
+            return
+
+        self.write_part(season, dict(self.iter_season(season)))
+
+        for name in old_parts:
+            part_path = os.path.join(self.season_path(season), name)
+            for column_file in os.listdir(part_path):
+                os.remove(os.path.join(part_path, column_file))
+            os.rmdir(part_path)
+
+        self.forget_season(season)
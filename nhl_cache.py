@@ -0,0 +1,230 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import time
+
+import nhl_client
+import nhl_metrics
+
+# where cached responses live, and how many (compressed) bytes they may use
+DEFAULT_CACHE_DIR = os.environ.get("NHL_CACHE_DIR", ".nhl_cache")
+DEFAULT_MAX_BYTES = int(os.environ.get("NHL_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+        os.makedirs(path, exist_ok=True)
+
+        # the index tracks validators and access times, bodies are gzip files
+        self.db = sqlite3.connect(os.path.join(path, "index.sqlite"))
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                   url TEXT PRIMARY KEY,
+                   etag TEXT,
+                   last_modified TEXT,
+                   final INTEGER NOT NULL,
+                   size INTEGER NOT NULL,
+                   accessed REAL NOT NULL
+               )"""
+        )
+        self.db.commit()
+
+    def body_path(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, key + ".gz")
+
+    def lookup(self, url):
+        row = self.db.execute(
+            "SELECT etag, last_modified, final FROM responses WHERE url=?", [url]
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        body_path = self.body_path(url)
+        if not os.path.exists(body_path):
+            # the body went missing underneath us, treat it as a miss
+            self.forget(url)
+            return None
+
+        etag, last_modified, final = row
+        return {
+            "path": body_path,
+            "etag": etag,
+            "last_modified": last_modified,
+            "final": bool(final),
+        }
+
+    def revalidation_headers(self, entry):
+        headers = {}
+
+        if entry is None:
+            return headers
+
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        return headers
+
+    def touch(self, url, final=False):
+        # a finished game's response never needs to be revalidated again
+        self.db.execute(
+            "UPDATE responses SET accessed=?, final=MAX(final, ?) WHERE url=?",
+            [time.time(), int(final), url],
+        )
+        self.db.commit()
+
+    def open_for_store(self, url):
+
+        # write to a temporary file first so readers never see a partial body
+        return gzip.open(self.body_path(url) + ".tmp", "wb")
+
+    def store(self, url, body, headers, final=False):
+        with self.open_for_store(url) as f:
+            f.write(body)
+
+        return self.commit(url, headers, final)
+
+    def commit(self, url, headers, final=False):
+        body_path = self.body_path(url)
+        os.replace(body_path + ".tmp", body_path)
+
+        self.db.execute(
+            """INSERT OR REPLACE INTO responses(url, etag, last_modified, final, size, accessed)
+               VALUES(?, ?, ?, ?, ?, ?)""",
+            [
+                url,
+                headers.get("ETag"),
+                headers.get("Last-Modified"),
+                int(final),
+                os.path.getsize(body_path),
+                time.time(),
+            ],
+        )
+        self.db.commit()
+
+        self.evict()
+
+        return body_path
+
+    def forget(self, url):
+        self.db.execute("DELETE FROM responses WHERE url=?", [url])
+        self.db.commit()
+
+        try:
+            os.remove(self.body_path(url))
+        except OSError:
+            pass
+
+    def evict(self):
+        total = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+        if total <= self.max_bytes:
+            return
+
+        # drop least recently used responses until we are back under budget
+        rows = self.db.execute(
+            "SELECT url, size FROM responses ORDER BY accessed"
+        ).fetchall()
+
+        for url, size in rows:
+            if total <= self.max_bytes:
+                break
+
+            print("evicting {} from the response cache".format(url))
+            self.forget(url)
+            total -= size
+
+
+def open_body(body_path):
+
+    # bodies are stored compressed, this decompresses as it is read
+    return gzip.open(body_path, "rb")
+
+
+cache = None
+
+
+def get_cache():
+    global cache
+
+    # share one cache (and sqlite connection) per process
+    if cache is None:
+        cache = ResponseCache()
+
+    return cache
+
+
+def read_body(body_path):
+    with open_body(body_path) as f:
+        return f.read()
+
+
+def cached_get(url, final=False):
+    response_cache = get_cache()
+    entry = response_cache.lookup(url)
+
+    # finished games never change, so don't even ask the server
+    if entry is not None and entry["final"]:
+        nhl_metrics.incr("cache_hits")
+        response_cache.touch(url)
+        return read_body(entry["path"])
+
+    # imported here, the pipelines fetch with nhl_fetch and never need it
+    import requests
+
+    # get the html, revalidating anything we already have, and retrying
+    # throttled, failed and timed out requests
+    bucket = nhl_client.get_bucket(url)
+    for attempt in range(nhl_client.MAX_ATTEMPTS):
+        last_attempt = attempt == nhl_client.MAX_ATTEMPTS - 1
+        retry_after = None
+
+        time.sleep(bucket.reserve())
+
+        nhl_metrics.incr("http_requests")
+        start = time.perf_counter()
+        try:
+            html = requests.get(
+                url,
+                headers=response_cache.revalidation_headers(entry),
+                timeout=(nhl_client.CONNECT_TIMEOUT, nhl_client.READ_TIMEOUT),
+            )
+        except (requests.ConnectionError, requests.Timeout) as err:
+            if last_attempt:
+                raise
+            reason = repr(err)
+        else:
+            nhl_metrics.observe(url, time.perf_counter() - start)
+            if not nhl_client.is_retryable(html.status_code):
+                bucket.succeeded()
+                break
+            if last_attempt:
+                break
+
+            reason = "{} {}".format(html.status_code, html.reason)
+            retry_after = html.headers.get("Retry-After")
+            if html.status_code == 429:
+                bucket.throttled()
+
+        nhl_client.record_retry(url, attempt, reason)
+        time.sleep(nhl_client.get_backoff(attempt, retry_after))
+
+    if html.status_code == 304 and entry is not None:
+        nhl_metrics.incr("cache_revalidations")
+        response_cache.touch(url, final)
+        return read_body(entry["path"])
+
+    html.raise_for_status()
+    nhl_metrics.incr("http_bytes", len(html.content))
+    response_cache.store(url, html.content, html.headers, final)
+
+    return html.content
@@ -0,0 +1,172 @@
+import os
+import random
+import threading
+import time
+from urllib import parse
+
+import nhl_metrics
+
+# requests per second allowed to each host, and how many can go at once
+DEFAULT_RATE = float(os.environ.get("NHL_RATE_LIMIT", 10))
+DEFAULT_BURST = int(os.environ.get("NHL_RATE_BURST", 20))
+
+# how often a request is tried before giving up, and the backoff between
+# tries: a random wait of up to BACKOFF_BASE * 2 ** attempt, capped
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30
+
+# responses worth retrying, everything else (ie. a 404) fails straight away
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# the lowest a host's rate is cut to, however often it throttles us
+MINIMUM_RATE = 0.5
+
+# seconds before giving up on connecting, and on a stalled response
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+
+# a response slower than this counts against the host, like an error does
+LATENCY_TARGET = float(os.environ.get("NHL_LATENCY_TARGET", 2.0))
+
+# how far past the starting concurrency (--concurrency) a host may be pushed
+# while it keeps responding quickly
+CONCURRENCY_HEADROOM = 4
+
+# at most one rate or concurrency cut per this many seconds, the requests
+# already in flight when the host pushed back shouldn't each cut it again
+DECREASE_INTERVAL = 1.0
+
+
+class TokenBucket:
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.rate = rate
+        self.configured_rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.last_decrease = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+
+        # take a token, returning how long to wait until it's really ours
+        # (tokens can go negative, each waiter queues behind the last)
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+
+            if self.tokens >= 0:
+                return 0
+
+            return -self.tokens / self.rate
+
+    def throttled(self):
+
+        # a 429 means we're over the host's limit, halve our rate (once for
+        # all the requests throttled together)
+        nhl_metrics.incr("http_throttled")
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_decrease < DECREASE_INTERVAL:
+                return
+
+            self.last_decrease = now
+            self.rate = max(MINIMUM_RATE, self.rate / 2)
+
+    def succeeded(self):
+
+        # and creep back up towards the configured rate as requests go through
+        if self.rate < self.configured_rate:
+            with self.lock:
+                self.rate = min(self.configured_rate, self.rate + 0.1)
+
+
+class AdaptiveLimit:
+    def __init__(self, initial, maximum, minimum=1):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.last_decrease = 0
+
+    def current(self):
+        return int(self.limit)
+
+    def succeeded(self, seconds):
+        if seconds > LATENCY_TARGET:
+            self.backed_off()
+            return
+
+        # additive increase: about one more request in flight for every
+        # limit's worth of good responses
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def backed_off(self):
+
+        # multiplicative decrease, once per burst of bad responses
+        now = time.monotonic()
+        if now - self.last_decrease < DECREASE_INTERVAL:
+            return
+
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+        nhl_metrics.incr("concurrency_decreases")
+
+
+# host -> TokenBucket and AdaptiveLimit, shared by every request (and fetch
+# path) in a process so what one batch learned carries over to the next
+buckets = {}
+limits = {}
+
+
+def get_bucket(url):
+    host = parse.urlparse(url).netloc
+    bucket = buckets.get(host)
+    if bucket is None:
+        bucket = buckets.setdefault(host, TokenBucket())
+
+    return bucket
+
+
+def get_limit(url, concurrency):
+    host = parse.urlparse(url).netloc
+    limit = limits.get(host)
+    if limit is None:
+        limit = limits.setdefault(
+            host, AdaptiveLimit(concurrency, concurrency * CONCURRENCY_HEADROOM)
+        )
+
+    return limit
+
+
+def is_retryable(status):
+    return status in RETRY_STATUSES
+
+
+def get_backoff(attempt, retry_after=None):
+
+    # full jitter, so clients that failed together don't retry together
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+
+    # but never sooner than a 429 or 503 asked us to wait
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            # an HTTP date rather than seconds, just use our own backoff
+            pass
+
+    return delay
+
+
+def record_retry(url, attempt, reason):
+    nhl_metrics.incr("http_retries")
+    print(
+        "retrying {} (attempt {} of {}): {}".format(
+            url, attempt + 2, MAX_ATTEMPTS, reason
+        )
+    )
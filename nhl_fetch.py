@@ -0,0 +1,186 @@
+import asyncio
+import time
+
+import nhl_cache
+import nhl_client
+import nhl_metrics
+
+# default number of requests allowed in flight at once
+DEFAULT_CONCURRENCY = 8
+
+# seconds before a single request (with its body) is abandoned
+REQUEST_TIMEOUT = 60
+
+# bytes read from the network at a time
+CHUNK_SIZE = 64 * 1024
+
+
+class ConcurrencyLimiter:
+    def __init__(self, adaptive_limit):
+        self.adaptive_limit = adaptive_limit
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+
+        # wait for a slot under the host's current (moving) limit
+        async with self.condition:
+            await self.condition.wait_for(
+                lambda: self.in_flight < self.adaptive_limit.current()
+            )
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+
+async def fetch_url(session, response_cache, url, final, limiters, concurrency):
+
+    # imported here, along with the rest of aiohttp in fetch_urls_async
+    import aiohttp
+
+    entry = response_cache.lookup(url)
+
+    # finished games never change, so don't even ask the server
+    if entry is not None and entry["final"]:
+        nhl_metrics.incr("cache_hits")
+        response_cache.touch(url)
+        return entry["path"]
+
+    headers = response_cache.revalidation_headers(entry)
+
+    bucket = nhl_client.get_bucket(url)
+    adaptive_limit = nhl_client.get_limit(url, concurrency)
+    limiter = limiters.get(adaptive_limit)
+    if limiter is None:
+        limiter = limiters[adaptive_limit] = ConcurrencyLimiter(adaptive_limit)
+
+    for attempt in range(nhl_client.MAX_ATTEMPTS):
+        last_attempt = attempt == nhl_client.MAX_ATTEMPTS - 1
+        retry_after = None
+
+        await asyncio.sleep(bucket.reserve())
+
+        async with limiter:
+            nhl_metrics.incr("http_requests")
+            start = time.perf_counter()
+
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304 and entry is not None:
+                        seconds = time.perf_counter() - start
+                        nhl_metrics.observe(url, seconds)
+                        nhl_metrics.incr("cache_revalidations")
+                        bucket.succeeded()
+                        adaptive_limit.succeeded(seconds)
+                        response_cache.touch(url, final)
+                        return entry["path"]
+
+                    if nhl_client.is_retryable(response.status) and not last_attempt:
+                        reason = "{} {}".format(response.status, response.reason)
+                        retry_after = response.headers.get("Retry-After")
+                        if response.status == 429:
+                            bucket.throttled()
+                    else:
+                        response.raise_for_status()
+
+                        # stream the body straight into the cache rather than
+                        # holding it, a retry starts the stored body over
+                        with response_cache.open_for_store(url) as f:
+                            async for chunk in response.content.iter_chunked(
+                                CHUNK_SIZE
+                            ):
+                                nhl_metrics.incr("http_bytes", len(chunk))
+                                f.write(chunk)
+
+                        seconds = time.perf_counter() - start
+                        nhl_metrics.observe(url, seconds)
+                        bucket.succeeded()
+                        adaptive_limit.succeeded(seconds)
+
+                        return response_cache.commit(url, response.headers, final)
+
+            except aiohttp.ClientResponseError:
+                # a status we don't retry (a 404), or the last attempt's
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                # timeouts, refused and dropped connections
+                if last_attempt:
+                    raise
+                reason = repr(err)
+
+        # the host is struggling, ease off it before trying again
+        adaptive_limit.backed_off()
+        nhl_client.record_retry(url, attempt, reason)
+        await asyncio.sleep(nhl_client.get_backoff(attempt, retry_after))
+
+
+async def fetch_urls_async(urls, concurrency, final_urls):
+
+    # imported here so code that only needs DEFAULT_CONCURRENCY (or workers
+    # reading cached responses) starts without loading aiohttp
+    import aiohttp
+
+    response_cache = nhl_cache.get_cache()
+
+    # the connector pools keep-alive connections, how many requests go to
+    # each host at once is up to that host's adaptive limit
+    connector = aiohttp.TCPConnector(
+        limit=0, limit_per_host=concurrency * nhl_client.CONCURRENCY_HEADROOM
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=REQUEST_TIMEOUT,
+        sock_connect=nhl_client.CONNECT_TIMEOUT,
+        sock_read=nhl_client.READ_TIMEOUT,
+    )
+
+    # one slot queue per host for this batch
+    limiters = {}
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+
+        # one url failing (a 404, or running out of retries) shouldn't take
+        # the rest of the batch down with it
+        results = await asyncio.gather(
+            *[
+                fetch_url(
+                    session,
+                    response_cache,
+                    url,
+                    url in final_urls,
+                    limiters,
+                    concurrency,
+                )
+                for url in urls
+            ],
+            return_exceptions=True,
+        )
+
+    body_paths = {}
+    for url, result in zip(urls, results):
+        if isinstance(result, (aiohttp.ClientError, asyncio.TimeoutError)):
+            print(
+                "Error: failed to fetch {}: {}".format(url, str(result) or repr(result))
+            )
+            nhl_metrics.incr("http_failures")
+        elif isinstance(result, BaseException):
+            # anything else is a bug, not the network
+            raise result
+        else:
+            body_paths[url] = result
+
+    return body_paths
+
+
+def fetch_urls(urls, concurrency=DEFAULT_CONCURRENCY, final_urls=()):
+
+    # drop duplicate urls (a team's roster is shared by its games), keeping order
+    unique_urls = list(dict.fromkeys(urls))
+
+    print("fetching {} urls, concurrency={}".format(len(unique_urls), concurrency))
+
+    # returns the cached body path for each url fetched, open them with
+    # nhl_cache.open_body, urls that failed are left out
+    return asyncio.run(fetch_urls_async(unique_urls, concurrency, set(final_urls)))
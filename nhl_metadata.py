@@ -1,9 +1,28 @@
+import getopt
+import json
 # postgres imports
 import os
+import sys
 from urllib import parse
 
 import psycopg2
-import requests
+import psycopg2.extras
+
+import nhl_cache
+import nhl_fetch
+
+# columns synced into each table (tables are in create_metadata.sql), the
+# first is the primary key the upserts conflict on
+TEAM_COLUMNS = [
+    "team_id",
+    "name",
+    "location",
+    "venue",
+    "team_name",
+    "division",
+    "conference",
+]
+PLAYER_COLUMNS = ["player_id", "team_id", "name", "position", "number"]
 
 
 def get_nhl_teams_url():
@@ -23,18 +42,7 @@ def get_records_nhl_team_players_url(team_id):
     return url
 
 
-def get_nhl_teams():
-    teams_url = get_nhl_teams_url()
-
-    # get the html
-    html = requests.get(teams_url)
-    data = html.json()
-
-    teams_data = data["teams"]
-    return teams_data
-
-
-def write_player_to_database(player_id, team_id, player_name, position, player_number):
+def connect_to_database():
 
     # set up postgres connection
     parse.uses_netloc.append("postgres")
@@ -48,153 +56,191 @@ def write_player_to_database(player_id, team_id, player_name, position, player_n
         port=url.port,
     )
 
-    cur = conn.cursor()
+    return conn
 
-    # Delete this player_id
-    delete_sql = """DELETE FROM players WHERE player_id=%s"""
 
-    # execute the DELETE statement
-    cur.execute(delete_sql, [player_id])
+def get_nhl_teams():
+    teams_url = get_nhl_teams_url()
 
-    sql = """INSERT INTO players(player_id, team_id, name, position, number)
-             VALUES(%s, %s, %s, %s, %s);"""
+    # get the html
+    html = nhl_cache.cached_get(teams_url)
+    data = json.loads(html)
 
-    # INSERT INTO the_table(id, column_1, column_2)
-    # VALUES(1, 'A', 'X'), (2, 'B', 'Y'), (3, 'C', 'Z')
-    # ON CONFLICT(id) DO UPDATE SET
-    # column_1 = excluded.column_1,
-    # column_2 = excluded.column_2;
+    return parse_teams(data)
 
-    print(
-        "INSERTING player_id={} team_id={} name={} position={} number={}".format(
-            player_id, team_id, player_name, position, player_number
-        )
-    )
 
-    # execute the INSERT statement
-    cur.execute(sql, (player_id, team_id, player_name, position, player_number))
+def parse_teams(data):
 
-    # close communication with the PostgreSQL database server
-    cur.close()
+    # team_id -> row, in TEAM_COLUMNS order
+    teams = {}
+    for team in data["teams"]:
+        teams[team["id"]] = (
+            team["id"],
+            team["name"],
+            team["locationName"],
+            team["venue"]["name"],
+            team["teamName"],
+            team["division"]["id"],
+            team["conference"]["id"],
+        )
 
-    # commit the changes
-    conn.commit()
+    return teams
 
-    return
 
+def parse_records_team_players(team_id, data):
 
-def write_team_to_database(
-    team_id, name, location, venue, team_name, division, conference
-):
+    # player_id -> row, in PLAYER_COLUMNS order
+    players = {}
+    for player in data["data"]:
 
-    # set up postgres connection
-    parse.uses_netloc.append("postgres")
-    url = parse.urlparse(os.environ["DATABASE_URL"])
+        # jersey numbers aren't always set, default to zero
+        if "sweaterNumber" in player:
+            player_number = player["sweaterNumber"]
+        else:
+            player_number = 0
 
-    conn = psycopg2.connect(
-        database=url.path[1:],
-        user=url.username,
-        password=url.password,
-        host=url.hostname,
-        port=url.port,
-    )
+        players[player["id"]] = (
+            player["id"],
+            team_id,
+            player["fullName"],
+            player["position"],
+            player_number,
+        )
 
-    cur = conn.cursor()
+    return players
 
-    # Delete this player_id
-    delete_sql = """DELETE FROM teams WHERE team_id=%s"""
 
-    # execute the DELETE statement
-    cur.execute(delete_sql, [team_id])
+def parse_team_players(team_id, data):
 
-    sql = """INSERT INTO teams(team_id, name, location, venue, team_name, division, conference)
-             VALUES(%s, %s, %s, %s, %s, %s, %s);"""
+    # the same rows from the statsapi roster
+    players = {}
+    for player in data["teams"][0]["roster"]["roster"]:
 
-    # INSERT INTO the_table(id, column_1, column_2)
-    # VALUES(1, 'A', 'X'), (2, 'B', 'Y'), (3, 'C', 'Z')
-    # ON CONFLICT(id) DO UPDATE SET
-    # column_1 = excluded.column_1,
-    # column_2 = excluded.column_2;
+        # jersey numbers aren't always set, default to zero
+        if "jerseyNumber" in player:
+            player_number = player["jerseyNumber"]
+        else:
+            player_number = 0
 
-    print(
-        "INSERTING team_id={} name={} location={} venue={} team_name={} division={} conference={}".format(
-            team_id, name, location, venue, team_name, division, conference
+        players[player["person"]["id"]] = (
+            player["person"]["id"],
+            team_id,
+            player["person"]["fullName"],
+            player["position"]["code"],
+            player_number,
         )
-    )
 
-    # execute the INSERT statement
-    cur.execute(sql, (team_id, name, location, venue, team_name, division, conference))
+    return players
 
-    # close communication with the PostgreSQL database server
-    cur.close()
 
-    # commit the changes
-    conn.commit()
+def get_team_rosters(team_ids, concurrency):
 
-    return
+    # fetch every team's roster at once
+    urls = {team_id: get_records_nhl_team_players_url(team_id) for team_id in team_ids}
+    responses = nhl_fetch.fetch_urls(list(urls.values()), concurrency)
 
+    # a player listed by two teams ends up with the last one, as before
+    players = {}
+    for team_id, url in urls.items():
 
-def get_records_team_players(team_id):
-    players_url = get_records_nhl_team_players_url(team_id)
+        # a team whose roster couldn't be fetched keeps the players it has
+        if url not in responses:
+            print("Error: skipping roster for team_id={}".format(team_id))
+            continue
 
-    # get the html
-    html = requests.get(players_url)
-    data = html.json()
+        with nhl_cache.open_body(responses[url]) as f:
+            players.update(parse_records_team_players(team_id, json.load(f)))
 
-    roster = data["data"]
+    return players
 
-    for player in roster:
-        player_id = player["id"]
-        player_name = player["fullName"]
-        position = player["position"]
-        handedness = player["shootsCatches"]
 
-        # jersey numbers aren't always set, default to zero
-        if "sweaterNumber" in player:
-            player_number = player["sweaterNumber"]
-        else:
-            player_number = 0
+def read_rows(cur, table, columns):
+    cur.execute("SELECT {} FROM {}".format(", ".join(columns), table))
+    return {row[0]: row for row in cur.fetchall()}
 
-        write_player_to_database(
-            player_id, team_id, player_name, position, player_number
-        )
 
+def upsert_rows(cur, table, columns, rows):
 
-def get_team_players(team_id):
-    players_url = get_nhl_team_players_url(team_id)
+    # one statement for every changed row, keyed on the first column
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO {} ({}) VALUES %s ON CONFLICT ({}) DO UPDATE SET {}".format(
+            table,
+            ", ".join(columns),
+            columns[0],
+            ", ".join("{0} = EXCLUDED.{0}".format(column) for column in columns[1:]),
+        ),
+        rows,
+    )
 
-    # get the html
-    html = requests.get(players_url)
-    data = html.json()
 
-    roster = data["teams"][0]["roster"]["roster"]
+def sync_rows(cur, table, columns, rows):
 
-    for player in roster:
-        player_id = player["person"]["id"]
-        player_name = player["person"]["fullName"]
-        position = player["position"]["code"]
+    # only rows that are new or differ from what's stored get written
+    current_rows = read_rows(cur, table, columns)
+    changed_rows = [row for key, row in rows.items() if current_rows.get(key) != row]
+
+    for row in changed_rows:
+        print(
+            "{} {} {}".format(
+                "UPDATING" if row[0] in current_rows else "INSERTING",
+                table,
+                " ".join(
+                    "{}={}".format(column, value) for column, value in zip(columns, row)
+                ),
+            )
+        )
+
+    if changed_rows:
+        upsert_rows(cur, table, columns, changed_rows)
+
+    return len(changed_rows)
 
-        # jersey numbers aren't always set, default to zero
-        if "jerseyNumber" in player:
-            player_number = player["jerseyNumber"]
-        else:
-            player_number = 0
 
-        write_player_to_database(
-            player_id, team_id, player_name, position, player_number
+def sync_metadata(conn, teams, players):
+
+    # diff and apply both tables in one transaction
+    with conn:
+        with conn.cursor() as cur:
+            teams_written = sync_rows(cur, "teams", TEAM_COLUMNS, teams)
+            players_written = sync_rows(cur, "players", PLAYER_COLUMNS, players)
+
+    print(
+        "UPSERTED {} of {} teams and {} of {} players".format(
+            teams_written, len(teams), players_written, len(players)
         )
+    )
+
+
+def main():
+    unixOptions = "c:h"
+    gnuOptions = ["concurrency=", "help"]
+
+    try:
+        arguments, values = getopt.getopt(sys.argv[1:], unixOptions, gnuOptions)
+    except getopt.error as err:
+        # output error, and return with an error code
+        print(str(err))
+        sys.exit(2)
+
+    concurrency = nhl_fetch.DEFAULT_CONCURRENCY
+    for currentArgument, currentValue in arguments:
+        if currentArgument in ("-h", "--help"):
+            print("usage: python nhl_metadata.py [--concurrency N]")
+            return
+        elif currentArgument in ("-c", "--concurrency"):
+            print(("using concurrency: (%s)") % (currentValue))
+            concurrency = int(currentValue)
 
+    teams = get_nhl_teams()
+    players = get_team_rosters(list(teams), concurrency)
 
-teams = get_nhl_teams()
-for team in teams:
-    team_id = team["id"]
-    name = team["name"]
-    venue = team["venue"]["name"]
-    location = team["locationName"]
-    team_name = team["teamName"]
-    division = team["division"]["id"]
-    conference = team["conference"]["id"]
+    conn = connect_to_database()
+    try:
+        sync_metadata(conn, teams, players)
+    finally:
+        conn.close()
 
-    write_team_to_database(team_id, name, location, venue, team_name, division, conference)
 
-    players = get_records_team_players(team_id)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import contextlib
+import json
+import os
+import re
+import time
+from urllib import parse
+
+# upper bounds (in seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+def new_metrics():
+
+    metrics = {
+        # stage -> {"count", "seconds"}
+        "timers": {},
+        # name -> running total
+        "counters": {},
+        # endpoint -> {"buckets" (one count per bound), "count", "sum"}
+        "histograms": {},
+    }
+
+    return metrics
+
+
+metrics = new_metrics()
+started = time.time()
+
+
+@contextlib.contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_time(name, time.perf_counter() - start)
+
+
+def record_time(name, seconds):
+    timer = metrics["timers"].setdefault(name, {"count": 0, "seconds": 0.0})
+    timer["count"] += 1
+    timer["seconds"] += seconds
+
+
+def incr(name, amount=1):
+    metrics["counters"][name] = metrics["counters"].get(name, 0) + amount
+
+
+def endpoint_name(url):
+
+    # group requests by what they ask for, not which game or team they ask
+    # about, ie. /api/v1/game/2018020001/feed/live -> /api/v1/game/{id}/feed/live
+    # and /site/api/player/byTeam/10 -> /site/api/player/byTeam/{id}
+    url = parse.urlparse(url)
+    return url.netloc + re.sub("(?<=/)[0-9]+(?=/|$)|[0-9]{4,}", "{id}", url.path)
+
+
+def observe(url, seconds):
+    histogram = metrics["histograms"].setdefault(
+        endpoint_name(url),
+        {"buckets": [0] * len(LATENCY_BUCKETS), "count": 0, "sum": 0.0},
+    )
+
+    # buckets are cumulative, like prometheus expects
+    for k, bound in enumerate(LATENCY_BUCKETS):
+        if seconds <= bound:
+            histogram["buckets"][k] += 1
+
+    histogram["count"] += 1
+    histogram["sum"] += seconds
+
+
+def collect():
+    global metrics
+
+    # hand back everything recorded so far and start over, worker processes
+    # return this with their results so the parent can merge it
+    collected = metrics
+    metrics = new_metrics()
+
+    return collected
+
+
+def merge(other):
+    for name, timer in other["timers"].items():
+        total = metrics["timers"].setdefault(name, {"count": 0, "seconds": 0.0})
+        total["count"] += timer["count"]
+        total["seconds"] += timer["seconds"]
+
+    for name, amount in other["counters"].items():
+        incr(name, amount)
+
+    for endpoint, histogram in other["histograms"].items():
+        total = metrics["histograms"].setdefault(
+            endpoint,
+            {"buckets": [0] * len(LATENCY_BUCKETS), "count": 0, "sum": 0.0},
+        )
+        for k, count in enumerate(histogram["buckets"]):
+            total["buckets"][k] += count
+        total["count"] += histogram["count"]
+        total["sum"] += histogram["sum"]
+
+
+def summary():
+
+    # stages that ran in worker processes add up their cpu time across
+    # workers, so compare them against each other rather than wall_seconds
+    return {
+        "wall_seconds": time.time() - started,
+        "timers": metrics["timers"],
+        "counters": metrics["counters"],
+        "histograms": metrics["histograms"],
+        "latency_buckets": LATENCY_BUCKETS,
+    }
+
+
+def format_prometheus():
+    lines = []
+
+    lines.append("# TYPE nhl_run_seconds gauge")
+    lines.append("nhl_run_seconds {}".format(time.time() - started))
+
+    lines.append("# TYPE nhl_stage_seconds_total counter")
+    for name, timer in sorted(metrics["timers"].items()):
+        lines.append(
+            'nhl_stage_seconds_total{{stage="{}"}} {}'.format(name, timer["seconds"])
+        )
+
+    lines.append("# TYPE nhl_stage_runs_total counter")
+    for name, timer in sorted(metrics["timers"].items()):
+        lines.append(
+            'nhl_stage_runs_total{{stage="{}"}} {}'.format(name, timer["count"])
+        )
+
+    for name, amount in sorted(metrics["counters"].items()):
+        lines.append("# TYPE nhl_{}_total counter".format(name))
+        lines.append("nhl_{}_total {}".format(name, amount))
+
+    lines.append("# TYPE nhl_request_latency_seconds histogram")
+    for endpoint, histogram in sorted(metrics["histograms"].items()):
+        for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+            lines.append(
+                'nhl_request_latency_seconds_bucket{{endpoint="{}",le="{}"}} {}'.format(
+                    endpoint, bound, count
+                )
+            )
+        lines.append(
+            'nhl_request_latency_seconds_bucket{{endpoint="{}",le="+Inf"}} {}'.format(
+                endpoint, histogram["count"]
+            )
+        )
+        lines.append(
+            'nhl_request_latency_seconds_sum{{endpoint="{}"}} {}'.format(
+                endpoint, histogram["sum"]
+            )
+        )
+        lines.append(
+            'nhl_request_latency_seconds_count{{endpoint="{}"}} {}'.format(
+                endpoint, histogram["count"]
+            )
+        )
+
+    return "\n".join(lines) + "\n"
+
+
+def write_atomically(path, text):
+
+    # collectors scraping the file never see it half written
+    with open(path + ".tmp", "w") as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+
+def report(summary_path=None, prometheus_path=None):
+
+    # the json summary goes to stdout unless we were given a file for it
+    text = json.dumps(summary(), indent=2, sort_keys=True)
+    if summary_path:
+        write_atomically(summary_path, text + "\n")
+    else:
+        print(text)
+
+    if prometheus_path:
+        write_atomically(prometheus_path, format_prometheus())
@@ -0,0 +1,181 @@
+import numpy as np
+
+import nhl_shift_table
+
+# line masks are int64s, one bit per player in the game
+MAX_PLAYERS = 63
+
+
+def get_strength(skaters, goalie, opposing_skaters, opposing_goalie):
+
+    # a pulled goalie (at either end) is its own situation
+    if not goalie or not opposing_goalie:
+        return "EN"
+
+    # from this team's side, ie. "5v4" on the power play
+    return "{}v{}".format(skaters, opposing_skaters)
+
+
+def make_on_ice_index(shift_tables, goalie_ids):
+
+    # every player in the game as a column, both teams together
+    merged_shifts = nhl_shift_table.merge_shift_tables(shift_tables)
+    player_ids = merged_shifts["player_ids"]
+    if len(player_ids) > MAX_PLAYERS:
+        raise ValueError(
+            "too many players for an on ice index: {}".format(len(player_ids))
+        )
+
+    player_teams = np.zeros(len(player_ids), dtype=np.int32)
+    player_teams[merged_shifts["player"]] = merged_shifts["team"]
+
+    # the change points: who is on the ice only changes when a shift starts
+    # or ends, interval k runs from times[k] up to times[k + 1]
+    times = np.unique(np.concatenate((merged_shifts["start"], merged_shifts["end"])))
+    changes = np.zeros((len(times), len(player_ids)), dtype=np.int32)
+    np.add.at(
+        changes,
+        (np.searchsorted(times, merged_shifts["start"]), merged_shifts["player"]),
+        1,
+    )
+    np.add.at(
+        changes,
+        (np.searchsorted(times, merged_shifts["end"]), merged_shifts["player"]),
+        -1,
+    )
+
+    # a player's shifts can overlap in the data, count them as one
+    on_ice = np.cumsum(changes, axis=0) > 0
+
+    # seconds each player has been on the ice up to each change point
+    lengths = np.diff(times)
+    toi = np.zeros((len(times), len(player_ids)), dtype=np.int32)
+    np.cumsum(on_ice[:-1] * lengths[:, None], axis=0, out=toi[1:])
+
+    bits = np.left_shift(np.int64(1), np.arange(len(player_ids), dtype=np.int64))
+    goalies = np.isin(player_ids, list(goalie_ids))
+
+    # each team's line mask and player counts per interval
+    team_ids = list(shift_tables)
+    masks = {}
+    counts = []
+    for team_id in team_ids:
+        team_players = player_teams == team_id
+        team_on_ice = on_ice[:, team_players]
+        masks[team_id] = team_on_ice @ bits[team_players]
+        team_goalies = goalies[team_players]
+        counts.append(team_on_ice[:, ~team_goalies].sum(axis=1))
+        counts.append(team_on_ice[:, team_goalies].sum(axis=1))
+
+    # only a handful of different counts come up in a game, so label the
+    # strength of each distinct one rather than of every interval
+    unique_counts, count_keys = np.unique(
+        np.stack(counts, axis=1), axis=0, return_inverse=True
+    )
+    strengths = {}
+    for k, team_id in enumerate(team_ids):
+        opposing = 2 * (1 - k)
+        labels = [
+            get_strength(c[2 * k], c[2 * k + 1], c[opposing], c[opposing + 1])
+            for c in unique_counts.tolist()
+        ]
+        strengths[team_id] = np.asarray(labels)[count_keys.reshape(-1)]
+
+    on_ice_index = {
+        "times": times,
+        "player_ids": player_ids,
+        "player_teams": player_teams,
+        "on_ice": on_ice,
+        "toi": toi,
+        "masks": masks,
+        "strengths": strengths,
+    }
+
+    return on_ice_index
+
+
+def find_interval(on_ice_index, time, side="right"):
+
+    # the interval holding time, side="left" asks about the moment just before
+    # time, ie. who was on the ice for a goal rather than the faceoff after it
+    return np.searchsorted(on_ice_index["times"], time, side=side) - 1
+
+
+def on_ice_at(on_ice_index, time, side="right"):
+    k = find_interval(on_ice_index, time, side)
+
+    players = {team_id: [] for team_id in on_ice_index["masks"]}
+    if k < 0 or k >= len(on_ice_index["times"]) - 1:
+        return players
+
+    on_ice = on_ice_index["on_ice"][k]
+    for player_id, team_id in zip(
+        on_ice_index["player_ids"][on_ice].tolist(),
+        on_ice_index["player_teams"][on_ice].tolist(),
+    ):
+        players[team_id].append(player_id)
+
+    return players
+
+
+def toi_at(on_ice_index, time):
+
+    # every player's time on ice from the start of the game up to time
+    times = on_ice_index["times"]
+    k = find_interval(on_ice_index, time)
+    if k < 0:
+        return np.zeros(len(on_ice_index["player_ids"]), dtype=np.int64)
+
+    # after the last change point nobody is on the ice
+    if k >= len(times) - 1:
+        return on_ice_index["toi"][-1]
+
+    return on_ice_index["toi"][k] + on_ice_index["on_ice"][k] * (time - times[k])
+
+
+def window_toi(on_ice_index, start, end):
+
+    # {player_id: seconds} on the ice between start and end
+    toi = toi_at(on_ice_index, end) - toi_at(on_ice_index, start)
+
+    return {
+        player_id: seconds
+        for player_id, seconds in zip(on_ice_index["player_ids"].tolist(), toi.tolist())
+        if seconds
+    }
+
+
+def window_deployments(on_ice_index, start, end):
+
+    # the intervals overlapping the window, clipped to it
+    times = on_ice_index["times"]
+    start = max(start, times[0])
+    end = min(end, times[-1])
+    first = max(find_interval(on_ice_index, start), 0)
+    last = min(np.searchsorted(times, end, side="left"), len(times) - 1)
+
+    lengths = np.minimum(times[first + 1 : last + 1], end) - np.maximum(
+        times[first:last], start
+    )
+
+    # nobody on the ice for either team, ie. between periods
+    anyone = on_ice_index["on_ice"][first:last].any(axis=1) & (lengths > 0)
+
+    # the same shape calculate_toi_deployments gives calculate_lines
+    deployments = {}
+    for team_id, masks in on_ice_index["masks"].items():
+        icetime = {}
+        for strength, line, length in zip(
+            on_ice_index["strengths"][team_id][first:last][anyone].tolist(),
+            masks[first:last][anyone].tolist(),
+            lengths[anyone].tolist(),
+        ):
+            strength_icetime = icetime.setdefault(strength, {})
+            strength_icetime[line] = strength_icetime.get(line, 0) + length
+
+        deployments[team_id] = {
+            "player_ids": on_ice_index["player_ids"].tolist(),
+            "icetime": icetime,
+        }
+
+    return deployments
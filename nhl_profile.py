@@ -0,0 +1,120 @@
+import cProfile
+import collections
+import contextlib
+import os
+import sys
+import threading
+
+# seconds between stack samples for the collapsed stack output
+SAMPLE_INTERVAL = 0.001
+
+# where profiles are written, profiling is off while this is None
+profile_directory = None
+
+# what the profiles are for (a game_id), and the stages profiled for it
+current_label = "run"
+stage_profiles = {}
+stage_stacks = {}
+
+# only one cProfile can be active at a time, so nested stages are folded
+# into the outer one
+active_stage = None
+
+
+def enable(directory):
+    global profile_directory
+
+    # also the process pool initializer, so workers profile their games too
+    profile_directory = directory
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return "{}:{}".format(os.path.basename(code.co_filename), code.co_name)
+
+
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id, stacks, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.stacks = stacks
+        self.interval = interval
+        self.finished = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+
+            # walk out from the running function, then flip to root first
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame))
+                frame = frame.f_back
+            names.reverse()
+
+            self.stacks[";".join(names)] += 1
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+
+
+@contextlib.contextmanager
+def stage(name):
+    global active_stage
+
+    if profile_directory is None or active_stage is not None:
+        yield
+        return
+
+    # stages run many times per label (once per team, once per poll), each
+    # keeps adding to the same profile
+    profile = stage_profiles.setdefault(name, cProfile.Profile())
+    stacks = stage_stacks.setdefault(name, collections.Counter())
+    sampler = StackSampler(threading.get_ident(), stacks)
+
+    active_stage = name
+    sampler.start()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        sampler.stop()
+        active_stage = None
+
+
+@contextlib.contextmanager
+def label(name):
+    global current_label
+
+    # write out what was profiled before, then profile this label on its own
+    dump()
+    current_label = name
+    try:
+        yield
+    finally:
+        dump()
+        current_label = "run"
+
+
+def dump():
+    if profile_directory is None:
+        return
+
+    for name, profile in stage_profiles.items():
+        path = os.path.join(profile_directory, "{}-{}".format(current_label, name))
+
+        # read with python -m pstats, or snakeviz
+        profile.dump_stats(path + ".pstats")
+
+        # one "root;...;leaf count" line per stack, for flamegraph.pl or
+        # speedscope, rooted at the stage so the files can be concatenated
+        with open(path + ".folded", "w") as f:
+            for stack, count in sorted(stage_stacks[name].items()):
+                f.write("{};{} {}\n".format(name, stack, count))
+
+    stage_profiles.clear()
+    stage_stacks.clear()
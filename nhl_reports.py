@@ -0,0 +1,94 @@
+import io
+
+# classes for different cell types, with the whitespace removed
+# ("playerHeading + border" -> "playerHeading+border")
+PLAYER_CLASS = "playerHeading+border"
+HEADER_CLASS = "heading+lborder+bborder"
+STAT_CLASS = "lborder+bborder"
+
+# the columns we need out of each shift row
+PERIOD_COLUMN = "Per"
+START_COLUMN = "Start of ShiftElapsed / Game"
+END_COLUMN = "End of ShiftElapsed / Game"
+
+
+def convert_report_time(value, period):
+
+    # "12:34 / 7:26" is elapsed / remaining, we only want the elapsed part
+    minutes, seconds = value.split("/")[0].split(":")
+
+    # convert into a seconds timestamp for the whole game
+    return (int(minutes) * 60) + int(seconds) + ((period - 1) * 20 * 60)
+
+
+def cell_text(element):
+
+    # most cells are plain text, headers have a <br> to join across
+    if len(element) == 0:
+        return element.text or ""
+
+    return "".join(element.itertext())
+
+
+def iter_time_on_ice_shifts(html):
+
+    # imported here, only runs reading the html reports need lxml
+    from lxml import etree
+
+    # normalized class names, keyed by the raw class attribute
+    cell_classes = {}
+
+    column_builder = []
+    column_headers = []
+    index = 0
+    player = None
+    row = {}
+
+    # stream the report a cell at a time instead of building the whole tree
+    cells = etree.iterparse(
+        io.BytesIO(html), events=("end",), tag=("td", "tr"), html=True
+    )
+
+    for event, element in cells:
+        if element.tag == "td":
+            raw_class = element.get("class")
+            cell_class = cell_classes.get(raw_class)
+            if cell_class is None:
+                cell_class = "".join((raw_class or "").split())
+                cell_classes[raw_class] = cell_class
+
+            # stat cells are by far the most common, so check them first
+            if cell_class == STAT_CLASS:
+                if len(column_builder) > 0:
+                    column_headers = column_builder
+                    column_builder = []
+
+                row[column_headers[index]] = cell_text(element)
+                index += 1
+                index = index % len(column_headers)
+            elif cell_class == PLAYER_CLASS:
+                player = cell_text(element)
+            elif cell_class == HEADER_CLASS:
+                column_builder.append(cell_text(element))
+
+            # cells are freed along with their row
+            continue
+
+        if row:
+            # if period is overtime, convert to '4'
+            period = row[PERIOD_COLUMN]
+            if period == "OT":
+                period = 4
+            period = int(period)
+
+            start = convert_report_time(row[START_COLUMN], period)
+            end = convert_report_time(row[END_COLUMN], period)
+
+            yield player, period, start, end
+
+            row = {}
+
+        # drop rows we're finished with so memory stays flat
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
@@ -0,0 +1,184 @@
+import numpy as np
+
+# seconds in a regulation period
+PERIOD_LENGTH = 20 * 60
+
+
+def parse_clock(values):
+
+    # the shift charts use zero padded "MM:SS", so read the digits straight out
+    # of one byte buffer instead of splitting every string
+    joined = "".join(values).encode("ascii")
+    if len(joined) == 5 * len(values):
+        digits = np.frombuffer(joined, dtype=np.uint8).reshape(-1, 5).astype(np.int32)
+        if (digits[:, 2] == ord(":")).all():
+            digits -= ord("0")
+            return (
+                (digits[:, 0] * 10 + digits[:, 1]) * 60
+                + digits[:, 3] * 10
+                + digits[:, 4]
+            )
+
+    # otherwise split every "M:SS" at once
+    clock = np.char.partition(np.asarray(values, dtype=str), ":")
+
+    return clock[:, 0].astype(np.int32) * 60 + clock[:, 2].astype(np.int32)
+
+
+def make_shift_table(player_ids, periods, starts, ends):
+
+    # a team's shifts as parallel columns, with players interned to small
+    # indexes into player_ids so the hot loops work on plain integers
+    unique_player_ids, player = np.unique(
+        np.asarray(player_ids, dtype=np.int64), return_inverse=True
+    )
+
+    shift_table = {
+        "player_ids": unique_player_ids,
+        "player": player.astype(np.int32),
+        "period": np.asarray(periods, dtype=np.int8),
+        "start": np.asarray(starts, dtype=np.int32),
+        "end": np.asarray(ends, dtype=np.int32),
+    }
+
+    return sort_shift_table(shift_table)
+
+
+def parse_game_time(periods, clocks):
+
+    # a period's "MM:SS" clocks as seconds into the whole game
+    return (
+        parse_clock(clocks) + (np.asarray(periods, dtype=np.int32) - 1) * PERIOD_LENGTH
+    )
+
+
+def make_clock_shift_table(player_ids, periods, start_clocks, end_clocks):
+
+    # convert each shift into a seconds timestamp for the whole game
+    return make_shift_table(
+        player_ids,
+        periods,
+        parse_game_time(periods, start_clocks),
+        parse_game_time(periods, end_clocks),
+    )
+
+
+def sort_shift_table(shift_table):
+
+    # sort by start of shift time, keeping the original order for ties
+    order = np.argsort(shift_table["start"], kind="stable")
+
+    sorted_table = {"player_ids": shift_table["player_ids"]}
+    for column in shift_table:
+        if column != "player_ids":
+            sorted_table[column] = shift_table[column][order]
+
+    return sorted_table
+
+
+def merge_shift_tables(shift_tables):
+
+    # both teams' shifts in one table, with a team column and each team's
+    # player indexes moved past the previous team's so they don't collide
+    player_ids = []
+    columns = {"player": [], "period": [], "start": [], "end": [], "team": []}
+    offset = 0
+    for team_id, shift_table in shift_tables.items():
+        player_ids.append(shift_table["player_ids"])
+        columns["player"].append(shift_table["player"] + offset)
+        for column in ("period", "start", "end"):
+            columns[column].append(shift_table[column])
+        columns["team"].append(
+            np.full(shift_count(shift_table), team_id, dtype=np.int32)
+        )
+        offset += len(shift_table["player_ids"])
+
+    merged_table = {"player_ids": np.concatenate(player_ids)}
+    for column, values in columns.items():
+        merged_table[column] = np.concatenate(values)
+
+    return sort_shift_table(merged_table)
+
+
+def shift_count(shift_table):
+    return len(shift_table["start"])
+
+
+def repair_shift_table(shift_table):
+
+    # the shift charts aren't always clean: fix a team's table with whole array
+    # operations, returning it with a count of each problem found
+    player = shift_table["player"]
+    start = shift_table["start"]
+    end = shift_table["end"]
+
+    # clip every shift to its own period
+    period_start = (shift_table["period"].astype(np.int32) - 1) * PERIOD_LENGTH
+    clipped_start = np.clip(start, period_start, period_start + PERIOD_LENGTH)
+    clipped_end = np.clip(end, period_start, period_start + PERIOD_LENGTH)
+
+    # then drop anything left without any time on the ice
+    length = clipped_end - clipped_start
+    kept = np.flatnonzero(length > 0)
+    clipped = (clipped_start[kept] != start[kept]) | (clipped_end[kept] != end[kept])
+
+    # group each player's shifts together in start order, so repeats and
+    # overlaps are next to each other
+    kept = kept[np.lexsort((clipped_end[kept], clipped_start[kept], player[kept]))]
+    kept_player = player[kept]
+    kept_start = clipped_start[kept]
+    kept_end = clipped_end[kept]
+
+    duplicate = np.zeros(len(kept), dtype=bool)
+    duplicate[1:] = (
+        (kept_player[1:] == kept_player[:-1])
+        & (kept_start[1:] == kept_start[:-1])
+        & (kept_end[1:] == kept_end[:-1])
+    )
+    kept = kept[~duplicate]
+    kept_player = kept_player[~duplicate]
+    kept_start = kept_start[~duplicate]
+    kept_end = kept_end[~duplicate]
+
+    # the furthest any of a player's shifts so far reaches, offsetting each
+    # player past the last so the running maximum restarts with every player
+    span = int(kept_end.max()) + 1 if len(kept) else 1
+    offset = kept_player.astype(np.int64) * span
+    reach = np.maximum.accumulate(kept_end + offset) - offset
+
+    # a shift starting before the player's previous ones end continues them
+    new_shift = np.ones(len(kept), dtype=bool)
+    new_shift[1:] = (kept_player[1:] != kept_player[:-1]) | (
+        kept_start[1:] >= reach[:-1]
+    )
+    shift_starts = np.flatnonzero(new_shift)
+    if len(kept):
+        merged_start = kept_start[shift_starts]
+        merged_end = np.maximum.reduceat(kept_end, shift_starts)
+
+        # each merged shift stands in the place of the first of its rows, so a
+        # clean table comes back unchanged
+        rows = np.minimum.reduceat(kept, shift_starts)
+    else:
+        merged_start = merged_end = rows = kept
+
+    order = np.argsort(rows, kind="stable")
+    rows = rows[order]
+
+    repaired_table = {
+        "player_ids": shift_table["player_ids"],
+        "player": player[rows],
+        "period": shift_table["period"][rows],
+        "start": merged_start[order].astype(start.dtype),
+        "end": merged_end[order].astype(end.dtype),
+    }
+
+    anomalies = {
+        "clipped": int(np.count_nonzero(clipped)),
+        "empty": int(np.count_nonzero(length == 0)),
+        "inverted": int(np.count_nonzero(length < 0)),
+        "duplicate": int(np.count_nonzero(duplicate)),
+        "merged": len(kept) - len(shift_starts),
+    }
+
+    return sort_shift_table(repaired_table), anomalies
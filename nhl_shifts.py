@@ -1,17 +1,85 @@
 # include standard modules for parsing command line
+import atexit
+import contextlib
+import copy
+import datetime
 import getopt
+import hashlib
+import heapq
+import io
+import json
 import operator
 # postgres imports
 import os
 import pprint
 import re
 import sys
-from operator import itemgetter
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
 from urllib import parse
 
-import psycopg2
-import requests
-from bs4 import BeautifulSoup
+import ijson
+
+import nhl_archive
+import nhl_cache
+import nhl_fetch
+import nhl_metrics
+import nhl_on_ice
+import nhl_profile
+import nhl_reports
+import nhl_shift_table
+
+
+# the strength each state's lines are built from, how many forwards and
+# defensemen make up a line there, and how deep the lines go
+LINE_STATES = {
+    "EVEN": {
+        "strength": "5v5",
+        "forwards": {3},
+        "forward_lines": 4,
+        "defense": {2},
+        "defense_pairs": 3,
+    },
+    "PP": {
+        "strength": "5v4",
+        "forwards": {3, 4},
+        "forward_lines": 2,
+        "defense": {1, 2},
+        "defense_pairs": 2,
+    },
+    "PK": {
+        "strength": "4v5",
+        "forwards": {2, 3},
+        "forward_lines": 2,
+        "defense": {1, 2},
+        "defense_pairs": 2,
+    },
+}
+
+
+# the typeCode of shift records in the shift charts, the rest are events
+SHIFT_TYPE_CODE = 517
+
+# bump whenever a change to the deployments or lines would change what is
+# computed from the same inputs, so every game is recomputed on its next run
+ALGORITHM_VERSION = 3
+
+# the NHL sometimes revises a finished game's shift charts hours later, so
+# its responses keep being revalidated (and the game rechecked) this long
+SETTLE_DAYS = 2
+
+# write_lines_to_database notifies this channel as its transaction commits,
+# with the game_ids written, so readers (nhl_api) know their lines are stale
+LINES_CHANNEL = "lines_updated"
+
+
+@contextlib.contextmanager
+def stage(name):
+
+    # time every stage, and profile it too when running with --profile
+    with nhl_metrics.stage(name), nhl_profile.stage(name):
+        yield
 
 
 def get_game_from_gameid(game_id):
@@ -63,6 +131,23 @@ def get_schedule_url(date):
         return "https://statsapi.web.nhl.com/api/v1/schedule"
 
 
+def get_schedule_range_url(start_date, end_date):
+    url = "https://statsapi.web.nhl.com/api/v1/schedule?startDate={}&endDate={}".format(
+        start_date, end_date
+    )
+    return url
+
+
+def get_game_schedule_url(game_id):
+    url = "https://statsapi.web.nhl.com/api/v1/schedule?gamePk={}".format(game_id)
+    return url
+
+
+def get_season_schedule_url(season):
+    url = "https://statsapi.web.nhl.com/api/v1/schedule?season={}".format(season)
+    return url
+
+
 def get_live_game_feed_url(game_id):
     url = (
         "https://statsapi.web.nhl.com/api/v1/game/"
@@ -96,9 +181,13 @@ def get_records_team_players(team_id):
     records_team_players_url = get_records_team_players_url(team_id)
 
     # get the html
-    html = requests.get(records_team_players_url)
-    data = html.json()
+    html = nhl_cache.cached_get(records_team_players_url)
+    data = json.loads(html)
+
+    return parse_records_team_players(data)
 
+
+def parse_records_team_players(data):
     roster = data["data"]
 
     team_players = {}
@@ -127,8 +216,8 @@ def get_team_players(team_id):
     team_players_url = get_team_players_url(team_id)
 
     # get the html
-    html = requests.get(team_players_url)
-    data = html.json()
+    html = nhl_cache.cached_get(team_players_url)
+    data = json.loads(html)
 
     roster = data["teams"][0]["roster"]["roster"]
 
@@ -157,55 +246,137 @@ def get_team_players(team_id):
 def parse_shift_charts(url):
 
     # get the html
-    html = requests.get(url)
-    data = html.json()
+    html = nhl_cache.cached_get(url)
 
-    shifts = {}
+    return parse_shift_charts_data(io.BytesIO(html))
 
-    for shift in data["data"]:
-        player_id = shift["playerId"]
-        shift_start = shift["startTime"]
-        shift_end = shift["endTime"]
-        period = shift["period"]
-        team_id = shift["teamId"]
 
-        print("{} - {} for {}".format(shift_start, shift_end, player_id))
+def is_shift(shift):
 
-        # get shift start/end minute:second, and split them
-        start_min, start_sec = shift_start.split(":")
-        end_min, end_sec = shift_end.split(":")
+    # the shift charts also carry events, only shift records have a start
+    return shift.get("typeCode", SHIFT_TYPE_CODE) == SHIFT_TYPE_CODE and bool(
+        shift["startTime"]
+    )
 
-        # convert each shift into a seconds timestamp
-        converted_shift = {}
-        converted_shift["start"] = (
-            (int(start_min) * 60) + int(start_sec) + ((int(period) - 1) * 20 * 60)
-        )
-        converted_shift["end"] = (
-            (int(end_min) * 60) + int(end_sec) + ((int(period) - 1) * 20 * 60)
+
+def parse_shift_charts_data(source):
+
+    # gather raw columns per team, the time conversion happens all at once
+    columns = {}
+    skipped_events = 0
+    open_shifts = 0
+
+    # decode one shift record at a time instead of the whole response
+    for shift in ijson.items(source, "data.item"):
+
+        # goals (typeCode 505) are listed alongside the shifts
+        if not is_shift(shift):
+            skipped_events += 1
+            continue
+
+        # a game still in progress has shifts without an end time yet, they
+        # are counted once they have one
+        if not shift["endTime"]:
+            open_shifts += 1
+            continue
+
+        team_columns = columns.setdefault(shift["teamId"], ([], [], [], []))
+        team_columns[0].append(shift["playerId"])
+        team_columns[1].append(shift["period"])
+        team_columns[2].append(shift["startTime"])
+        team_columns[3].append(shift["endTime"])
+
+    shifts = {}
+    for team_id, (player_ids, periods, start_clocks, end_clocks) in columns.items():
+        shifts[team_id] = nhl_shift_table.make_clock_shift_table(
+            player_ids, periods, start_clocks, end_clocks
         )
-        converted_shift["player_id"] = player_id
+        nhl_metrics.incr("shifts_parsed", len(player_ids))
+
+    if skipped_events:
+        nhl_metrics.incr("shift_events_skipped", skipped_events)
+    if open_shifts:
+        print("Warning: skipped {} shifts without an end time".format(open_shifts))
+        nhl_metrics.incr("shifts_in_progress", open_shifts)
 
-        # Add shift to list of team shifts
-        shifts.setdefault(team_id, []).append(converted_shift)
+    return shifts
+
+
+def parse_new_shift_charts(source, seen_shift_ids):
+
+    columns = {}
+    open_columns = ([], [], [], [])
+
+    for shift in ijson.items(source, "data.item"):
+        if shift["id"] in seen_shift_ids or not is_shift(shift):
+            continue
 
-    # sort by start of shift time
-    sorted_shifts = {}
-    for team_id in shifts:
-        sorted_shifts[team_id] = sorted(
-            shifts[team_id], key=itemgetter("start"), reverse=True
+        # shifts still in progress have no end time yet, they're on the ice
+        # now and picked up again once they have one
+        if not shift["endTime"]:
+            open_columns[0].append(shift["playerId"])
+            open_columns[1].append(shift["teamId"])
+            open_columns[2].append(shift["period"])
+            open_columns[3].append(shift["startTime"])
+            continue
+        seen_shift_ids.add(shift["id"])
+
+        team_columns = columns.setdefault(shift["teamId"], ([], [], [], []))
+        team_columns[0].append(shift["playerId"])
+        team_columns[1].append(shift["period"])
+        team_columns[2].append(shift["startTime"])
+        team_columns[3].append(shift["endTime"])
+
+    shift_tables = {}
+    for team_id, (player_ids, periods, start_clocks, end_clocks) in columns.items():
+        shift_tables[team_id] = nhl_shift_table.make_clock_shift_table(
+            player_ids, periods, start_clocks, end_clocks
+        )
+        nhl_metrics.incr("shifts_parsed", len(player_ids))
+
+    # repeats across polls are caught by seen_shift_ids, this catches the rest
+    # within the new shifts
+    shift_tables = repair_shifts(shift_tables)
+
+    # the shifts in progress, as (start, player_id, team_id)
+    open_shifts = []
+    if open_columns[0]:
+        player_ids, team_ids, periods, start_clocks = open_columns
+        starts = nhl_shift_table.parse_game_time(periods, start_clocks)
+        open_shifts = sorted(zip(starts.tolist(), player_ids, team_ids))
+
+    if not shift_tables:
+        return [], open_shifts
+
+    # only the new shifts, as (start, end, player_id, team_id) for both teams
+    # sorted by start time
+    shift_table = nhl_shift_table.merge_shift_tables(shift_tables)
+    new_shifts = list(
+        zip(
+            shift_table["start"].tolist(),
+            shift_table["end"].tolist(),
+            shift_table["player_ids"][shift_table["player"]].tolist(),
+            shift_table["team"].tolist(),
         )
+    )
 
-    return sorted_shifts
+    return new_shifts, open_shifts
 
 
 def get_player_stats_for_game(game_id):
     live_game_feed_url = get_live_game_feed_url(game_id)
 
     # get the html
-    html = requests.get(live_game_feed_url)
-    data = html.json()
+    html = nhl_cache.cached_get(live_game_feed_url)
+
+    return parse_player_stats(io.BytesIO(html))
+
 
-    teams = data["liveData"]["boxscore"]["teams"]
+def parse_player_stats(source):
+
+    # only decode the boxscore, the plays that make up most of the live feed
+    # are skipped over by the parser without building any objects
+    teams = next(ijson.items(source, "liveData.boxscore.teams", use_float=True), {})
 
     player_stats = {}
 
@@ -226,10 +397,25 @@ def get_player_stats_for_game(game_id):
 
 def get_games_on_date(date):
     url = get_schedule_url(date)
+    return get_scheduled_games(url)
+
+
+def get_games_between_dates(start_date, end_date):
+    url = get_schedule_range_url(start_date, end_date)
+    return get_scheduled_games(url)
+
+
+def get_games_in_season(season):
+    url = get_season_schedule_url(season)
+    return get_scheduled_games(url)
+
+
+def get_scheduled_games(url):
 
     # get the html
-    html = requests.get(url)
-    data = html.json()
+    with stage("fetch"):
+        html = nhl_cache.cached_get(url)
+    data = json.loads(html)
 
     todays_games = {}
 
@@ -241,18 +427,117 @@ def get_games_on_date(date):
             away_team = game["teams"]["away"]["team"]["name"]
             away_id = game["teams"]["away"]["team"]["id"]
 
-            todays_games[game_id] = {"home": home_id, "away": away_id}
+            # finished games won't change, so their responses can be cached for good
+            final = game["status"]["abstractGameState"] == "Final"
+
+            todays_games[game_id] = {
+                "home": home_id,
+                "away": away_id,
+                "final": final,
+                "date": date["date"],
+            }
 
             print("{} - {} @ {}".format(game_id, away_team, home_team))
 
     return todays_games
 
 
-def find_player_id(number, first_name, last_name, players):
+def get_game_urls(game_id, teams):
+
+    # every request the main loop needs for a single game
+    game_urls = {
+        "home_players": get_records_team_players_url(teams["home"]),
+        "away_players": get_records_team_players_url(teams["away"]),
+        "live_feed": get_live_game_feed_url(game_id),
+        "shift_charts": get_shift_charts_url(game_id),
+    }
+
+    return game_urls
+
+
+def is_settled(teams):
+
+    # finished long enough ago that its feeds won't be revised again
+    settled_date = datetime.date.today() - datetime.timedelta(days=SETTLE_DAYS)
+    return teams["final"] and teams["date"] <= settled_date.isoformat()
+
+
+def is_game_settled(game_id):
+
+    # for reports fetched a game at a time, outside of a schedule
+    games = get_scheduled_games(get_game_schedule_url(game_id))
+    return game_id in games and is_settled(games[game_id])
+
+
+def get_final_game_urls(game_id, teams):
+
+    # rosters change over a season, but a settled game's feeds do not
+    if not is_settled(teams):
+        return []
+
+    return [get_live_game_feed_url(game_id), get_shift_charts_url(game_id)]
+
+
+def normalize_name(name):
+
+    # fold accents away ("Stützle" -> "stutzle") so reports and rosters agree
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c)).lower()
+
+    # "T.J." and "TJ", "O'Reilly" and "OReilly", "Ekman-Larsson" and "Ekman Larsson"
+    name = re.sub("[.'\u2019]", "", name)
+    name = re.sub("[-\u2010\u2013]", " ", name)
+
+    return " ".join(name.split())
+
+
+def build_roster_index(players):
+
+    roster_index = {"names": {}, "last_names": {}, "numbers": {}}
 
     for player_id, details in players.items():
-        if "{} {}".format(first_name, last_name).lower() == details["name"].lower():
-            return player_id
+        name = normalize_name(details["name"])
+        roster_index["names"].setdefault(name, []).append(player_id)
+
+        # jersey numbers default to zero when they aren't set
+        number = int(details["number"] or 0)
+        if number == 0:
+            continue
+
+        roster_index["numbers"].setdefault(number, []).append(player_id)
+
+        # we don't know where the first name ends ("James van Riemsdyk"), so
+        # index every trailing part of the name as a possible last name
+        name_parts = name.split(" ")
+        for i in range(1, len(name_parts)):
+            last_name = " ".join(name_parts[i:])
+            roster_index["last_names"].setdefault((number, last_name), []).append(
+                player_id
+            )
+
+    return roster_index
+
+
+def find_player_id(number, first_name, last_name, roster_index):
+    number = int(number)
+    numbered_players = roster_index["numbers"].get(number, [])
+
+    # rosters can hold two players with the same name, the number settles it
+    named_players = roster_index["names"].get(
+        normalize_name("{} {}".format(first_name, last_name)), []
+    )
+    if len(named_players) > 1:
+        named_players = [p for p in named_players if p in numbered_players]
+
+    # fall back to the jersey number, first with the last name (nicknames,
+    # "Alex" vs "Alexander"), then on its own if only one player wears it
+    last_named_players = roster_index["last_names"].get(
+        (number, normalize_name(last_name)), []
+    )
+
+    for candidates in (named_players, last_named_players, numbered_players):
+        if len(candidates) == 1:
+            return candidates[0]
 
     print("Error: Could not find player_id for {}, {}".format(last_name, first_name))
     return 0
@@ -260,140 +545,292 @@ def find_player_id(number, first_name, last_name, players):
 
 def parse_time_on_ice(url, players):
     # get the html
-    html = requests.get(url)
-
-    # create the BeautifulSoup object
-    soup = BeautifulSoup(html, "lxml")
-
-    # classes for different cell types
-    player_class = "playerHeading+border"
-    header_class = "heading+lborder+bborder"
-    stat_class = "lborder+bborder"
-
-    index = 0
-    column_builder = []
-    column_headers = []
-    shift_hash = {}
-    team_shifts = []
-
-    # Match "37 Cable, Jonathan", need to include slashes, periods and spaces in names as well
-    p = re.compile("^([0-9]+) ([A-z\-\. ']+), ([A-z\-\. ']+)$")
-
-    for row in soup.find_all("tr"):
-        cells = row.find_all("td")
-        player_hash = {}
-        for cell in cells:
-            c = cell.get("class")
-            if c is None:
-                continue
-            elif "".join(c) == player_class:
-                player = cell.text
-                shift_hash[player] = []
-            elif "".join(c) == header_class:
-                column_builder.append(cell.text)
-            elif "".join(c) == stat_class:
-                if len(column_builder) > 0:
-                    column_headers = column_builder
-                    column_builder = []
-
-                player_hash[column_headers[index]] = cell.text
-                index += 1
-                index = index % len(column_headers)
-
-        if player_hash:
+    html = nhl_cache.cached_get(url)
+
+    return parse_time_on_ice_report(html, players)
+
+
+def parse_time_on_ice_report(html, players):
 
+    shift_player_ids = []
+    shift_periods = []
+    shift_starts = []
+    shift_ends = []
+
+    # Match "37 Cable, Jonathan", names may include accents, dashes, periods and spaces
+    p = re.compile("^([0-9]+) ([^,]+), (.+)$")
+
+    # resolve each player heading once, not once per shift row
+    roster_index = build_roster_index(players)
+    player_ids = {}
+    dropped_shifts = {}
+
+    for player, period, start, end in nhl_reports.iter_time_on_ice_shifts(html):
+        if player not in player_ids:
             # map player information to player id
             matches = p.match(player)
             if matches:
                 number = matches.group(1)
                 last_name = matches.group(2)
                 first_name = matches.group(3)
-                player_id = find_player_id(number, first_name, last_name, players)
-
-                # we can't locate this player right now
-                if player_id == 0:
-                    continue
-
-                # get shift start/end minute:second, and split them
-                start_min, start_sec = player_hash["Start of ShiftElapsed / Game"][
-                    :5
-                ].split(":")
-                end_min, end_sec = player_hash["End of ShiftElapsed / Game"][:5].split(
-                    ":"
+                player_ids[player] = find_player_id(
+                    number, first_name, last_name, roster_index
                 )
+            else:
+                print("Error: No match for player={}".format(player))
+                player_ids[player] = 0
 
-                # get the period, so we can differentiate the shift times
-                period = player_hash["Per"]
+        player_id = player_ids[player]
 
-                shift = {}
-                # if period is overtime, convert to '4'
-                if period == "OT":
-                    period = 4
+        # we can't locate this player right now
+        if player_id == 0:
+            dropped_shifts[player] = dropped_shifts.get(player, 0) + 1
+            continue
 
-                # convert each shift into a seconds timestamp
-                shift["start"] = (
-                    (int(start_min) * 60)
-                    + int(start_sec)
-                    + ((int(period) - 1) * 20 * 60)
-                )
-                shift["end"] = (
-                    (int(end_min) * 60) + int(end_sec) + ((int(period) - 1) * 20 * 60)
-                )
-                shift["player_id"] = player_id
-                # shift_hash[player_id].append(shift)
+        # Add shift to the team's columns
+        shift_player_ids.append(player_id)
+        shift_periods.append(period)
+        shift_starts.append(start)
+        shift_ends.append(end)
+
+    for player, count in dropped_shifts.items():
+        print("Error: Dropped {} shifts for unmatched player={}".format(count, player))
+        nhl_metrics.incr("shifts_dropped", count)
 
-                # Add shift to list of team shifts
-                team_shifts.append(shift)
+    nhl_metrics.incr("shifts_parsed", len(shift_player_ids))
+
+    return nhl_shift_table.make_shift_table(
+        shift_player_ids, shift_periods, shift_starts, shift_ends
+    )
 
+
+def new_deployment_state(team_ids, goalie_ids):
+
+    deployment_state = {
+        # set current time on ice to zero
+        "current_toi": 0,
+        "team_ids": list(team_ids),
+        "goalie_ids": set(goalie_ids),
+        # players are interned to single bits, player_ids[k] is bit 1 << k,
+        # so a line is an integer mask of the players on the ice
+        "player_ids": [],
+        "player_bits": {},
+        "goalie_mask": 0,
+        # time on ice per team, then per strength ("5v4"), then per line mask
+        "icetime": {team_id: {} for team_id in team_ids},
+        # min-heap of (end, player bit, team) for the shifts currently on the
+        # ice, plus a count of open shifts per player (a player's shifts can
+        # overlap in the data) and the mask of who is on the ice per team
+        "ending_shifts": [],
+        "open_shifts": {},
+        "on_ice": {team_id: 0 for team_id in team_ids},
+        # distinct skaters and goalies on the ice per team
+        "skaters": {team_id: 0 for team_id in team_ids},
+        "goalies_on_ice": {team_id: 0 for team_id in team_ids},
+        # (home, away) strengths, keyed by the counts above
+        "strengths": {},
+        # start of the last shift swept, later shifts can be swept incrementally
+        "last_start": 0,
+    }
+
+    return deployment_state
+
+
+def record_interval(deployment_state, length):
+    home_id, away_id = deployment_state["team_ids"]
+    on_ice = deployment_state["on_ice"]
+    skaters = deployment_state["skaters"]
+    goalies_on_ice = deployment_state["goalies_on_ice"]
+
+    # nobody on the ice, ie. between periods
+    if not on_ice[home_id] and not on_ice[away_id]:
+        return
+
+    # only a handful of different counts come up in a game
+    counts = (
+        skaters[home_id],
+        goalies_on_ice[home_id],
+        skaters[away_id],
+        goalies_on_ice[away_id],
+    )
+    strengths = deployment_state["strengths"].get(counts)
+    if strengths is None:
+        strengths = (
+            nhl_on_ice.get_strength(*counts),
+            nhl_on_ice.get_strength(counts[2], counts[3], counts[0], counts[1]),
+        )
+        deployment_state["strengths"][counts] = strengths
+
+    for team_id, strength in zip((home_id, away_id), strengths):
+        strength_icetime = deployment_state["icetime"][team_id].setdefault(strength, {})
+
+        line = on_ice[team_id]
+        if line in strength_icetime:
+            strength_icetime[line] += length
+        else:
+            strength_icetime[line] = length
+
+
+def end_shifts(deployment_state, until):
+
+    current_toi = deployment_state["current_toi"]
+    ending_shifts = deployment_state["ending_shifts"]
+    open_shifts = deployment_state["open_shifts"]
+    on_ice = deployment_state["on_ice"]
+    goalie_mask = deployment_state["goalie_mask"]
+    skaters = deployment_state["skaters"]
+    goalies_on_ice = deployment_state["goalies_on_ice"]
+
+    # close out every shift ending by until, one change at a time
+    while ending_shifts and ending_shifts[0][0] <= until:
+        shift_end = ending_shifts[0][0]
+
+        # everyone on the ice up to this change shares the interval
+        if shift_end > current_toi:
+            record_interval(deployment_state, shift_end - current_toi)
+            current_toi = shift_end
+
+        while ending_shifts and ending_shifts[0][0] == shift_end:
+            _, bit, team_id = heapq.heappop(ending_shifts)
+            open_shifts[bit] -= 1
+            if open_shifts[bit] == 0:
+                on_ice[team_id] &= ~bit
+                if bit & goalie_mask:
+                    goalies_on_ice[team_id] -= 1
+                else:
+                    skaters[team_id] -= 1
+
+    deployment_state["current_toi"] = current_toi
+
+
+def advance_deployments(deployment_state, starts, ends, player_ids, teams):
+
+    ending_shifts = deployment_state["ending_shifts"]
+    open_shifts = deployment_state["open_shifts"]
+    on_ice = deployment_state["on_ice"]
+    player_bits = deployment_state["player_bits"]
+    skaters = deployment_state["skaters"]
+    goalies_on_ice = deployment_state["goalies_on_ice"]
+
+    # shifts must arrive sorted by start time (both teams together, so each
+    # interval knows the strength)
+    for start, end, player_id, team_id in zip(starts, ends, player_ids, teams):
+
+        bit = player_bits.get(player_id)
+        if bit is None:
+            bit = 1 << len(deployment_state["player_ids"])
+            deployment_state["player_ids"].append(player_id)
+            player_bits[player_id] = bit
+            open_shifts[bit] = 0
+            if player_id in deployment_state["goalie_ids"]:
+                deployment_state["goalie_mask"] |= bit
+
+        # check to see if we have ending shifts
+        if ending_shifts and ending_shifts[0][0] <= start:
+            end_shifts(deployment_state, start)
+
+        # and credit the time since to the players still on the ice
+        if start > deployment_state["current_toi"]:
+            record_interval(deployment_state, start - deployment_state["current_toi"])
+            deployment_state["current_toi"] = start
+
+        heapq.heappush(ending_shifts, (end, bit, team_id))
+        open_shifts[bit] += 1
+        if open_shifts[bit] == 1:
+            on_ice[team_id] |= bit
+            if bit & deployment_state["goalie_mask"]:
+                goalies_on_ice[team_id] += 1
             else:
-                print("Error: No match for player={}".format(player))
+                skaters[team_id] += 1
 
-    # sort by start of shift time
-    team_shifts = sorted(team_shifts, key=itemgetter("start"), reverse=True)
+        deployment_state["last_start"] = start
 
-    return team_shifts
+    return deployment_state
 
 
-def calculate_toi_deployments(shifts):
+def finish_deployments(deployment_state):
 
-    # set current time on ice to zero
-    current_toi = 0
-    current_shifts = []
-    icetime = {}
+    # once the game is over, the shifts still open run to their ends
+    end_shifts(deployment_state, float("inf"))
 
-    while len(shifts) > 0:
-        shift = shifts.pop()
+    return deployment_state
 
-        # keep current shifts sorted by their expiration time
-        current_shifts = sorted(current_shifts, key=itemgetter("end"))
 
-        # check to see if we have ending shifts
-        if len(current_shifts) > 0 and current_shifts[0]["end"] <= shift["start"]:
+def get_goalie_ids(*rosters):
+    goalie_ids = set()
+    for roster in rosters:
+        for player_id, player in roster.items():
+            if player["position"] == "G":
+                goalie_ids.add(player_id)
 
-            # calculate shift length
-            shift_length = current_shifts[0]["end"] - current_toi
-            current_toi = current_shifts[0]["end"]
+    return goalie_ids
 
-            line = set()
-            # use a copy of current_shifts ([:]) so that we can modify it mid-loop
-            for current_shift in current_shifts[:]:
-                # set up the current line
-                line.add(current_shift["player_id"])
 
-                # remove all ending shifts
-                if current_shift["end"] <= shift["start"]:
-                    current_shifts.remove(current_shift)
+def get_team_deployments(deployment_state, team_id):
 
-            frozen_line = frozenset(line)
+    # a team's line masks per strength, with the player_ids to read them by
+    team_deployments = {
+        "player_ids": deployment_state["player_ids"],
+        "icetime": deployment_state["icetime"][team_id],
+    }
 
-            if frozen_line in icetime:
-                icetime[frozen_line] += shift_length
-            else:
-                icetime[frozen_line] = shift_length
+    return team_deployments
+
+
+def get_line_players(line, player_ids):
+
+    # the NHL player ids in a line mask, with the bit each one is
+    line_players = {}
+    while line:
+        # peel off the lowest set bit
+        bit = line & -line
+        line_players[player_ids[bit.bit_length() - 1]] = bit
+        line ^= bit
+
+    return line_players
+
+
+def repair_shifts(shifts):
+
+    # clean every team's shifts before they're swept (see
+    # nhl_shift_table.repair_shift_table), counting what had to be fixed
+    repaired_shifts = {}
+    for team_id, shift_table in shifts.items():
+        repaired_shifts[team_id], anomalies = nhl_shift_table.repair_shift_table(
+            shift_table
+        )
+        for anomaly, count in anomalies.items():
+            if count:
+                print(
+                    "Warning: {} {} shifts for team={}".format(count, anomaly, team_id)
+                )
+                nhl_metrics.incr("shifts_{}".format(anomaly), count)
+
+    return repaired_shifts
+
+
+def calculate_toi_deployments(shifts, goalie_ids):
 
-        current_shifts.append(shift)
+    # sweep both teams at once, so each interval is split by strength in the
+    # same pass (the merged table is sorted by start time)
+    merged_shifts = nhl_shift_table.merge_shift_tables(shifts)
 
-    return icetime
+    deployment_state = advance_deployments(
+        new_deployment_state(shifts, goalie_ids),
+        merged_shifts["start"].tolist(),
+        merged_shifts["end"].tolist(),
+        merged_shifts["player_ids"][merged_shifts["player"]].tolist(),
+        merged_shifts["team"].tolist(),
+    )
+    finish_deployments(deployment_state)
+
+    deployments = {}
+    for team_id, team_icetime in deployment_state["icetime"].items():
+        deployments[team_id] = get_team_deployments(deployment_state, team_id)
+        for strength_icetime in team_icetime.values():
+            nhl_metrics.incr("deployments", len(strength_icetime))
+
+    return deployments
 
 
 def determine_forward_positions(line, roster, player_stats):
@@ -432,101 +869,157 @@ def determine_forward_positions(line, roster, player_stats):
     return forward_positions
 
 
-def calculate_lines(toi_deployments, players, player_stats):
+def get_position_masks(player_ids, players):
+
+    # one mask per position group, so a line splits into forwards and defense
+    # with a couple of ands (players from the other team are in neither)
+    position_masks = {"F": 0, "D": 0, "G": 0}
+    for k, player_id in enumerate(player_ids):
+        if player_id not in players:
+            continue
+
+        position = players[player_id]["position"]
+        if position == "G":
+            position_masks["G"] |= 1 << k
+        elif position == "D":
+            position_masks["D"] |= 1 << k
+        else:
+            position_masks["F"] |= 1 << k
+
+    return position_masks
+
+
+def calculate_lines(team_deployments, players, player_stats):
+
+    player_ids = team_deployments["player_ids"]
+    position_masks = get_position_masks(player_ids, players)
+
+    lines_info = []
+
+    for state, line_shape in LINE_STATES.items():
+        print("{} lines:".format(state))
+        lines_info.extend(
+            calculate_state_lines(
+                team_deployments["icetime"].get(line_shape["strength"], {}),
+                player_ids,
+                position_masks,
+                players,
+                player_stats,
+                state,
+                line_shape,
+            )
+        )
+
+    return lines_info
+
+
+def calculate_state_lines(
+    toi_deployments,
+    player_ids,
+    position_masks,
+    players,
+    player_stats,
+    state,
+    line_shape,
+):
+
+    forward_mask = position_masks["F"]
+    defense_mask = position_masks["D"]
 
     forward_lines = {}
     defense_lines = {}
 
-    all_forwards = set()
-    all_defense = set()
+    all_forwards = 0
+    all_defense = 0
 
     for deployment, toi in toi_deployments.items():
 
-        forwards = set()
-        defense = set()
-        for player_id in deployment:
-            # name = players[player_id]['name']
-            position = players[player_id]["position"]
-            if position == "G":
-                # goalie, we don't care
-                continue
-            elif position == "D":
-                # defense, find partner
-                defense.add(player_id)
-                all_defense.add(player_id)
-            else:
-                # forward, find linemates
-                forwards.add(player_id)
-                all_forwards.add(player_id)
-
-        if len(defense) == 2:
-            frozen_defense = frozenset(defense)
-            if frozen_defense in defense_lines:
-                defense_lines[frozen_defense] += toi
+        # forwards find linemates, defense find partners, goalies we don't care
+        forwards = deployment & forward_mask
+        defense = deployment & defense_mask
+        all_forwards |= forwards
+        all_defense |= defense
+
+        if bin(defense).count("1") in line_shape["defense"]:
+            if defense in defense_lines:
+                defense_lines[defense] += toi
             else:
-                defense_lines[frozen_defense] = toi
+                defense_lines[defense] = toi
 
-        if len(forwards) == 3:
-            frozen_forwards = frozenset(forwards)
-            if frozen_forwards in forward_lines:
-                forward_lines[frozen_forwards] += toi
+        if bin(forwards).count("1") in line_shape["forwards"]:
+            if forwards in forward_lines:
+                forward_lines[forwards] += toi
             else:
-                forward_lines[frozen_forwards] = toi
+                forward_lines[forwards] = toi
 
     sorted_forward_lines = sorted(
         forward_lines.items(), key=lambda kv: kv[1], reverse=True
     )
 
-    pprint.pprint(sorted_forward_lines)
+    pprint.pprint(
+        [
+            (list(get_line_players(line, player_ids)), toi)
+            for line, toi in sorted_forward_lines
+        ]
+    )
+
+    # players left over are stacked up to the deepest line
+    max_depth = max(line_shape["forward_lines"], line_shape["defense_pairs"])
 
     lines_info = []
     depth = 1
-    assigned_forwards = set()
+    assigned_forwards = 0
     for forward_line, toi in sorted_forward_lines:
-        if depth == 5:
+        if depth > line_shape["forward_lines"]:
             break
 
-        # ensure that there is no intersection between these sets so we don't re-use players
-        if len(assigned_forwards.intersection(forward_line)) is not 0:
+        # ensure that there is no intersection between these lines so we don't re-use players
+        if assigned_forwards & forward_line:
             continue
 
+        forward_players = list(get_line_players(forward_line, player_ids))
         line_positions = determine_forward_positions(
-            forward_line, players, player_stats
+            forward_players, players, player_stats
         )
-        for player_id in forward_line:
+        for player_id in forward_players:
             info = {
                 "player_id": player_id,
                 "depth": depth,
                 "toi": toi,
-                "position": line_positions[player_id],
-                "state": "EVEN",
+                # a fourth forward on the power play keeps his roster position
+                "position": line_positions.get(
+                    player_id, players[player_id]["position"]
+                ),
+                "state": state,
             }
             lines_info.append(info)
-            assigned_forwards.add(player_id)
             print(
                 "{} ({}),".format(players[player_id]["name"], info["position"]), end=" "
             )
+        assigned_forwards |= forward_line
         depth += 1
         print("")
 
-    # if we didn't have four separate lines
-    while depth > 1 and depth < 5:
-        remaining_forwards = all_forwards.difference(assigned_forwards)
+    # if we didn't have four separate lines (or two units)
+    while depth > 1 and depth <= max_depth:
+        remaining_forwards = get_line_players(
+            all_forwards & ~assigned_forwards, player_ids
+        )
         if len(remaining_forwards) > 0:
             line_positions = determine_forward_positions(
                 remaining_forwards, players, player_stats
             )
-            for player_id in remaining_forwards:
+            for player_id, bit in remaining_forwards.items():
                 if player_id in line_positions:
                     info = {
                         "player_id": player_id,
                         "depth": depth,
                         "toi": toi,
                         "position": line_positions[player_id],
-                        "state": "EVEN",
+                        "state": state,
                     }
                     lines_info.append(info)
-                    assigned_forwards.add(player_id)
+                    assigned_forwards |= bit
                     print(
                         "{} ({}),".format(players[player_id]["name"], info["position"]),
                         end=" ",
@@ -538,56 +1031,62 @@ def calculate_lines(toi_deployments, players, player_stats):
         defense_lines.items(), key=lambda kv: kv[1], reverse=True
     )
 
-    pprint.pprint(sorted_defense_lines)
+    pprint.pprint(
+        [
+            (list(get_line_players(line, player_ids)), toi)
+            for line, toi in sorted_defense_lines
+        ]
+    )
 
     depth = 1
-    assigned_defense = set()
+    assigned_defense = 0
     for defense_line, toi in sorted_defense_lines:
-        if depth == 4:
+        if depth > line_shape["defense_pairs"]:
             break
 
-        # ensure that there is no intersection between these sets so we don't re-use players
-        if len(assigned_defense.intersection(defense_line)) is not 0:
+        # ensure that there is no intersection between these lines so we don't re-use players
+        if assigned_defense & defense_line:
             continue
 
-        for player_id in defense_line:
+        for player_id in get_line_players(defense_line, player_ids):
             info = {
                 "player_id": player_id,
                 "depth": depth,
                 "toi": toi,
                 "position": players[player_id]["position"],
-                "state": "EVEN",
+                "state": state,
             }
             lines_info.append(info)
-            assigned_defense.add(player_id)
             print("{},".format(players[player_id]["name"]), end=" ")
+        assigned_defense |= defense_line
         depth += 1
         print("")
 
     # if we didn't have three separate lines
-    while depth > 1 and depth < 5:
-        remaining_defense = all_defense.difference(assigned_defense)
-        for player_id in remaining_defense:
+    while depth > 1 and depth <= max_depth:
+        remaining_defense = all_defense & ~assigned_defense
+        for player_id in get_line_players(remaining_defense, player_ids):
             info = {
                 "player_id": player_id,
                 "depth": depth,
                 "toi": toi,
                 "position": players[player_id]["position"],
-                "state": "EVEN",
+                "state": state,
             }
             lines_info.append(info)
-            assigned_defense.add(player_id)
             print("{},".format(players[player_id]["name"]), end=" ")
+        assigned_defense |= remaining_defense
         depth += 1
         print("")
 
     return lines_info
 
 
-def write_lines_to_database(game_id, team_id, line_info):
-    # ensure we have new data
-    if not line_info:
-        return
+def connect_to_database():
+
+    # imported here, runs that never write (and the process pool's workers)
+    # start without it
+    import psycopg2
 
     # set up postgres connection
     parse.uses_netloc.append("postgres")
@@ -601,134 +1100,1037 @@ def write_lines_to_database(game_id, team_id, line_info):
         port=url.port,
     )
 
-    cur = conn.cursor()
+    return conn
+
+
+def write_lines_to_database(conn, game_lines, game_dates, game_hashes=None):
+
+    # tables are in create_lines.sql
+
+    # build a tab separated COPY payload for every game and team
+    buffer = io.StringIO()
+    rows = 0
+    for game_id, team_lines in game_lines.items():
+        for team_id, line_info in team_lines.items():
+            for line in line_info:
+                buffer.write(
+                    "{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(
+                        game_id,
+                        line["player_id"],
+                        team_id,
+                        line["position"],
+                        line["depth"],
+                        line["state"],
+                        line["toi"],
+                    )
+                )
+                rows += 1
+
+    # ensure we have new data
+    if rows == 0:
+        return
+
+    buffer.seek(0)
+
+    # the season and date each game counts towards in the aggregates
+    games_buffer = io.StringIO()
+    for game_id in game_lines:
+        games_buffer.write(
+            "{}\t{}\t{}\n".format(
+                game_id, get_season_from_gameid(game_id), game_dates[game_id]
+            )
+        )
+    games_buffer.seek(0)
+
+    # load into staging tables and swap the games in within a single
+    # transaction, so readers see either the old lines or the new lines (and
+    # totals), never a mix
+    with stage("db_write"), conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """CREATE TEMP TABLE lines_staging (LIKE lines INCLUDING DEFAULTS)
+                   ON COMMIT DROP"""
+            )
+            cur.execute(
+                """CREATE TEMP TABLE games_staging (
+                       game_id integer PRIMARY KEY,
+                       season integer NOT NULL,
+                       game_date date NOT NULL
+                   ) ON COMMIT DROP"""
+            )
+
+            cur.copy_expert(
+                """COPY lines_staging(game_id, player_id, team_id, position, depth, state, time_on_ice)
+                   FROM STDIN""",
+                buffer,
+            )
+            cur.copy_expert(
+                "COPY games_staging(game_id, season, game_date) FROM STDIN",
+                games_buffer,
+            )
 
-    # CREATE TABLE lines (
-    #     game_id integer,
-    #     player_id integer,
-    #     team_id integer NOT NULL,
-    #     position character varying(5) NOT NULL,
-    #     depth integer,
-    #     state character varying(5),
-    #     time_on_ice integer NOT NULL,
-    #     CONSTRAINT lines_pkey PRIMARY KEY (game_id, player_id, depth, state)
-    # );
+            # a game written before (a re-run, or every poll in live mode)
+            # comes back out of the season totals before it goes back in
+            cur.execute(
+                """CREATE TEMP TABLE previous_lines ON COMMIT DROP AS
+                   SELECT season, team_id, state, unit, player_ids,
+                          SUM(time_on_ice) AS time_on_ice, COUNT(*) AS games
+                   FROM line_games
+                   WHERE (game_id, team_id) IN (
+                       SELECT DISTINCT game_id, team_id FROM lines_staging
+                   )
+                   GROUP BY season, team_id, state, unit, player_ids"""
+            )
+            cur.execute(
+                """UPDATE line_totals
+                   SET time_on_ice = line_totals.time_on_ice - previous.time_on_ice,
+                       games = line_totals.games - previous.games
+                   FROM previous_lines previous
+                   WHERE line_totals.season = previous.season
+                     AND line_totals.team_id = previous.team_id
+                     AND line_totals.state = previous.state
+                     AND line_totals.unit = previous.unit
+                     AND line_totals.player_ids = previous.player_ids"""
+            )
+            cur.execute(
+                """DELETE FROM line_totals
+                   WHERE games <= 0
+                     AND team_id IN (SELECT DISTINCT team_id FROM lines_staging)"""
+            )
 
-    # Add game_id=%s when we expand to display multiple lines for different games
-    delete_sql = """DELETE FROM lines WHERE team_id=%s"""
+            cur.execute(
+                """DELETE FROM line_games
+                   WHERE (game_id, team_id) IN (
+                       SELECT DISTINCT game_id, team_id FROM lines_staging
+                   )"""
+            )
+            cur.execute(
+                """DELETE FROM lines
+                   WHERE (game_id, team_id) IN (
+                       SELECT DISTINCT game_id, team_id FROM lines_staging
+                   )"""
+            )
+            rows_deleted = cur.rowcount
 
-    # execute the DELETE statement
-    cur.execute(delete_sql, [team_id])
+            cur.execute(
+                """INSERT INTO lines(game_id, player_id, team_id, position, depth, state, time_on_ice)
+                   SELECT game_id, player_id, team_id, position, depth, state, time_on_ice
+                   FROM lines_staging"""
+            )
 
-    # get the number of deleted rows
-    rows_deleted = cur.rowcount
+            # group each line's players back into a combination
+            cur.execute(
+                """INSERT INTO line_games(game_id, team_id, season, game_date, state, unit, depth, player_ids, time_on_ice)
+                   SELECT lines_staging.game_id,
+                          lines_staging.team_id,
+                          games_staging.season,
+                          games_staging.game_date,
+                          lines_staging.state,
+                          CASE WHEN lines_staging.position = 'D' THEN 'D' ELSE 'F' END,
+                          lines_staging.depth,
+                          array_agg(lines_staging.player_id ORDER BY lines_staging.player_id),
+                          MAX(lines_staging.time_on_ice)
+                   FROM lines_staging
+                   JOIN games_staging USING (game_id)
+                   GROUP BY 1, 2, 3, 4, 5, 6, 7"""
+            )
+
+            cur.execute(
+                """INSERT INTO line_totals(season, team_id, state, unit, player_ids, time_on_ice, games, last_game_id, last_seen)
+                   SELECT season, team_id, state, unit, player_ids,
+                          SUM(time_on_ice), COUNT(*), MAX(game_id), MAX(game_date)
+                   FROM line_games
+                   WHERE (game_id, team_id) IN (
+                       SELECT DISTINCT game_id, team_id FROM lines_staging
+                   )
+                   GROUP BY season, team_id, state, unit, player_ids
+                   ON CONFLICT (season, team_id, state, unit, player_ids) DO UPDATE
+                   SET time_on_ice = line_totals.time_on_ice + EXCLUDED.time_on_ice,
+                       games = line_totals.games + EXCLUDED.games,
+                       last_game_id = GREATEST(line_totals.last_game_id, EXCLUDED.last_game_id),
+                       last_seen = GREATEST(line_totals.last_seen, EXCLUDED.last_seen)"""
+            )
+            totals_upserted = cur.rowcount
+
+            # the lines those games used to have may have been last seen in
+            # one of them, take the latest game each still has instead
+            cur.execute(
+                """UPDATE line_totals
+                   SET last_game_id = latest.last_game_id,
+                       last_seen = latest.last_seen
+                   FROM (
+                       SELECT season, team_id, state, unit, player_ids,
+                              MAX(line_games.game_id) AS last_game_id,
+                              MAX(line_games.game_date) AS last_seen
+                       FROM line_games
+                       JOIN previous_lines USING (season, team_id, state, unit, player_ids)
+                       GROUP BY season, team_id, state, unit, player_ids
+                   ) latest
+                   WHERE line_totals.season = latest.season
+                     AND line_totals.team_id = latest.team_id
+                     AND line_totals.state = latest.state
+                     AND line_totals.unit = latest.unit
+                     AND line_totals.player_ids = latest.player_ids"""
+            )
+
+            # what these lines were computed from, games written without a
+            # hash (live mode) have to be recomputed on their next run
+            cur.execute(
+                """DELETE FROM game_inputs
+                   WHERE game_id IN (SELECT game_id FROM games_staging)"""
+            )
+            for game_id in game_lines:
+                if game_hashes and game_id in game_hashes:
+                    cur.execute(
+                        """INSERT INTO game_inputs(game_id, input_hash, algorithm_version)
+                           VALUES (%s, %s, %s)""",
+                        (game_id, game_hashes[game_id], ALGORITHM_VERSION),
+                    )
+
+            # delivered to listeners only once (and if) this commits
+            cur.execute(
+                "SELECT pg_notify(%s, %s)",
+                (LINES_CHANNEL, ",".join(str(game_id) for game_id in game_lines)),
+            )
+
+    nhl_metrics.incr("rows_deleted", rows_deleted)
+    nhl_metrics.incr("rows_written", rows)
+    nhl_metrics.incr("line_totals_upserted", totals_upserted)
 
     print(
-        "DELETED {} rows from the lines table for team_id={}".format(
-            rows_deleted, team_id
+        "REPLACED {} rows with {} rows in the lines table for {} games, {} line totals updated".format(
+            rows_deleted, rows, len(game_lines), totals_upserted
         )
     )
 
-    sql = """INSERT INTO lines(game_id, player_id, team_id, position, depth, state, time_on_ice)
-             VALUES(%s, %s, %s, %s, %s, %s, %s);"""
 
-    for line in line_info:
-        depth = line["depth"]
-        toi = line["toi"]
-        position = line["position"]
-        player_id = line["player_id"]
-        state = line["state"]
+def get_checkpoint_path(
+    season, start_date, end_date, write_to_database, write_to_archive
+):
 
-        print(
-            "INSERTING game_id={} team_id={} player_id={} depth={} toi={} position={} state={}".format(
-                game_id, team_id, player_id, depth, toi, position, state
-            )
+    # a checkpoint per season or range and per output, so a run that doesn't
+    # write lines (or archive them) never marks games done for one that does
+    outputs = []
+    if write_to_database:
+        outputs.append("lines")
+    if write_to_archive:
+        outputs.append("archive")
+
+    # a run that keeps nothing has nothing to resume
+    if not outputs:
+        return None
+
+    name = season or "{}-{}".format(start_date or end_date, end_date or start_date)
+
+    return "backfill-{}-{}.checkpoint".format(name, "-".join(outputs))
+
+
+def read_checkpoint(checkpoint_path):
+
+    # one completed game_id per line, a missing file means nothing is done yet
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return set()
+
+    with open(checkpoint_path) as f:
+        return {int(line) for line in f if line.strip()}
+
+
+def record_checkpoint(checkpoint_path, game_id):
+    with open(checkpoint_path, "a") as f:
+        f.write("{}\n".format(game_id))
+
+
+def fetch_game_sources(games, concurrency):
+
+    # fetch the rosters, live feeds and shift charts for every game at once
+    game_urls = {}
+    final_urls = []
+    for game_id, teams in games.items():
+        game_urls[game_id] = get_game_urls(game_id, teams)
+        final_urls.extend(get_final_game_urls(game_id, teams))
+
+    with stage("fetch"):
+        responses = nhl_fetch.fetch_urls(
+            [url for urls in game_urls.values() for url in urls.values()],
+            concurrency,
+            final_urls,
         )
 
-        # execute the INSERT statement
-        cur.execute(sql, (game_id, player_id, team_id, position, depth, state, toi))
+    # workers read each game's responses straight from the cache, a game
+    # missing any of them is skipped (and picked up again by a later run)
+    game_sources = {}
+    for game_id, urls in game_urls.items():
+        failed_urls = [url for url in urls.values() if url not in responses]
+        if failed_urls:
+            print(
+                "Error: skipping game_id={}, failed to fetch {}".format(
+                    game_id, ", ".join(failed_urls)
+                )
+            )
+            nhl_metrics.incr("games_failed")
+            continue
 
-    # close communication with the PostgreSQL database server
-    cur.close()
-    # commit the changes
-    conn.commit()
+        game_sources[game_id] = {name: responses[url] for name, url in urls.items()}
 
+    return game_sources
 
-# read commandline arguments, first
-fullCmdArguments = sys.argv
 
-# - further arguments
-argumentList = fullCmdArguments[1:]
+def calculate_game_lines(
+    home_id, away_id, shifts, home_players, away_players, player_stats
+):
 
-unixOptions = "d:hvw"
-gnuOptions = ["date=", "help", "verbose", "write"]
+    # duplicate, empty and overlapping shifts would each count as deployments
+    with stage("repair"):
+        shifts = repair_shifts({home_id: shifts[home_id], away_id: shifts[away_id]})
 
-try:
-    arguments, values = getopt.getopt(argumentList, unixOptions, gnuOptions)
-except getopt.error as err:
-    # output error, and return with an error code
-    print(str(err))
-    sys.exit(2)
+    # both teams are swept together, so every deployment knows its strength
+    with stage("deployments"):
+        toi_deploy = calculate_toi_deployments(
+            shifts, get_goalie_ids(home_players, away_players)
+        )
 
-# evaluate given options
-date = ""
-write_to_database = False
-for currentArgument, currentValue in arguments:
-    if currentArgument in ("-v", "--verbose"):
-        print("enabling verbose mode")
-    elif currentArgument in ("-h", "--help"):
-        print("displaying help")
-    elif currentArgument in ("-w", "--write"):
-        print("enabling write (to database) mode")
-        write_to_database = True
-    elif currentArgument in ("-d", "--date"):
-        print(("using specified date: (%s)") % (currentValue))
-        date = currentValue
+    with stage("lines"):
+        home_line_info = calculate_lines(
+            toi_deploy[home_id], home_players, player_stats
+        )
+        away_line_info = calculate_lines(
+            toi_deploy[away_id], away_players, player_stats
+        )
+
+    return {home_id: home_line_info, away_id: away_line_info}
+
+
+def hash_game_inputs(game):
+
+    # a hash of exactly what the lines are computed from (an archived game,
+    # see process_game), so a roster move elsewhere on the team or a new
+    # timestamp in the live feed doesn't count as a change
+    digest = hashlib.sha1()
+    for team_id, shift_table in sorted(game["shifts"].items()):
+        digest.update(str(team_id).encode())
+        for column in ("player_ids", "player", "period", "start", "end"):
+            digest.update(shift_table[column].tobytes())
+
+        # a player missing from the roster is left out of the lines, which
+        # isn't the same as being on it with no position
+        players = game["players"][team_id]
+        for player_id in shift_table["player_ids"].tolist():
+            if player_id in players:
+                player = "rostered\t{}\t{}".format(
+                    players[player_id]["name"], players[player_id]["position"]
+                )
+            else:
+                player = "unrostered"
+            digest.update(
+                "{}\t{}\t{}\n".format(
+                    player_id,
+                    player,
+                    game["player_stats"].get(player_id, {}).get("faceoffTaken", 0),
+                ).encode()
+            )
+
+    return digest.hexdigest()
 
 
-# get the games for today
-todays_games = get_games_on_date(date)
+def read_game_hashes(conn, game_ids):
 
-games = 1
+    # the input hash each game's lines were last written from, by this
+    # version of the algorithm (in a transaction of its own, so the
+    # connection isn't left idle in one when nothing gets written)
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT game_id, input_hash FROM game_inputs
+                   WHERE game_id = ANY(%s) AND algorithm_version = %s""",
+                (list(game_ids), ALGORITHM_VERSION),
+            )
+            return dict(cur.fetchall())
 
-# for each game, get the players and their shifts
-for game_id, teams in todays_games.items():
 
-    # limit to one game for testing
-    # if games > 1:
-    #    break
+def process_game(game_id, teams, sources, known_hash=None):
 
     print(game_id)
     home_id = teams["home"]
     away_id = teams["away"]
 
-    home_players = get_records_team_players(home_id)
-    away_players = get_records_team_players(away_id)
+    with stage("parse"):
+        with nhl_cache.open_body(sources["home_players"]) as f:
+            home_players = parse_records_team_players(json.load(f))
+        with nhl_cache.open_body(sources["away_players"]) as f:
+            away_players = parse_records_team_players(json.load(f))
 
-    player_stats = get_player_stats_for_game(game_id)
+        with nhl_cache.open_body(sources["live_feed"]) as f:
+            player_stats = parse_player_stats(f)
 
-    shift_charts_url = get_shift_charts_url(game_id)
-    shifts = parse_shift_charts(shift_charts_url)
+        with nhl_cache.open_body(sources["shift_charts"]) as f:
+            shifts = parse_shift_charts_data(f)
 
     if not shifts:
         # some games don't have shifts in the response
-        continue
-        
-    home_shifts = shifts[home_id]
-    away_shifts = shifts[away_id]
+        print("No shifts for game_id={}, skipping".format(game_id))
+        return None, None, None
+
+    # and some only have one team's (a partial chart), skipped until it's whole
+    missing_team_ids = [
+        team_id for team_id in (home_id, away_id) if team_id not in shifts
+    ]
+    if missing_team_ids:
+        print(
+            "Error: skipping game_id={}, no shifts for team_id={}".format(
+                game_id, ",".join(str(team_id) for team_id in missing_team_ids)
+            )
+        )
+        nhl_metrics.incr("games_failed")
+        return None, None, None
+
+    # everything the lines are built from, for the shift archive
+    archived_game = {
+        "date": teams["date"],
+        "shifts": {home_id: shifts[home_id], away_id: shifts[away_id]},
+        "players": {home_id: home_players, away_id: away_players},
+        "player_stats": player_stats,
+    }
+
+    # nothing has changed since these lines were last written (the game is
+    # still returned, it may not have been archived yet)
+    input_hash = hash_game_inputs(archived_game)
+    if input_hash == known_hash:
+        return None, archived_game, input_hash
+
+    team_lines = calculate_game_lines(
+        home_id, away_id, shifts, home_players, away_players, player_stats
+    )
 
-    home_toi_deploy = calculate_toi_deployments(home_shifts)
-    home_line_info = calculate_lines(home_toi_deploy, home_players, player_stats)
+    return team_lines, archived_game, input_hash
+
+
+def measure_game(game_id, teams, sources, known_hash=None):
+
+    # set aside whatever was recorded before (the parent's own metrics when
+    # run inline, or a copy inherited from the parent in a worker) so only
+    # this game's metrics go back with its lines
+    previous_metrics = nhl_metrics.collect()
+    try:
+        with nhl_profile.label(game_id):
+            game_result = process_game(game_id, teams, sources, known_hash)
+    except Exception as err:
+        # one bad game is skipped rather than taking the rest of the batch
+        # (and every resumed backfill) down with it, it isn't checkpointed so
+        # a later run tries it again
+        print("Error: skipping game_id={}, {!r}".format(game_id, err))
+        nhl_metrics.incr("games_failed")
+        game_result = (None, None, None)
+    finally:
+        game_metrics = nhl_metrics.collect()
+        nhl_metrics.merge(previous_metrics)
+
+    return game_result + (game_metrics,)
+
+
+def process_games(
+    games, concurrency, conn=None, pool=None, checkpoint_path=None, archive=None
+):
+    game_sources = fetch_game_sources(games, concurrency)
+    games = {game_id: games[game_id] for game_id in game_sources}
+
+    # games whose lines are already in the database, to skip if unchanged
+    known_hashes = {}
+    if conn is not None:
+        known_hashes = read_game_hashes(conn, games)
+
+    # games already archived, an unchanged game is only archived if it isn't
+    archived_game_ids = set()
+    if archive is not None:
+        for season in {get_season_from_gameid(game_id) for game_id in games}:
+            archived_game_ids.update(archive.game_ids(season))
+
+    # compute the lines in the process pool when we have one, otherwise inline
+    if pool is None:
+        mapper = map
+    else:
+        mapper = pool.map
+
+    game_ids = list(games)
+    results = mapper(
+        measure_game,
+        game_ids,
+        [games[game_id] for game_id in game_ids],
+        [game_sources[game_id] for game_id in game_ids],
+        [known_hashes.get(game_id) for game_id in game_ids],
+    )
 
-    # write the home lines to the LINES table in Postgresql
-    if write_to_database:
-        write_lines_to_database(game_id, home_id, home_line_info)
+    game_lines = {}
+    archived_games = {}
+    game_hashes = {}
+    unchanged_game_ids = []
+    for game_id, (team_lines, archived_game, input_hash, game_metrics) in zip(
+        game_ids, results
+    ):
+        nhl_metrics.merge(game_metrics)
+        nhl_metrics.incr("games_processed")
+
+        # no shifts, or the game failed (see measure_game)
+        if input_hash is None:
+            continue
+
+        if team_lines is None:
+            print("No changes for game_id={}, skipping".format(game_id))
+            nhl_metrics.incr("games_unchanged")
+            unchanged_game_ids.append(game_id)
+            if game_id not in archived_game_ids:
+                archived_games[game_id] = archived_game
+            continue
+
+        game_lines[game_id] = team_lines
+        archived_games[game_id] = archived_game
+        game_hashes[game_id] = input_hash
+
+    # keep the parsed shifts so the lines can be rebuilt without the network
+    if archive is not None and archived_games:
+        with stage("archive"):
+            archive.write_games(archived_games)
+        nhl_metrics.incr("games_archived", len(archived_games))
+
+    # write the home and away lines to the LINES table in Postgresql
+    if conn is not None:
+        write_lines_to_database(
+            conn,
+            game_lines,
+            {game_id: games[game_id]["date"] for game_id in game_lines},
+            game_hashes,
+        )
+
+    # only mark games as done once their lines are committed (or archived),
+    # a run that kept nothing hasn't done them
+    if checkpoint_path and (conn is not None or archive is not None):
+        for game_id in list(game_lines) + unchanged_game_ids:
+            record_checkpoint(checkpoint_path, game_id)
+
+
+def backfill(games, concurrency, conn, jobs, checkpoint_path, archive=None):
+
+    # resume where a previous run stopped
+    completed = read_checkpoint(checkpoint_path)
+
+    games_by_date = {}
+    for game_id, teams in games.items():
+        if game_id in completed:
+            continue
+        games_by_date.setdefault(teams["date"], {})[game_id] = teams
+
+    print(
+        "backfilling {} games ({} already completed) with {} processes".format(
+            sum(len(date_games) for date_games in games_by_date.values()),
+            len(completed),
+            jobs,
+        )
+    )
+
+    # fetch a date at a time so only one night of responses is held in memory
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=nhl_profile.enable,
+        initargs=(nhl_profile.profile_directory,),
+    ) as pool:
+        for date in sorted(games_by_date):
+            print("backfilling date: {}".format(date))
+            process_games(
+                games_by_date[date],
+                concurrency,
+                conn,
+                pool,
+                checkpoint_path,
+                archive,
+            )
+
+    # each date was archived as a part of its own, leave each season as one
+    if archive is not None:
+        with stage("archive"):
+            for season in sorted(
+                {get_season_from_gameid(game_id) for game_id in games}
+            ):
+                archive.compact(season)
+
+
+def rebuild_season_lines(archive, season, conn):
+
+    # recompute a season's lines from the shift archive alone, no requests
+    game_ids = archive.game_ids(season)
+    print("rebuilding lines for {} archived games in {}".format(len(game_ids), season))
+
+    # write a date at a time, like a backfill does
+    games_by_date = {}
+    game_hashes = {}
+    for game_id, game in archive.iter_season(season):
+        print(game_id)
+
+        # the lines don't depend on which of the two teams was at home
+        home_id, away_id = game["shifts"]
+
+        team_lines = calculate_game_lines(
+            home_id,
+            away_id,
+            game["shifts"],
+            game["players"][home_id],
+            game["players"][away_id],
+            game["player_stats"],
+        )
+        nhl_metrics.incr("games_processed")
+
+        games_by_date.setdefault(game["date"], {})[game_id] = team_lines
+        game_hashes[game_id] = hash_game_inputs(game)
+
+    if conn is not None:
+        for date in sorted(games_by_date):
+            write_lines_to_database(
+                conn,
+                games_by_date[date],
+                {game_id: date for game_id in games_by_date[date]},
+                game_hashes,
+            )
+
+
+def new_live_game_state(team_ids, goalie_ids):
 
-    away_toi_deploy = calculate_toi_deployments(away_shifts)
-    away_line_info = calculate_lines(away_toi_deploy, away_players, player_stats)
+    live_game_state = {
+        # every shift seen so far, in case one arrives out of order
+        "shifts": [],
+        # completed shifts not swept yet, held back until every skater shift
+        # starting before them has ended
+        "held_shifts": [],
+        # goalie shifts swept while still in progress, (player_id, start) ->
+        # team_id, their end is filled in once it arrives
+        "open_goalie_shifts": {},
+        # the shifts in progress on the last poll, and the latest time seen
+        "open_shifts": [],
+        "clock": 0,
+        "deployment_state": new_deployment_state(team_ids, goalie_ids),
+        "line_info": {},
+    }
 
-    # write the away lines to the LINES table in Postgresql
+    return live_game_state
+
+
+def close_open_shift(deployment_state, player_id, end):
+
+    # give a shift swept while in progress (ending at infinity) its end, as
+    # long as the sweep hasn't gone past it already
+    if end < deployment_state["current_toi"]:
+        return False
+
+    bit = deployment_state["player_bits"][player_id]
+    ending_shifts = deployment_state["ending_shifts"]
+    for i, (shift_end, shift_bit, team_id) in enumerate(ending_shifts):
+        if shift_bit == bit and shift_end == float("inf"):
+            ending_shifts[i] = (end, bit, team_id)
+            heapq.heapify(ending_shifts)
+            return True
+
+    return False
+
+
+def take_ready_shifts(live_game_state, watermark):
+
+    # the held shifts starting before the watermark, and the goalie shifts in
+    # progress that haven't been swept yet, sorted by start time
+    goalie_ids = live_game_state["deployment_state"]["goalie_ids"]
+    held_shifts = live_game_state["held_shifts"]
+    open_goalie_shifts = live_game_state["open_goalie_shifts"]
+
+    ready_shifts = [shift for shift in held_shifts if shift[0] < watermark]
+    held_shifts[:] = [shift for shift in held_shifts if shift[0] >= watermark]
+
+    for start, player_id, team_id in live_game_state["open_shifts"]:
+        if (
+            player_id in goalie_ids
+            and start < watermark
+            and (player_id, start) not in open_goalie_shifts
+        ):
+            ready_shifts.append((start, float("inf"), player_id, team_id))
+            open_goalie_shifts[(player_id, start)] = team_id
+
+    return sorted(ready_shifts, key=operator.itemgetter(0))
+
+
+def update_live_game(live_game_state, new_shifts, open_shifts):
+    changed = bool(new_shifts) or open_shifts != live_game_state["open_shifts"]
+
+    live_game_state["shifts"].extend(new_shifts)
+    live_game_state["open_shifts"] = open_shifts
+    live_game_state["clock"] = max(
+        [live_game_state["clock"]]
+        + [shift[1] for shift in new_shifts]
+        + [shift[0] for shift in open_shifts]
+    )
+
+    deployment_state = live_game_state["deployment_state"]
+    open_goalie_shifts = live_game_state["open_goalie_shifts"]
+
+    # goalie shifts that were swept in progress and have now ended
+    replay = False
+    for shift in new_shifts:
+        start, end, player_id, _ = shift
+        if open_goalie_shifts.pop((player_id, start), None) is not None:
+            replay |= not close_open_shift(deployment_state, player_id, end)
+        else:
+            live_game_state["held_shifts"].append(shift)
+
+    # or that ended without a shift we could match them up with
+    if not {(player_id, start) for start, player_id, _ in open_shifts}.issuperset(
+        open_goalie_shifts
+    ):
+        replay = True
+
+    # a skater's shift in progress holds back every shift starting after it,
+    # so the sweep only moves past shifts that can't change any more, but a
+    # goalie's lasts the whole period so it's swept in progress instead
+    goalie_ids = deployment_state["goalie_ids"]
+    watermark = min(
+        [start for start, player_id, _ in open_shifts if player_id not in goalie_ids],
+        default=float("inf"),
+    )
+    ready_shifts = take_ready_shifts(live_game_state, watermark)
+
+    # a shift that starts before the sweep's position can't be added on (one
+    # the feed reported late), so replay everything we have
+    if ready_shifts and ready_shifts[0][0] < deployment_state["last_start"]:
+        replay = True
+
+    if replay:
+        print("shift arrived out of order, replaying the game's shifts")
+        nhl_metrics.incr("live_replays")
+        deployment_state = new_deployment_state(
+            deployment_state["team_ids"], deployment_state["goalie_ids"]
+        )
+        live_game_state["deployment_state"] = deployment_state
+        live_game_state["held_shifts"] = list(live_game_state["shifts"])
+        open_goalie_shifts.clear()
+        ready_shifts = take_ready_shifts(live_game_state, watermark)
+
+    if not ready_shifts:
+        return changed
+
+    starts, ends, player_ids, team_ids = zip(*ready_shifts)
+    advance_deployments(deployment_state, starts, ends, player_ids, team_ids)
+
+    return True
+
+
+def get_live_deployment_state(live_game_state):
+    deployment_state = live_game_state["deployment_state"]
+    held_shifts = live_game_state["held_shifts"]
+    open_goalie_shifts = live_game_state["open_goalie_shifts"]
+
+    # the skater shifts in progress, the goalie ones not swept yet, and those
+    # held back behind them
+    clock = live_game_state["clock"]
+    open_shifts = [
+        (start, clock, player_id, team_id)
+        for start, player_id, team_id in live_game_state["open_shifts"]
+        if (player_id, start) not in open_goalie_shifts
+    ]
+    if not open_shifts and not held_shifts and not open_goalie_shifts:
+        return deployment_state
+
+    # sweep them, running up to the latest time seen, on a copy of the
+    # completed sweep so the next poll carries on from where it was
+    live_deployment_state = copy.deepcopy(deployment_state)
+    live_deployment_state["ending_shifts"] = [
+        (min(end, clock), bit, team_id)
+        for end, bit, team_id in live_deployment_state["ending_shifts"]
+    ]
+    heapq.heapify(live_deployment_state["ending_shifts"])
+
+    shifts = sorted(held_shifts + open_shifts, key=operator.itemgetter(0))
+    if shifts:
+        starts, ends, player_ids, team_ids = zip(*shifts)
+        advance_deployments(live_deployment_state, starts, ends, player_ids, team_ids)
+
+    return finish_deployments(live_deployment_state)
+
+
+def run_live(game_id, concurrency, conn, poll_interval):
+
+    # imported here, cached_get imports it the same way
+    import requests
+
+    seen_shift_ids = set()
+    live_game_state = None
+
+    while True:
+
+        # like the rest of the poll, a failed schedule lookup is tried again
+        # rather than ending live mode
+        try:
+            teams = get_scheduled_games(get_game_schedule_url(game_id))[game_id]
+        except requests.RequestException as err:
+            print(
+                "Error: failed to fetch the schedule for game_id={}: {}".format(
+                    game_id, err
+                )
+            )
+            nhl_metrics.incr("http_failures")
+            time.sleep(poll_interval)
+            continue
+
+        sources = fetch_game_sources({game_id: teams}, concurrency).get(game_id)
+
+        # a failed fetch is tried again on the next poll
+        if sources is None:
+            time.sleep(poll_interval)
+            continue
+
+        with stage("parse"):
+            with nhl_cache.open_body(sources["home_players"]) as f:
+                home_players = parse_records_team_players(json.load(f))
+            with nhl_cache.open_body(sources["away_players"]) as f:
+                away_players = parse_records_team_players(json.load(f))
+
+            with nhl_cache.open_body(sources["live_feed"]) as f:
+                player_stats = parse_player_stats(f)
+
+            # only shifts we haven't seen on a previous poll, and the ones
+            # still in progress
+            with nhl_cache.open_body(sources["shift_charts"]) as f:
+                new_shifts, open_shifts = parse_new_shift_charts(f, seen_shift_ids)
+
+        if live_game_state is None:
+            live_game_state = new_live_game_state(
+                [teams["home"], teams["away"]],
+                get_goalie_ids(home_players, away_players),
+            )
+
+        with stage("deployments"):
+            updated = update_live_game(live_game_state, new_shifts, open_shifts)
+
+            # once the game is over the shifts still open have ended too
+            if teams["final"] and not open_shifts:
+                finish_deployments(live_game_state["deployment_state"])
+                updated = True
+
+            deployment_state = get_live_deployment_state(live_game_state)
+
+        changed_lines = {}
+        if updated:
+
+            for team_id, players in (
+                (teams["home"], home_players),
+                (teams["away"], away_players),
+            ):
+                with stage("lines"):
+                    line_info = calculate_lines(
+                        get_team_deployments(deployment_state, team_id),
+                        players,
+                        player_stats,
+                    )
+
+                # only push lines that actually moved
+                if line_info != live_game_state["line_info"].get(team_id):
+                    live_game_state["line_info"][team_id] = line_info
+                    changed_lines[team_id] = line_info
+
+        print(
+            "{} new shifts, lines changed for {} teams".format(
+                len(new_shifts), len(changed_lines)
+            )
+        )
+
+        # write the changed lines to the LINES table in Postgresql
+        if conn is not None and changed_lines:
+            write_lines_to_database(
+                conn, {game_id: changed_lines}, {game_id: teams["date"]}
+            )
+
+        if teams["final"]:
+            print("game_id={} is final, stopping".format(game_id))
+            break
+
+        time.sleep(poll_interval)
+
+
+def main():
+    # read commandline arguments, first
+    fullCmdArguments = sys.argv
+
+    # - further arguments
+    argumentList = fullCmdArguments[1:]
+
+    unixOptions = "c:d:hj:l:vw"
+    gnuOptions = [
+        "archive=",
+        "checkpoint=",
+        "concurrency=",
+        "date=",
+        "from=",
+        "from-archive=",
+        "help",
+        "interval=",
+        "jobs=",
+        "live=",
+        "metrics=",
+        "profile=",
+        "prometheus=",
+        "season=",
+        "to=",
+        "verbose",
+        "write",
+    ]
+
+    try:
+        arguments, values = getopt.getopt(argumentList, unixOptions, gnuOptions)
+    except getopt.error as err:
+        # output error, and return with an error code
+        print(str(err))
+        sys.exit(2)
+
+    # evaluate given options
+    date = ""
+    write_to_database = False
+    concurrency = nhl_fetch.DEFAULT_CONCURRENCY
+    start_date = ""
+    end_date = ""
+    season = ""
+    jobs = None
+    checkpoint_path = None
+    live_game_id = None
+    poll_interval = 30
+    metrics_path = None
+    prometheus_path = None
+    profile_directory = None
+    archive_directory = None
+    archive_season = ""
+    for currentArgument, currentValue in arguments:
+        if currentArgument in ("-v", "--verbose"):
+            print("enabling verbose mode")
+        elif currentArgument in ("-h", "--help"):
+            print("displaying help")
+        elif currentArgument in ("-w", "--write"):
+            print("enabling write (to database) mode")
+            write_to_database = True
+        elif currentArgument in ("-d", "--date"):
+            print(("using specified date: (%s)") % (currentValue))
+            date = currentValue
+        elif currentArgument in ("-c", "--concurrency"):
+            print(("using concurrency: (%s)") % (currentValue))
+            concurrency = int(currentValue)
+        elif currentArgument == "--from":
+            print(("backfilling from date: (%s)") % (currentValue))
+            start_date = currentValue
+        elif currentArgument == "--to":
+            print(("backfilling to date: (%s)") % (currentValue))
+            end_date = currentValue
+        elif currentArgument == "--season":
+            print(("backfilling season: (%s)") % (currentValue))
+            season = currentValue
+        elif currentArgument in ("-j", "--jobs"):
+            print(("using processes: (%s)") % (currentValue))
+            jobs = int(currentValue)
+        elif currentArgument == "--checkpoint":
+            print(("using checkpoint file: (%s)") % (currentValue))
+            checkpoint_path = currentValue
+        elif currentArgument in ("-l", "--live"):
+            print(("following live game: (%s)") % (currentValue))
+            live_game_id = int(currentValue)
+        elif currentArgument == "--interval":
+            print(("polling every (%s) seconds") % (currentValue))
+            poll_interval = float(currentValue)
+        elif currentArgument == "--metrics":
+            print(("writing metrics summary to: (%s)") % (currentValue))
+            metrics_path = currentValue
+        elif currentArgument == "--prometheus":
+            print(("writing prometheus metrics to: (%s)") % (currentValue))
+            prometheus_path = currentValue
+        elif currentArgument == "--profile":
+            print(("writing stage profiles to: (%s)") % (currentValue))
+            profile_directory = currentValue
+        elif currentArgument == "--archive":
+            print(("archiving shifts to: (%s)") % (currentValue))
+            archive_directory = currentValue
+        elif currentArgument == "--from-archive":
+            print(("rebuilding lines from archived season: (%s)") % (currentValue))
+            archive_season = currentValue
+
+    # summarize timings and counters however the run ends
+    atexit.register(nhl_metrics.report, metrics_path, prometheus_path)
+
+    # profile each game's stages, anything outside a game is written at exit
+    if profile_directory:
+        nhl_profile.enable(profile_directory)
+        atexit.register(nhl_profile.dump)
+
+    # hold a single database connection for the whole run
+    conn = None
     if write_to_database:
-        write_lines_to_database(game_id, away_id, away_line_info)
+        conn = connect_to_database()
+
+    # rebuilding from the archive reads the default one unless told otherwise
+    archive = None
+    if archive_directory or archive_season:
+        archive = nhl_archive.ShiftArchive(
+            archive_directory or nhl_archive.DEFAULT_ARCHIVE_DIR
+        )
+
+    if archive_season:
+        rebuild_season_lines(archive, archive_season, conn)
+        return
+
+    if live_game_id:
+        with nhl_profile.label(live_game_id):
+            run_live(live_game_id, concurrency, conn, poll_interval)
+        return
+
+    if season or start_date or end_date:
+        if season:
+            games = get_games_in_season(season)
+        else:
+            # a single --from or --to is a one day range
+            games = get_games_between_dates(
+                start_date or end_date, end_date or start_date
+            )
+
+        if checkpoint_path is None:
+            checkpoint_path = get_checkpoint_path(
+                season, start_date, end_date, conn is not None, archive is not None
+            )
+        if checkpoint_path:
+            print("using checkpoint file: ({})".format(checkpoint_path))
+
+        backfill(
+            games,
+            concurrency,
+            conn,
+            jobs or os.cpu_count(),
+            checkpoint_path,
+            archive,
+        )
+        return
+
+    # get the games for today
+    todays_games = get_games_on_date(date)
+
+    # and recheck the games that haven't settled yet for revised shift
+    # charts, the unchanged ones are skipped before any lines are computed
+    if not date and conn is not None:
+        today = datetime.date.today()
+        recent_games = get_games_between_dates(
+            (today - datetime.timedelta(days=SETTLE_DAYS)).isoformat(),
+            (today - datetime.timedelta(days=1)).isoformat(),
+        )
+        for game_id, teams in recent_games.items():
+            if teams["final"]:
+                todays_games.setdefault(game_id, teams)
+
+    # a single date runs inline unless asked for more processes
+    if jobs and jobs > 1:
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=nhl_profile.enable,
+            initargs=(nhl_profile.profile_directory,),
+        ) as pool:
+            process_games(todays_games, concurrency, conn, pool, archive=archive)
+    else:
+        process_games(todays_games, concurrency, conn, archive=archive)
+
 
-    games += 1
+if __name__ == "__main__":
+    main()